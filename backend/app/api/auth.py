@@ -3,12 +3,14 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.schemas import UserCreate, UserResponse
+from app import config
 from app.services.auth import (
     create_user, authenticate_user, create_access_token, 
-    verify_token, get_user_by_email, ACCESS_TOKEN_EXPIRE_MINUTES
+    resolve_token, get_user_by_email, AuthenticatedUser, PasswordHasherBusy,
+    ACCESS_TOKEN_EXPIRE_MINUTES
 )
 from app.models import User
 
@@ -17,33 +19,47 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 # OAuth2 setup for token-based authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
-    """Get the current authenticated user from JWT token."""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    payload = verify_token(token)
-    if payload is None:
-        raise credentials_exception
-    
-    email: str = payload.get("sub")
-    if email is None:
-        raise credentials_exception
-    
-    user = get_user_by_email(db, email=email)
+
+def _busy_exception() -> HTTPException:
+    """Password hashing is saturated - tell the client to come back shortly."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, please retry shortly",
+        headers={"Retry-After": str(config.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+    )
+
+async def get_current_identity(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> AuthenticatedUser:
+    """
+    Get the id/email of the caller from their JWT token.
+    Cheap: usually answered from the token cache without touching the database.
+    Use this for routes that only need to know *who* is calling.
+    """
+    identity = await resolve_token(db, token)
+    if identity is None:
+        raise _credentials_exception()
+    return identity
+
+async def get_current_user(
+    identity: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """Get the full User row of the caller (one primary-key lookup)."""
+    user = await db.get(User, identity.id)
     if user is None:
-        raise credentials_exception
-    
+        raise _credentials_exception()
     return user
 
 @router.post("/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user."""
     # Check if user already exists
-    existing_user = get_user_by_email(db, email=user.email)
+    existing_user = await get_user_by_email(db, email=user.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -51,13 +67,19 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    new_user = create_user(db, user)
+    try:
+        new_user = await create_user(db, user)
+    except PasswordHasherBusy:
+        raise _busy_exception()
     return new_user
 
 @router.post("/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """Login and get access token."""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordHasherBusy:
+        raise _busy_exception()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -67,7 +89,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "uid": user.id}, expires_delta=access_token_expires
     )
     
     return {
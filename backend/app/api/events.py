@@ -0,0 +1,143 @@
+# Events API endpoint - live compile status over Server-Sent Events
+#
+#   const events = new EventSource(`/events?token=${token}`);
+#   events.addEventListener("status", (e) => update(JSON.parse(e.data)));
+#   events.addEventListener("progress", (e) => showStep(JSON.parse(e.data)));
+#
+# Browsers' EventSource can't set headers, so the token may come as
+# ?token= as well as the usual Authorization: Bearer header.
+
+import json
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from app import config
+from app.database import AsyncSessionLocal
+from app.models import Note
+from app.services import artifacts
+from app.services.auth import resolve_token
+from app.services.events import TooManySubscriptions, event_broker, status_event
+
+router = APIRouter(tags=["events"])
+
+# How long a browser waits before reconnecting a dropped stream
+RETRY_MILLISECONDS = 3000
+
+# Notes reported in the initial snapshot of a per-user stream
+SNAPSHOT_LIMIT = 100
+
+
+def _format(payload: dict, sequence: Optional[int] = None) -> str:
+    """One SSE message: the payload type is the event name, the payload the data."""
+    lines = [f"event: {payload['type']}"]
+    if sequence is not None:
+        lines.append(f"id: {sequence}")
+    lines.append("data: " + json.dumps(payload, separators=(",", ":"), default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+def _bearer_token(authorization: Optional[str], token: Optional[str]) -> Optional[str]:
+    if token:
+        return token
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return None
+
+
+async def _snapshot(user_id: int, note_id: Optional[int]) -> list:
+    """
+    Current status of the note being watched (404 if it isn't the
+    caller's), or of the user's notes that are still compiling.
+    """
+    query = select(Note.id, Note.status).where(Note.user_id == user_id)
+    if note_id is not None:
+        query = query.where(Note.id == note_id)
+    else:
+        query = query.where(Note.status.in_(("pending", "compiling"))).order_by(Note.id).limit(SNAPSHOT_LIMIT)
+    # A short session of our own: a stream can stay open for hours and
+    # must not hold a pooled connection all that time
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(query)).all()
+    if note_id is not None and not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
+    return [
+        status_event(row.id, row.status, **({"pdf_url": artifacts.pdf_url_for(row.id)} if row.status == "completed" else {}))
+        for row in rows
+    ]
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    note_id: Optional[int] = Query(None, description="Only events for this note"),
+    token: Optional[str] = Query(None, description="Access token, for clients that can't send headers"),
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[int] = Header(None),
+):
+    """
+    Stream compile status changes of the caller's notes (text/event-stream).
+    Each `status` event carries note_id, status (pending, compiling,
+    completed, failed) and, where it applies, pdf_url or error. While a
+    note compiles, `progress` events carry note_id and step: "tex" (with
+    pass_number and max_passes), "bibtex", "biber" or "format" (building
+    the precompiled preamble). A `resync` event means events were lost -
+    reload the notes you are showing.
+    """
+    bearer = _bearer_token(authorization, token)
+    identity = None
+    if bearer:
+        async with AsyncSessionLocal() as db:
+            identity = await resolve_token(db, bearer)
+    if identity is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    try:
+        # Subscribe before reading the snapshot, so nothing falls in between
+        subscription = event_broker.subscribe(identity.id, note_id, last_event_id)
+    except TooManySubscriptions:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"At most {config.EVENTS_MAX_STREAMS_PER_USER} open event streams per user"
+        )
+    try:
+        # A reconnect gets what it missed from the broker's history - unless
+        # that no longer reaches back to its Last-Event-ID (history rolled
+        # over, or the server restarted): then it is told to reload, and
+        # gets the current status like a new stream
+        snapshot = []
+        if subscription.missed:
+            snapshot.append({"type": "resync"})
+        if last_event_id is None or subscription.missed:
+            snapshot += await _snapshot(identity.id, note_id)
+    except BaseException:
+        event_broker.unsubscribe(subscription)
+        raise
+
+    async def stream():
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            for payload in snapshot:
+                yield _format(payload)
+            while True:
+                events = await subscription.next_events(config.EVENTS_KEEPALIVE_SECONDS)
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield _format({"type": "resync"})
+                yield "".join(_format(payload, sequence) for sequence, payload in events)
+        finally:
+            # Runs when the client disconnects (the response task is cancelled)
+            event_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,178 @@
+# Note files API endpoints - the extra files of multi-file notes
+#
+# The note's latex_content is the main document; these endpoints manage
+# the files next to it (chapters, .bib databases, local styles). Only a
+# change to a file the main document actually reaches recompiles the note.
+
+from datetime import datetime, timezone
+from typing import Dict
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.schemas import NoteFileWrite, NoteFileInfo, NoteFileContent, NoteProject
+from app import config
+from app.models import Note, NoteFile
+from app.api.auth import get_current_identity
+from app.services.auth import AuthenticatedUser
+from app.services import projects
+from app.services.latex import enqueue_compile, compile_dispatcher
+
+router = APIRouter(prefix="/notes", tags=["note files"])
+
+
+async def _owned_note(db: AsyncSession, note_id: int, user_id: int) -> Note:
+    note = await db.scalar(select(Note).where(
+        Note.id == note_id,
+        Note.user_id == user_id
+    ))
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    return note
+
+
+def _checked_path(path: str) -> str:
+    try:
+        return projects.validate_path(path)
+    except projects.InvalidProjectPath as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+
+async def _project_contents(db: AsyncSession, note_id: int) -> Dict[str, str]:
+    return (await projects.load_files(db, [note_id])).get(note_id, {})
+
+
+def _file_info(file: NoteFile, used: bool) -> dict:
+    return {
+        "path": file.path,
+        "content_size": file.content_size,
+        "used": used,
+        "created_at": file.created_at,
+        "updated_at": file.updated_at,
+    }
+
+
+async def _recompile(db: AsyncSession, note: Note) -> None:
+    """The compiled document changed: mark the note edited and queue a compile."""
+    note.updated_at = datetime.now(timezone.utc)
+    await enqueue_compile(db, note)
+
+
+async def _commit(db: AsyncSession) -> None:
+    try:
+        await db.commit()
+    except (IntegrityError, StaleDataError):
+        # Another request created the same path, or saved the note, at the same moment
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The file was changed by another request - reload and retry"
+        )
+    compile_dispatcher.notify()
+
+
+@router.get("/{note_id}/files", response_model=NoteProject)
+async def list_note_files(
+    note_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """List a note's project files and the dependency graph between them."""
+    note = await _owned_note(db, note_id, current_user.id)
+    files = (await db.scalars(
+        select(NoteFile).where(NoteFile.note_id == note_id).order_by(NoteFile.path)
+    )).all()
+    graph = projects.build_graph(note.latex_content, {file.path: file.content for file in files})
+    used = graph.reachable()
+    return {
+        "note_id": note_id,
+        "files": [_file_info(file, file.path in used) for file in files],
+        "dependencies": graph.edges,
+        "missing": graph.missing,
+    }
+
+
+@router.get("/{note_id}/files/{path:path}", response_model=NoteFileContent)
+async def get_note_file(
+    note_id: int,
+    path: str,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get one project file with its contents."""
+    note = await _owned_note(db, note_id, current_user.id)
+    path = _checked_path(path)
+    contents = await _project_contents(db, note_id)
+    file = await db.scalar(select(NoteFile).where(NoteFile.note_id == note_id, NoteFile.path == path))
+    if file is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    used = path in projects.build_graph(note.latex_content, contents).reachable()
+    return {**_file_info(file, used), "content": file.content}
+
+
+@router.put("/{note_id}/files/{path:path}", response_model=NoteFileInfo)
+async def put_note_file(
+    note_id: int,
+    path: str,
+    body: NoteFileWrite,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create or replace a project file. The note is recompiled only if its
+    main document reaches this file (directly or through other files).
+    """
+    note = await _owned_note(db, note_id, current_user.id)
+    path = _checked_path(path)
+    contents = await _project_contents(db, note_id)
+    file = await db.scalar(select(NoteFile).where(NoteFile.note_id == note_id, NoteFile.path == path))
+    if file is None:
+        if len(contents) >= config.PROJECT_MAX_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"A note can have at most {config.PROJECT_MAX_FILES} files"
+            )
+        file = NoteFile(note_id=note_id, path=path, content=body.content)
+        db.add(file)
+        changed = True
+    else:
+        changed = file.content != body.content
+        if changed:
+            file.content = body.content
+
+    contents[path] = body.content
+    # A new file can also satisfy an \input the main document already had
+    used = path in projects.build_graph(note.latex_content, contents).reachable()
+    if changed and used:
+        await _recompile(db, note)
+    await _commit(db)
+    await db.refresh(file)
+    return _file_info(file, used)
+
+
+@router.delete("/{note_id}/files/{path:path}")
+async def delete_note_file(
+    note_id: int,
+    path: str,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete a project file (recompiles the note if it was in use)."""
+    note = await _owned_note(db, note_id, current_user.id)
+    path = _checked_path(path)
+    contents = await _project_contents(db, note_id)
+    if path not in contents:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    used = path in projects.build_graph(note.latex_content, contents).reachable()
+    file = await db.scalar(select(NoteFile).where(NoteFile.note_id == note_id, NoteFile.path == path))
+    await db.delete(file)
+    if used:
+        await db.flush()  # enqueue_compile reads the remaining files
+        await _recompile(db, note)
+    await _commit(db)
+    return {"message": "File deleted successfully"}
@@ -1,53 +1,522 @@
 # Notes API endpoints - CRUD operations for LaTeX notes
 
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import List, Literal, Optional, Set
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.schemas import NoteCreate, NoteUpdate, NoteResponse
-from app.models import User, Note
-from app.api.auth import get_current_user
+from app.schemas import (
+    NoteCreate, NoteUpdate, NotePatch, NoteResponse, NotePage, NoteSearchPage,
+    NoteRevisionPage, NoteRevisionContent, NoteBatch, NoteBatchResult, NoteImportResult,
+)
+from app import config
+from app.models import Note
+from app.api.auth import get_current_identity
+from app.services.auth import AuthenticatedUser
+from app.services import artifacts, http_cache, note_archive, note_stats, projects, revisions, search, sync
+from app.services.note_batch import BatchConflict, apply_batch
+from app.services.latex import PRIORITY_INTERACTIVE, enqueue_compile, cancel_compiles, compile_dispatcher
+from app.services.serialization import FastJSONResponse, NOTE_FIELDS, note_dict
+from app.services.pagination import encode_cursor, decode_cursor, parse_datetime
+from app.services.downloads import FileRangeResponse, RangeNotSatisfiable, etag_matches, parse_range
 
 router = APIRouter(prefix="/notes", tags=["notes"])
 
+# Note list paging - the cap keeps one request from pulling a whole account
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Search paging - ranked results use offsets, so the depth is capped too
+DEFAULT_SEARCH_SIZE = 20
+MAX_SEARCH_SIZE = 50
+MAX_SEARCH_OFFSET = 1000
+
+# Columns the note list returns - latex_content is left out unless asked for,
+# so listing never reads, decompresses or ships the large body
+# (content_size tells the client how big it is)
+SUMMARY_COLUMNS = (
+    Note.id, Note.user_id, Note.title, Note.pdf_url,
+    Note.status, Note.revision, Note.version, Note.content_size,
+    Note.word_count, Note.math_count, Note.document_class, Note.packages,
+    Note.created_at, Note.updated_at, Note.changed_at,
+)
+
+# Orders the note list can be sorted in (?sort=), by column. Each one has
+# a (user_id, column, id) index, so every order pages by index range scan
+LIST_SORTS = {
+    "updated": Note.updated_at,    # Recently edited (the default)
+    "size": Note.content_size,     # Largest / smallest
+    "words": Note.word_count,
+    "math": Note.math_count,
+}
+
+# Most ?package= filters one listing may combine
+MAX_PACKAGE_FILTERS = 5
+
+# Revision history paging
+DEFAULT_REVISION_PAGE_SIZE = 50
+MAX_REVISION_PAGE_SIZE = 200
+
+
+def _revision_conflict() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="The note was changed by another request - reload and retry"
+    )
+
+
+def _version_conflict(version: int) -> HTTPException:
+    """409 for a write based on an old version; the body and ETag say which version is current."""
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={
+            "message": f"The note was changed by another request (it is now at version {version}) "
+                       "- reload and retry",
+            "version": version,
+        }
+    )
+
+
+def _expected_versions(request: Request, expected_version: Optional[int] = None) -> Optional[Set[int]]:
+    """
+    The versions a write may apply to: from If-Match (note ETags, or bare
+    versions like "3") or an expected_version in the body. None = any
+    version (no condition, or If-Match: *). Only the version part of an
+    ETag counts - a compile that finished since the read is no conflict.
+    """
+    versions = set()
+    header = request.headers.get("if-match")
+    if header and header.strip() != "*":
+        for tag in header.split(","):
+            tag = tag.strip().removeprefix("W/").strip('"').split(".")[0]
+            if not tag.isdigit():
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="If-Match must list note versions (ETags) or be *"
+                )
+            versions.add(int(tag))
+    if expected_version is not None:
+        versions.add(expected_version)
+    return versions or None
+
+
+async def _current_version(db: AsyncSession, note_id: int, user_id: int) -> int:
+    """The version a conflicting write lost to (404 if the note is gone)."""
+    version = await db.scalar(select(Note.version).where(
+        Note.id == note_id,
+        Note.user_id == user_id
+    ))
+    if version is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    return version
+
+
+def _check_version(note: Note, expected: Optional[Set[int]]) -> None:
+    if expected is not None and note.version not in expected:
+        raise _version_conflict(note.version)
+
+
+def _note_headers(version: int, changed_at) -> dict:
+    """Validators and caching policy for one note (see services/http_cache.py)."""
+    return {
+        "etag": http_cache.note_etag(version, changed_at),
+        "last-modified": http_cache.http_date(changed_at),
+        "cache-control": config.NOTE_CACHE_CONTROL,
+    }
+
+
+def _note_response(body: dict) -> FastJSONResponse:
+    """A NoteResponse body, with its ETag (usable as If-Match for the next write)."""
+    return FastJSONResponse(body, headers=_note_headers(body["version"], body["changed_at"]))
+
+
+async def _save_content(db: AsyncSession, note: Note, content: str, edits=None) -> None:
+    """
+    Store new LaTeX for a note as its next revision and version, then
+    recompile and re-index it. Computes the edits from the old text if not
+    given. The caller commits with _commit_save().
+    """
+    if edits is None:
+        edits = revisions.diff_edits(note.latex_content, content)
+    (stats,) = await note_stats.compute_stats([content])
+    note.latex_content = content
+    note_stats.apply_stats(note, stats)
+    note.revision += 1
+    note.version += 1
+    # The UPDATE only matches if the row is still at the version we read
+    # (see Note.__mapper_args__), and (note_id, revision) is unique - so if
+    # two saves both built on the same state, the second one fails here
+    revisions.record_revision(db, note.id, note.revision, content, edits)
+    try:
+        await db.flush()
+    except (IntegrityError, StaleDataError):
+        await db.rollback()
+        raise _version_conflict(await _current_version(db, note.id, note.user_id))
+    await enqueue_compile(db, note)  # Reuses a cached PDF or marks the note "pending"
+    await search.index_note(db, note.id, note.user_id, note.title, note.latex_content)
+    await note_stats.index_packages(db, [(note.id, note.user_id, note.packages)])
+
+
+async def _commit_save(db: AsyncSession, note: Optional[Note] = None) -> None:
+    """Commit a content change, turning a lost race into 409 (with the current version of `note`)."""
+    owner = (note.id, note.user_id) if note is not None else None
+    try:
+        await db.commit()
+    except (IntegrityError, StaleDataError):
+        await db.rollback()
+        if owner is None:
+            raise _revision_conflict()
+        raise _version_conflict(await _current_version(db, *owner))
+    compile_dispatcher.notify()
+
+
+async def _update_title(db: AsyncSession, note_id: int, user_id: int, title: str,
+                        expected: Optional[Set[int]]) -> FastJSONResponse:
+    """
+    A title-only change: one conditional UPDATE ... RETURNING, with no read
+    before it. Only if it matches nothing do we look at why (404 or 409).
+    """
+    statement = update(Note).where(Note.id == note_id, Note.user_id == user_id)
+    if expected is not None:
+        statement = statement.where(Note.version.in_(expected))
+    statement = (
+        statement
+        .values(title=title, version=Note.version + 1)  # updated_at: set by the column's onupdate
+        .returning(*(getattr(Note, field) for field in NOTE_FIELDS))
+        .execution_options(synchronize_session=False)
+    )
+    row = (await db.execute(statement)).first()
+    if row is None:
+        await db.rollback()
+        raise _version_conflict(await _current_version(db, note_id, user_id))
+    await search.retitle_note(db, note_id, title)
+    await db.commit()
+    return _note_response(row._asdict())
+
+
+async def _owned_note_revision(db: AsyncSession, note_id: int, user_id: int) -> int:
+    """Current revision of a note the caller owns (404 otherwise) - skips the LaTeX body."""
+    revision = await db.scalar(select(Note.revision).where(
+        Note.id == note_id,
+        Note.user_id == user_id
+    ))
+    if revision is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    return revision
+
+def _decode_list_cursor(cursor: str, sort: str, order: str) -> tuple:
+    """
+    (sort value, id) of the last row of the previous page. Cursors carry
+    their sort and order, so one can't be replayed against another listing.
+    Raises ValueError (or TypeError) for anything we didn't issue.
+    """
+    values = decode_cursor(cursor)
+    if len(values) == 2:
+        values = ["updated", "desc", *values]  # Issued before the list had other orders
+    if len(values) != 4 or values[:2] != [sort, order]:
+        raise ValueError("Cursor belongs to a different order")
+    value, last_id = values[2:]
+    if sort == "updated":
+        return parse_datetime(value), int(last_id)
+    if not isinstance(value, int):
+        raise ValueError("Malformed cursor")
+    return value, int(last_id)
+
 @router.post("/", response_model=NoteResponse)
 async def create_note(
     note: NoteCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new LaTeX note."""
+    (stats,) = await note_stats.compute_stats([note.latex_content])
     db_note = Note(
         title=note.title,
         latex_content=note.latex_content,
         user_id=current_user.id,
-        status="pending"  # Will be compiled later
+        status="pending",  # Will be compiled later
+        **stats
     )
     db.add(db_note)
-    db.commit()
-    db.refresh(db_note)
-    return db_note
+    await db.flush()  # Assigns db_note.id so the compile job can point at it
+    revisions.record_revision(db, db_note.id, db_note.revision, db_note.latex_content)
+    await search.index_note(db, db_note.id, db_note.user_id, db_note.title, db_note.latex_content)
+    await note_stats.index_packages(db, [(db_note.id, db_note.user_id, db_note.packages)])
+    await enqueue_compile(db, db_note)
+    await db.commit()
+    compile_dispatcher.notify()
+    await db.refresh(db_note)
+    return _note_response(note_dict(db_note))
+
+@router.post("/batch", response_model=NoteBatchResult, response_model_exclude_none=True)
+async def batch_notes(
+    batch: NoteBatch,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create, update and delete many notes in one request and one transaction.
+    All or nothing: if any operation is invalid the response is 422,
+    nothing is changed, and `results` marks the failing items.
+    """
+    if len(batch.operations) > config.BATCH_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {config.BATCH_MAX_OPERATIONS} operations per batch"
+        )
+    try:
+        applied, results = await apply_batch(db, current_user.id, batch.operations)
+    except BatchConflict:
+        raise _revision_conflict()
+    if not applied:
+        body = NoteBatchResult(applied=False, results=results)
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content=body.model_dump(exclude_none=True)
+        )
 
-@router.get("/", response_model=List[NoteResponse])
+    await _commit_save(db)
+    deleted = [operation.id for operation in batch.operations if operation.op == "delete"]
+    if deleted:
+        await projects.remove_build_dirs(deleted)
+        await artifacts.trim_store(db)
+    return {"applied": True, "results": results}
+
+@router.get("/", response_model=NotePage, response_model_exclude_unset=True)
 async def get_user_notes(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_content: bool = False,
+    changed_since: Optional[str] = None,
+    sort: Literal["updated", "size", "words", "math"] = "updated",
+    order: Literal["desc", "asc"] = "desc",
+    package: List[str] = Query([]),
+    document_class: Optional[str] = Query(None, max_length=100),
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List the current user's notes, most recently updated first - or by
+    size, word count or math count (?sort=, ?order=asc for smallest first).
+    ?package=tikz keeps notes that load a package (repeat for several),
+    ?document_class=beamer those of one document class.
+    Returns one page at a time; pass next_cursor back as ?cursor= to continue.
+    The first page has a sync_token: ?changed_since=<token> later returns
+    only what changed since (see services/sync.py).
+    Pages have a weak ETag - If-None-Match gets a 304 when nothing changed.
+    """
+    columns = SUMMARY_COLUMNS + ((Note.latex_content,) if include_content else ())
+    if changed_since is not None:
+        return await _note_changes(db, current_user.id, changed_since, limit, columns)
+
+    if len(package) > MAX_PACKAGE_FILTERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_PACKAGE_FILTERS} package filters"
+        )
+    after = None
+    if cursor:
+        try:
+            after = _decode_list_cursor(cursor, sort, order)
+        except (ValueError, TypeError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+
+    sort_column = LIST_SORTS[sort]
+
+    def page_query(columns):
+        query = select(*columns).where(Note.user_id == current_user.id)
+        if document_class is not None:
+            query = query.where(Note.document_class == document_class)
+        for name in package:
+            # Answered from the note_packages index, not by parsing bodies
+            query = query.where(Note.id.in_(note_stats.notes_using(current_user.id, name)))
+        if after is not None:
+            # Keyset condition: strictly "after" the last row of the previous page
+            key, last = tuple_(sort_column, Note.id), tuple_(*after)
+            query = query.where(key < last if order == "desc" else key > last)
+        if order == "desc":
+            query = query.order_by(sort_column.desc(), Note.id.desc())
+        else:
+            query = query.order_by(sort_column, Note.id)
+        # Fetch one extra row to learn whether another page exists
+        return query.limit(limit + 1)
+
+    def page_etag(rows):
+        return http_cache.list_etag(
+            ((row.id, row.version, row.changed_at) for row in rows[:limit + 1]),
+            cursor, limit, include_content, sync_token, sort, order, document_class, package,
+        )
+
+    sync_token = None if cursor else await sync.current_token(db, current_user.id)
+    if include_content and http_cache.has_validators(request.headers):
+        # Revalidating a page with bodies: decide on the metadata alone, so
+        # a 304 never reads or decompresses latex_content
+        etag = page_etag((await db.execute(page_query(SUMMARY_COLUMNS))).all())
+        if http_cache.not_modified(request.headers, etag):
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"etag": etag, "cache-control": config.NOTE_LIST_CACHE_CONTROL}
+            )
+
+    rows = (await db.execute(page_query(columns))).all()
+    etag = page_etag(rows)
+    headers = {"etag": etag, "cache-control": config.NOTE_LIST_CACHE_CONTROL}
+    if http_cache.not_modified(request.headers, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor([sort, order, getattr(last, sort_column.key), last.id])
+    # Rows go straight to JSON - no per-row NoteSummary validation (see services/serialization.py)
+    body = {"items": [row._asdict() for row in rows], "next_cursor": next_cursor}
+    if sync_token is not None:
+        body["sync_token"] = sync_token
+    return FastJSONResponse(body, headers=headers)
+
+async def _note_changes(db: AsyncSession, user_id: int, token: str, limit: int, columns) -> FastJSONResponse:
+    """The ?changed_since= form of the note list: a delta for sync clients."""
+    try:
+        rows, deleted, sync_token, has_more = await sync.changes(db, user_id, token, limit, columns)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid sync token"
+        )
+    except sync.SyncTokenExpired:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Sync token expired - reload the full note list"
+        )
+    return FastJSONResponse({
+        "items": [row._asdict() for row in rows],
+        "next_cursor": sync_token if has_more else None,  # More changes: pass as ?changed_since=
+        "deleted": deleted,
+        "sync_token": sync_token,
+    }, headers={"cache-control": "no-store"})
+
+@router.get("/search", response_model=NoteSearchPage)
+async def search_user_notes(
+    q: str = Query("", max_length=500),
+    command: Optional[str] = Query(None, max_length=100),
+    limit: int = Query(DEFAULT_SEARCH_SIZE, ge=1, le=MAX_SEARCH_SIZE),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all notes for the current user."""
-    notes = db.query(Note).filter(Note.user_id == current_user.id).all()
-    return notes
+    """
+    Full-text search over the current user's notes, best match first.
+    `q` matches words in titles and text (the last word also as a prefix);
+    `command` restricts to notes using a LaTeX command or environment
+    (e.g. command=tikzpicture).
+    """
+    if not q.strip() and not command:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide a search query (q) or a command filter"
+        )
+    # One extra row tells us whether there is another page
+    hits = await search.search_notes(db, current_user.id, q, command, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    # Validated through NoteSearchPage: the raw SQL search returns SQLite's
+    # datetime strings, which the model normalizes
+    return {"items": hits[:limit], "next_offset": next_offset}
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_notes(
+    format: Literal["zip", "tar", "tar.gz"] = Query("zip"),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Download every note as one archive: sources, project files, compiled
+    PDFs and a JSON manifest (layout in services/note_archive.py).
+    Streamed as it is built - no Content-Length, constant server memory.
+    """
+    content_type, extension = note_archive.EXPORT_FORMATS[format]
+    filename = f"notes-{datetime.now(timezone.utc):%Y%m%d}.{extension}"
+    return StreamingResponse(
+        note_archive.export_archive(current_user.id, format),
+        media_type=content_type,
+        headers={
+            "content-disposition": f'attachment; filename="{filename}"',
+            "cache-control": "no-store",
+        },
+    )
+
+# Send the archive itself as the request body (any content type). tar and
+# tar.gz are read as they arrive; zip is spooled to a temporary file first
+@router.post("/import", response_model=NoteImportResult)
+async def import_notes(
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Create notes from an archive made by GET /notes/export (zip, tar or
+    tar.gz). Every note folder becomes a new note; invalid folders are
+    skipped and listed in `errors`. Notes are committed in batches, so a
+    broken archive keeps the notes read before the damage (the 400 says how many)
+    """
+    limit = config.IMPORT_MAX_MB * 1024 * 1024
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Archives are limited to {config.IMPORT_MAX_MB} MB"
+        )
+    try:
+        report = await note_archive.import_archive(db, current_user.id, request.stream())
+    except note_archive.ArchiveError as exc:
+        too_large = isinstance(exc, note_archive.ImportTooLarge)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE if too_large else status.HTTP_400_BAD_REQUEST,
+            detail={"message": str(exc), "imported": exc.imported}
+        )
+    return FastJSONResponse(report)
 
 @router.get("/{note_id}", response_model=NoteResponse)
 async def get_note(
     note_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get a specific note by ID."""
-    note = db.query(Note).filter(
+    """
+    Get a specific note by ID. Sends ETag and Last-Modified; a request
+    with If-None-Match / If-Modified-Since that still matches gets 304.
+    """
+    if http_cache.has_validators(request.headers):
+        # Revalidation: version and changed_at decide - the body isn't read
+        meta = (await db.execute(select(Note.version, Note.changed_at).where(
+            Note.id == note_id,
+            Note.user_id == current_user.id
+        ))).first()
+        if meta is not None:
+            headers = _note_headers(*meta)
+            if http_cache.not_modified(request.headers, headers["etag"], meta.changed_at):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    note = await db.scalar(select(Note).where(
         Note.id == note_id,
         Note.user_id == current_user.id
-    ).first()
+    ))
     
     if not note:
         raise HTTPException(
@@ -55,57 +524,308 @@ async def get_note(
             detail="Note not found"
         )
     
-    return note
+    return _note_response(note_dict(note))
+
+@router.api_route("/{note_id}/pdf", methods=["GET", "HEAD"], response_class=Response)
+async def download_note_pdf(
+    note_id: int,
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download the compiled PDF of a note.
+    Supports Range requests (for PDF viewers) and If-None-Match (304).
+    """
+    # Only the artifact key is needed - never load latex_content here
+    artifact_key = (await db.execute(select(Note.artifact_key).where(
+        Note.id == note_id,
+        Note.user_id == current_user.id
+    ))).first()
+    if artifact_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    artifact_key = artifact_key[0]
+    if artifact_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="PDF not available - the note has not compiled yet"
+        )
+
+    # The artifact key is a hash of the source, so it is a strong ETag:
+    # same key, byte-for-byte the same PDF
+    etag = f'"{artifact_key}"'
+    headers = {"etag": etag, "cache-control": config.PDF_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        pdf_file = await asyncio.to_thread(open, artifacts.artifact_path(artifact_key), "rb", 0)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="PDF not available - the note has not compiled yet"
+        )
+    size = os.fstat(pdf_file.fileno()).st_size
+
+    # If-Range: only honour Range when the client's copy is still current
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        pdf_file.close()
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"content-range": f"bytes */{size}"}
+        )
+
+    headers["content-type"] = "application/pdf"
+    headers["content-disposition"] = f'inline; filename="note-{note_id}.pdf"'
+    return FileRangeResponse(
+        pdf_file, size, headers,
+        byte_range=byte_range,
+        send_body=request.method != "HEAD",
+    )
 
 @router.put("/{note_id}", response_model=NoteResponse)
 async def update_note(
     note_id: int,
     note_update: NoteUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Update a specific note."""
-    note = db.query(Note).filter(
+    """
+    Update a specific note. With If-Match (or expected_version) the update
+    only applies if the note is still at that version - otherwise 409.
+    """
+    expected = _expected_versions(request, note_update.expected_version)
+    if note_update.latex_content is None and note_update.title is not None:
+        return await _update_title(db, note_id, current_user.id, note_update.title, expected)
+
+    note = await db.scalar(select(Note).where(
         Note.id == note_id,
         Note.user_id == current_user.id
-    ).first()
+    ))
     
     if not note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Note not found"
         )
+    _check_version(note, expected)
     
     # Update only provided fields
     if note_update.title is not None:
         note.title = note_update.title
-    if note_update.latex_content is not None:
-        note.latex_content = note_update.latex_content
-        note.status = "pending"  # Mark for recompilation
+    if note_update.latex_content is not None and note_update.latex_content != note.latex_content:
+        await _save_content(db, note, note_update.latex_content)
+    elif note_update.title is not None:
+        note.version += 1
+        await search.retitle_note(db, note.id, note.title)
     
-    db.commit()
-    db.refresh(note)
-    return note
+    await _commit_save(db, note)
+    await db.refresh(note)
+    return _note_response(note_dict(note))
 
-@router.delete("/{note_id}")
-async def delete_note(
+@router.patch("/{note_id}", response_model=NoteResponse)
+async def patch_note(
     note_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    note_patch: NotePatch,
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
 ):
-    """Delete a specific note."""
-    note = db.query(Note).filter(
+    """
+    Apply text edits to a note instead of re-sending the whole document.
+    `base_revision` must be the note's current revision (and the version
+    must match If-Match, if sent); if someone else saved in between,
+    nothing is applied and the response is 409.
+    """
+    if len(note_patch.edits) > config.MAX_NOTE_EDITS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {config.MAX_NOTE_EDITS} edits per request"
+        )
+    note = await db.scalar(select(Note).where(
         Note.id == note_id,
         Note.user_id == current_user.id
-    ).first()
+    ))
     
     if not note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Note not found"
         )
+    _check_version(note, _expected_versions(request))
+    if note_patch.base_revision != note.revision:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Edits are based on revision {note_patch.base_revision}, "
+                   f"but the note is at revision {note.revision}"
+        )
+
+    edits = [(edit.start, edit.end, edit.text) for edit in note_patch.edits]
+    try:
+        content = revisions.apply_edits(note.latex_content, edits)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(exc)
+        )
+
+    if note_patch.title is not None:
+        note.title = note_patch.title
+    if content != note.latex_content:
+        await _save_content(db, note, content, edits)
+    elif note_patch.title is not None:
+        note.version += 1
+        await search.retitle_note(db, note.id, note.title)
+
+    await _commit_save(db, note)
+    await db.refresh(note)
+    return _note_response(note_dict(note))
+
+@router.get("/{note_id}/revisions", response_model=NoteRevisionPage)
+async def list_note_revisions(
+    note_id: int,
+    limit: int = Query(DEFAULT_REVISION_PAGE_SIZE, ge=1, le=MAX_REVISION_PAGE_SIZE),
+    before: Optional[int] = Query(None, ge=1),
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """List a note's saved revisions, newest first (pass next_before as ?before= for more)."""
+    await _owned_note_revision(db, note_id, current_user.id)
+    items = await revisions.list_revisions(db, note_id, limit + 1, before)
+    next_before = items[limit - 1]["revision"] if len(items) > limit else None
+    return FastJSONResponse({"items": items[:limit], "next_before": next_before})
+
+@router.get("/{note_id}/revisions/{revision}", response_model=NoteRevisionContent)
+async def get_note_revision(
+    note_id: int,
+    revision: int,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the full LaTeX of one past revision."""
+    await _owned_note_revision(db, note_id, current_user.id)
+    try:
+        content = await revisions.load_revision(db, note_id, revision)
+    except revisions.RevisionNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Revision not found"
+        )
+    return {"note_id": note_id, "revision": revision, "latex_content": content}
+
+@router.post("/{note_id}/revisions/{revision}/restore", response_model=NoteResponse)
+async def restore_note_revision(
+    note_id: int,
+    revision: int,
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Make an old revision current again. History is kept: the restored text
+    is saved as a new revision on top. Honors If-Match like PUT.
+    """
+    note = await db.scalar(select(Note).where(
+        Note.id == note_id,
+        Note.user_id == current_user.id
+    ))
     
-    db.delete(note)
-    db.commit()
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    _check_version(note, _expected_versions(request))
+    try:
+        content = await revisions.load_revision(db, note_id, revision)
+    except revisions.RevisionNotFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Revision not found"
+        )
+
+    if content != note.latex_content:
+        await _save_content(db, note, content)
+        await _commit_save(db, note)
+        await db.refresh(note)
+    return _note_response(note_dict(note))
+
+@router.post("/{note_id}/compile", status_code=status.HTTP_202_ACCEPTED)
+async def compile_note_now(
+    note_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Compile a note right away ("compile now"). Skips the autosave debounce
+    and goes ahead of background compiles - still taking turns with other users.
+    """
+    note = await db.scalar(select(Note).where(
+        Note.id == note_id,
+        Note.user_id == current_user.id
+    ))
+
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+
+    await enqueue_compile(db, note, priority=PRIORITY_INTERACTIVE)
+    await _commit_save(db, note)
+    return {"note_id": note.id, "status": note.status}
+
+@router.delete("/{note_id}")
+async def delete_note(
+    note_id: int,
+    request: Request,
+    expected_version: Optional[int] = Query(None, ge=1),
+    current_user: AuthenticatedUser = Depends(get_current_identity),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Delete a specific note. With If-Match (or ?expected_version=) the note
+    is only deleted if nobody changed it since that version - otherwise 409.
+    """
+    expected = _expected_versions(request, expected_version)
+    # Claim the row with one conditional write (no read first): it checks
+    # owner and version and locks the note until we commit. Its dependent
+    # rows go next, then the note itself
+    statement = update(Note).where(Note.id == note_id, Note.user_id == current_user.id)
+    if expected is not None:
+        statement = statement.where(Note.version.in_(expected))
+    statement = (
+        statement
+        .values(version=Note.version + 1, updated_at=Note.updated_at)
+        .returning(Note.artifact_key)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = (await db.execute(statement)).first()
+    if claimed is None:
+        await db.rollback()
+        raise _version_conflict(await _current_version(db, note_id, current_user.id))
+
+    await cancel_compiles(db, note_id)
+    await search.remove_note(db, note_id)
+    await note_stats.remove_packages(db, [note_id])
+    await revisions.delete_history(db, note_id)
+    await projects.delete_files(db, [note_id])
+    await artifacts.release(db, claimed.artifact_key)  # PDF stays if other notes share it
+    await db.execute(delete(Note).where(Note.id == note_id))
+    await sync.record_deletions(db, current_user.id, [note_id])  # So sync clients drop their copy
+    await db.commit()
+    await projects.remove_build_dirs([note_id])
+    await artifacts.trim_store(db)
     
     return {"message": "Note deleted successfully"}
@@ -0,0 +1,116 @@
+# Math preview API endpoints - LaTeX math to MathML without a compile
+#
+# The editor's live preview sends the equation under the cursor (or the
+# whole buffer) here and gets MathML back in milliseconds, instead of
+# waiting for the full pdflatex round-trip. Rendering happens in-process
+# (services/math_render.py) and is cached per snippet + macro definitions.
+
+from typing import List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app.database import get_db
+from app.schemas import MathRenderRequest, MathRenderResponse, NoteMath
+from app import config
+from app.api.auth import get_current_identity
+from app.models import Note
+from app.services.auth import AuthenticatedUser
+from app.services import math_render, projects
+from app.services.serialization import FastJSONResponse
+
+router = APIRouter(tags=["math preview"])
+
+
+def _item(tex: str, display: bool, result: math_render.RenderedMath) -> dict:
+    return {
+        "tex": tex,
+        "display": display,
+        "mathml": result.mathml,
+        "error": result.error,
+        "error_position": result.position,
+    }
+
+
+def _document_items(rendered: List[Tuple[math_render.MathSpan, math_render.RenderedMath]]) -> List[dict]:
+    items = []
+    for span, result in rendered:
+        item = _item(span.tex, span.display, result)
+        item.update(start=span.start, end=span.end, line=span.line)
+        items.append(item)
+    return items
+
+
+def _render_document(document: str, *macro_sources: str) -> List[dict]:
+    context = math_render.macro_context(*macro_sources, document)
+    return _document_items(
+        math_render.render_document(document, context, limit=config.MATH_MAX_SNIPPETS)
+    )
+
+
+def _render_snippets(request: MathRenderRequest) -> List[dict]:
+    context = math_render.macro_context(request.macros or "")
+    return [
+        _item(snippet.tex, snippet.display, math_render.render_math(snippet.tex, snippet.display, context))
+        for snippet in request.snippets
+    ]
+
+
+@router.post("/render/math", response_model=MathRenderResponse)
+async def render_math(
+    request: MathRenderRequest,
+    identity: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Render LaTeX math to MathML: either `snippets` (each with its display
+    flag) or every piece of math in `document`. Snippets that don't parse
+    come back with an error instead of MathML; the rest still render
+    """
+    if (request.document is None) == (not request.snippets):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Send either snippets or a document"
+        )
+    if len(request.snippets) > config.MATH_MAX_SNIPPETS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {config.MATH_MAX_SNIPPETS} snippets per request"
+        )
+    if any(len(snippet.tex) > config.MATH_MAX_SNIPPET_CHARS for snippet in request.snippets):
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Snippets are limited to {config.MATH_MAX_SNIPPET_CHARS} characters"
+        )
+
+    # Parsing is CPU work - keep it off the event loop
+    if request.document is not None:
+        items = await run_in_threadpool(_render_document, request.document, request.macros or "")
+    else:
+        items = await run_in_threadpool(_render_snippets, request)
+    return FastJSONResponse({"items": items})
+
+
+@router.get("/notes/{note_id}/math", response_model=NoteMath)
+async def render_note_math(
+    note_id: int,
+    db: AsyncSession = Depends(get_db),
+    identity: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Render all the math in a note. Macros come from the note itself and
+    from the project files it includes (e.g. a macros.sty)
+    """
+    note = await db.scalar(select(Note).where(
+        Note.id == note_id,
+        Note.user_id == identity.id
+    ))
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    document, revision = note.latex_content, note.revision
+    files = (await projects.load_files(db, [note_id])).get(note_id, {})
+    files = projects.compile_files(document, files)
+    items = await run_in_threadpool(_render_document, document, *files.values())
+    return FastJSONResponse({"note_id": note_id, "revision": revision, "items": items})
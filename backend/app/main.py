@@ -1,10 +1,38 @@
 # LaTeX Note Platform - Main FastAPI Application
 
-from fastapi import FastAPI
+import asyncio
+import codecs
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
 
 # Import our API routers
-from app.api import auth, notes
+from app import config
+from app.api import auth, events, notes, note_files, render
+from app.database import AsyncSessionLocal, async_engine
+from app.services import math_render, metrics
+from app.services.auth import user_cache
+from app.services.events import event_broker
+from app.services.latex import compile_dispatcher, queue_counts
+from app.services.latex_analyzer import LatexAnalyzer
+from app.services.preamble import preamble_cache
+from app.services.projects import scan_cache_stats
+from app.services.serialization import FastJSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services with the app and stop them on shutdown."""
+    await compile_dispatcher.start()
+    yield
+    await compile_dispatcher.stop()
+    await async_engine.dispose()  # Close pooled connections (aiosqlite runs a thread per connection)
+
 
 # Create the FastAPI application instance
 app = FastAPI(
@@ -12,7 +40,9 @@ app = FastAPI(
     description="A cloud-backed LaTeX note-taking platform with user authentication",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse  # orjson for every JSON response
 )
 
 # Add CORS middleware for frontend integration
@@ -24,9 +54,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics - added last so it wraps everything, CORS included
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Include API routers
 app.include_router(auth.router)
 app.include_router(notes.router)
+app.include_router(note_files.router)
+app.include_router(events.router)
+app.include_router(render.router)
 
 # Root endpoint - API status
 @app.get("/")
@@ -42,39 +79,88 @@ async def read_root():
         }
     }
 
-# Health check endpoint
+# Health check endpoint - 503 when the database doesn't answer, so load
+# balancers and orchestrators take the instance out of rotation
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "database": "connected"}
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            await asyncio.wait_for(db.execute(text("SELECT 1")), timeout=config.HEALTH_DB_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "database": "timeout"})
+    except Exception as exc:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unhealthy", "database": "unavailable", "error": type(exc).__name__}
+        )
+    latency_ms = round((time.perf_counter() - started) * 1000, 2)
+    return {"status": "healthy", "database": "connected", "database_latency_ms": latency_ms}
+
+# Prometheus metrics (see services/metrics.py)
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Values that are cheaper to read now than to track as they change
+    async with AsyncSessionLocal() as db:
+        for status, count in (await queue_counts(db)).items():
+            metrics.COMPILE_QUEUE.set(count, status=status)
+    tokens = user_cache.stats()
+    metrics.record_cache("auth_token", tokens["hits"], tokens["misses"], tokens["entries"])
+    preambles = preamble_cache.stats()
+    metrics.record_cache("preamble", preambles["hits"], preambles["misses"], preambles["entries"])
+    scans = scan_cache_stats()
+    metrics.record_cache("project_scan", scans["hits"], scans["misses"], scans["entries"])
+    maths = math_render.cache_stats()
+    metrics.record_cache("math", maths["hits"], maths["misses"], maths["entries"])
+    metrics.EVENT_STREAMS.set(event_broker.connections)
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
-# Keep the original LaTeX validator for testing
+# LaTeX validator - a one-pass structural check (see services/latex_analyzer.py)
+#
+# Send either JSON {"latex": "..."} or the raw document with a text/plain
+# (or application/x-tex) content type. Raw bodies are analyzed as they
+# arrive, chunk by chunk, so a large document is never held in memory.
+# The analyzer takes about 0.5 s per MB, so it runs on the thread pool -
+# a big document must not stall every other request.
 @app.post("/validate-latex")
-async def validate_latex_snippet(data: dict):
+async def validate_latex_snippet(request: Request):
     """
-    Basic LaTeX validation - for testing purposes
+    Check LaTeX structure: braces, environments, math delimiters, and the
+    documentclass / document skeleton. Errors carry line and column
     """
-    latex_code = data.get("latex", "")
-    
-    if not latex_code:
-        return {"valid": False, "error": "No LaTeX code provided"}
-    
-    if "\\documentclass" not in latex_code:
-        return {"valid": False, "error": "Missing \\documentclass"}
-        
-    if "\\begin{document}" not in latex_code:
-        return {"valid": False, "error": "Missing \\begin{document}"}
-        
-    if "\\end{document}" not in latex_code:
-        return {"valid": False, "error": "Missing \\end{document}"}
-    
-    # Count math expressions
-    math_count = latex_code.count("$")
-    
-    return {
-        "valid": True,
-        "message": "LaTeX looks good!",
-        "stats": {
-            "length": len(latex_code),
-            "math_expressions": math_count // 2
-        }
-    }
+    analyzer = LatexAnalyzer()
+    limit = config.VALIDATE_MAX_MB * 1024 * 1024
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("application/json"):
+        try:
+            data = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        latex_code = data.get("latex", "") if isinstance(data, dict) else ""
+        if not isinstance(latex_code, str) or not latex_code:
+            return {"valid": False, "error": "No LaTeX code provided"}
+        if len(latex_code) > limit:
+            raise HTTPException(status_code=413, detail="Document too large")
+        await run_in_threadpool(analyzer.feed, latex_code)
+    else:
+        # Decode incrementally - a UTF-8 character may straddle two chunks
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > limit:
+                raise HTTPException(status_code=413, detail="Document too large")
+            await run_in_threadpool(analyzer.feed, decoder.decode(chunk))
+        await run_in_threadpool(analyzer.feed, decoder.decode(b"", final=True))
+        if received == 0:
+            return {"valid": False, "error": "No LaTeX code provided"}
+
+    report = await run_in_threadpool(analyzer.finish)
+    if report["valid"]:
+        report["message"] = "LaTeX looks good!"
+    else:
+        report["error"] = report["errors"][0]["message"]  # Kept for older clients
+    return report
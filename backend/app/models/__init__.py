@@ -6,6 +6,12 @@
 # Import our database models
 from .user import User
 from .note import Note
+from .compile_job import CompileJob
+from .artifact import Artifact
+from .note_revision import NoteRevision
+from .note_file import NoteFile
+from .note_tombstone import NoteTombstone
+from .note_package import NotePackage
 
 # Explicit export list - only these classes can be imported
 # When someone does: from app.models import *
@@ -13,4 +19,10 @@ from .note import Note
 __all__ = [
     "User",
     "Note",
+    "CompileJob",
+    "Artifact",
+    "NoteRevision",
+    "NoteFile",
+    "NoteTombstone",
+    "NotePackage",
 ]
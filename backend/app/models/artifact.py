@@ -0,0 +1,34 @@
+# Artifact model - one compiled PDF in the content-addressed store
+
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class Artifact(Base):
+    """
+    Artifact model - a compiled PDF shared by every note with the same source.
+
+    The key is a hash of the normalized LaTeX plus compiler settings, so two
+    notes that only differ in whitespace or comments share one file.
+
+    Columns:
+    - key: sha256 hex digest, also the file name on disk
+    - size_bytes: file size, used to keep the store under its size budget
+    - ref_count: how many notes point at this PDF (0 = safe to evict)
+    - created_at: when it was first compiled
+    - last_used_at: last cache hit or attach, drives LRU eviction
+    """
+    __tablename__ = "artifacts"
+
+    key = Column(String(64), primary_key=True)
+    size_bytes = Column(Integer, nullable=False, default=0)
+    ref_count = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # Eviction walks unreferenced artifacts oldest-first, hence the index
+
+    def __repr__(self):
+        return f"<Artifact(key={self.key[:12]}..., refs={self.ref_count}, size={self.size_bytes})>"
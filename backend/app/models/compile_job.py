@@ -0,0 +1,51 @@
+# CompileJob model - the persistent queue of LaTeX compilations
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class CompileJob(Base):
+    """
+    CompileJob model - one requested compilation of a note.
+
+    Jobs live in the database instead of in memory, so a restart or crash
+    never loses work: whatever was still queued gets picked up again.
+
+    Columns:
+    - id: queue position (lower ids are older and run first)
+    - note_id: the note to compile
+    - user_id: the note's owner - the dispatcher takes turns between users
+    - status: queued, running, completed, failed or cancelled
+      (cancelled = superseded by a newer save of the same note)
+    - priority: 1 for an explicit "compile now", 0 for saves
+    - not_before: don't start before this time (debounces autosaves)
+    - attempts: how many times a worker has started this job
+    - error: short error summary when the compile failed
+    - created_at / started_at / finished_at: queue timing
+    """
+    __tablename__ = "compile_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=True)
+    # Copied from the note so scheduling never has to join notes
+
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
+    not_before = Column(DateTime(timezone=True), nullable=True)
+    # A save queues its job a little in the future; a newer save of the
+    # same note moves that time instead of adding another job
+
+    status = Column(String, nullable=False, default="queued", index=True)
+    # The dispatcher only ever looks for status="queued", so this is indexed
+
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<CompileJob(id={self.id}, note_id={self.note_id}, status='{self.status}')>"
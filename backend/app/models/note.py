@@ -1,12 +1,84 @@
 # Note model - defines the notes table structure
 
 # Import database column types and relationships  
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+import zlib
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, DateTime, ForeignKey, Index, JSON
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 
 # Import our Base class from database.py
 from ..database import Base
+from .. import config
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# Stored format of CompressedText on SQLite: one marker byte, then the body
+_PLAIN = b"\x00"       # UTF-8 text as-is (small bodies aren't worth compressing)
+_COMPRESSED = b"\x01"  # zlib-compressed UTF-8
+
+
+def compress_content(text: str, min_bytes: int = config.CONTENT_COMPRESSION_MIN_BYTES) -> bytes:
+    """Encode a note body for storage, compressing it if it is big enough."""
+    raw = text.encode("utf-8")
+    if len(raw) >= min_bytes:
+        packed = zlib.compress(raw, config.CONTENT_COMPRESSION_LEVEL)
+        if len(packed) < len(raw):
+            return _COMPRESSED + packed
+    return _PLAIN + raw
+
+
+def decompress_content(value: Union[bytes, str, None]) -> Optional[str]:
+    """
+    Decode a stored note body. Also accepts plain strings, which is what
+    rows written before compression existed (or on PostgreSQL) contain.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == _COMPRESSED:
+        return zlib.decompress(value[1:]).decode("utf-8")
+    if value[:1] == _PLAIN:
+        return value[1:].decode("utf-8")
+    return value.decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """
+    A Text column that is stored compressed.
+
+    Python code sees a normal str. On SQLite the column is a BLOB holding
+    compress_content() output; decoding happens only for rows whose query
+    actually selects the column, so listings that leave it out (the note
+    list, search) never pay for it. On PostgreSQL it is plain TEXT:
+    Postgres already compresses large values (TOAST), doing it twice
+    would only cost CPU.
+    """
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(LargeBinary())
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return compress_content(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_content(value)
+
+    def coerce_compared_value(self, op, value):
+        # Comparisons (LIKE patterns etc.) bind as plain text, not compressed
+        return Text()
 
 
 class Note(Base):
@@ -18,13 +90,33 @@ class Note(Base):
     - id: unique identifier for each note
     - user_id: which user owns this note (foreign key to users.id)
     - title: note title for organization
-    - latex_content: the actual LaTeX code
+    - latex_content: the actual LaTeX code (stored compressed)
+    - content_size: size of latex_content in bytes
+    - word_count / math_count / document_class / packages: statistics of
+      latex_content, computed when it is saved
     - pdf_url: location of compiled PDF (nullable)
+    - artifact_key: content hash of the compiled PDF it points at (nullable)
     - status: compilation status (pending, completed, failed)
+    - revision: number of the latest saved version of latex_content
+    - version: bumped on every change to title or latex_content (If-Match)
     - created_at: when note was created
     - updated_at: when note was last modified
+    - changed_at: when anything clients see last changed (compile status too)
     """
     __tablename__ = "notes"
+    __table_args__ = (
+        Index("ix_notes_user_updated_id", "user_id", "updated_at", "id"),
+        Index("ix_notes_user_changed_id", "user_id", "changed_at", "id"),
+        Index("ix_notes_user_size_id", "user_id", "content_size", "id"),
+        Index("ix_notes_user_words_id", "user_id", "word_count", "id"),
+        Index("ix_notes_user_math_id", "user_id", "math_count", "id"),
+        Index("ix_notes_user_class_updated_id", "user_id", "document_class", "updated_at", "id"),
+    )
+    # Composite index for the note list: "this user's notes, newest first,
+    # after cursor X" becomes a single index range scan (no sort, no table scan).
+    # The second one does the same for sync: "changed after token X", and
+    # the rest for the other list orders ("largest first", "most words")
+    # and for "notes of document class X, newest first"
     
     # Primary Key - unique identifier for each note
     id = Column(Integer, primary_key=True, index=True)
@@ -44,16 +136,38 @@ class Note(Base):
     # Used for: note lists, organization, search
     
     # LaTeX Content - the actual LaTeX code
-    latex_content = Column(Text, nullable=False)
-    # Text = can store very large content (entire LaTeX documents)
+    latex_content = Column(CompressedText, nullable=False)
+    # CompressedText = very large text (entire LaTeX documents), stored
+    # compressed on disk - LaTeX shrinks 4-8x (see CompressedText above)
     # nullable=False = every note must have content
     # This is where the actual LaTeX code lives
+
+    # Content Size - length of latex_content in bytes (UTF-8, uncompressed)
+    content_size = Column(Integer, nullable=False, default=0, server_default="0")
+    # Kept in sync by _track_content_size below, so listings can show how
+    # big a note is without reading or decompressing the body
+
+    # Statistics - set by whoever saves latex_content (note_stats.compute_stats)
+    word_count = Column(Integer, nullable=False, default=0, server_default="0")
+    math_count = Column(Integer, nullable=False, default=0, server_default="0")
+    document_class = Column(String(100), nullable=True)
+    packages = Column(JSON, nullable=False, default=list, server_default="[]")
+    # Counted by the LaTeX analyzer (the same one as POST /validate-latex)
+    # over the main document only. The note list returns them and can sort
+    # and filter on them, so nobody re-parses bodies to show "1,204 words,
+    # uses tikz". packages is for display - filtering by package goes
+    # through the indexed note_packages table (see services/note_stats.py)
     
     # PDF URL - location of compiled PDF file
     pdf_url = Column(String, nullable=True)
     # nullable=True = can be empty (notes start without PDFs)
     # Gets filled after successful LaTeX compilation
-    # Examples: "s3://bucket/notes/123.pdf" or "/files/note123.pdf"
+    # Example: "/notes/123/pdf" (the download endpoint for this note)
+    
+    # Artifact Key - which compiled PDF in the artifact store this note uses
+    artifact_key = Column(String(64), nullable=True, index=True)
+    # Hash of the normalized LaTeX source (see services/artifacts.py)
+    # Several notes can share one key - the PDF is only freed when none do
     
     # Status - compilation status tracking
     status = Column(String, default="pending")
@@ -61,12 +175,40 @@ class Note(Base):
     # default="pending" = new notes start as "pending" 
     # Used to show compilation progress in UI
     
+    # Revision - bumped on every change to latex_content
+    revision = Column(Integer, nullable=False, default=1, server_default="1")
+    # Older versions live in note_revisions (see services/revisions.py).
+    # PATCH requests name the revision they edited, so a stale client
+    # can't silently overwrite newer text
+
+    # Version - bumped on every change a client makes (title or content)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Optimistic concurrency: writes are UPDATE ... WHERE id = ? AND
+    # version = ?, so of two saves built on the same version only the first
+    # matches a row - the second gets 409 instead of overwriting it.
+    # Clients send the version they read as If-Match. Compile status
+    # changes don't bump it (the ORM still checks it, see __mapper_args__)
+    
     # Timestamps - track when note was created and last modified
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), onupdate=_utcnow)
     # created_at: set once when note is created (never changes)
     # updated_at: automatically updated whenever note is modified
-    # onupdate=func.now() = database updates this field on every UPDATE
+    # Set from Python (microsecond precision, one format) rather than the
+    # database clock: SQLite's CURRENT_TIMESTAMP only has whole seconds,
+    # which would make (updated_at, id) pagination cursors ambiguous
+
+    changed_at = Column(DateTime(timezone=True), nullable=False, default=_utcnow, onupdate=_utcnow)
+    # Bumped by *every* UPDATE of the row - user edits and compile status
+    # changes alike (Core updates run onupdate too). It is what HTTP
+    # caching (ETag / Last-Modified) and ?changed_since= sync compare:
+    # if it didn't move, no field a client can see did either
+    
+    # Every ORM UPDATE/DELETE of a note carries "AND version = <loaded>" and
+    # fails with StaleDataError if another request changed the row first.
+    # The app sets the new version itself (generator off), so only user
+    # edits bump it
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
     
     # Relationship - connect this note back to its owner
     user = relationship("User", back_populates="notes")
@@ -75,6 +217,11 @@ class Note(Base):
     # user.notes → [Note1, Note2, Note3...] (from User model)
     # back_populates="notes" links to the User.notes relationship
     
+    @validates("latex_content")
+    def _track_content_size(self, key, value):
+        self.content_size = len(value.encode("utf-8")) if value is not None else 0
+        return value
+    
     def __repr__(self):
         """
         String representation for debugging.
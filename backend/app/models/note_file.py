@@ -0,0 +1,49 @@
+# NoteFile model - the extra source files of a multi-file note (a "project")
+
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import validates
+from sqlalchemy.sql import func
+
+from ..database import Base
+from .note import CompressedText, _utcnow
+
+
+class NoteFile(Base):
+    """
+    NoteFile model - one file of a note's project, next to the main document.
+
+    The note's own latex_content stays the main file; chapters, .bib
+    databases, local .sty/.cls files etc. live here and are pulled in by
+    \\input, \\include, \\bibliography, ... (see services/projects.py).
+    A note without NoteFile rows is a plain single-file document.
+
+    Columns:
+    - note_id / path: which note, and the file's path relative to the main
+      document (e.g. "chapters/intro.tex", "refs.bib")
+    - content: the file's text (stored compressed, like Note.latex_content)
+    - content_size: size of content in bytes
+    - created_at / updated_at: when the file was added / last changed
+    """
+    __tablename__ = "note_files"
+    __table_args__ = (
+        UniqueConstraint("note_id", "path", name="uq_note_files_note_path"),
+    )
+    # The unique constraint doubles as the index for "all files of note X"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False)
+    path = Column(String(255), nullable=False)
+
+    content = Column(CompressedText, nullable=False)
+    content_size = Column(Integer, nullable=False, default=0, server_default="0")
+
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), onupdate=_utcnow)
+
+    @validates("content")
+    def _track_content_size(self, key, value):
+        self.content_size = len(value.encode("utf-8")) if value is not None else 0
+        return value
+
+    def __repr__(self):
+        return f"<NoteFile(note_id={self.note_id}, path='{self.path}')>"
@@ -0,0 +1,31 @@
+# NotePackage model - which LaTeX packages each note loads (for filtering)
+
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+
+from ..database import Base
+
+
+class NotePackage(Base):
+    """
+    NotePackage model - one \\usepackage of one note.
+
+    Note.packages already lists a note's packages for display, but a JSON
+    list can't be searched with an index. These rows can: "this user's
+    notes that use tikz" is a range scan of ix_note_packages_user_package.
+    Rewritten whenever a note's content is saved (see services/note_stats.py).
+
+    Columns:
+    - note_id / package: the note and the package name (e.g. "tikz")
+    - user_id: the note's owner, copied here so the index can start with it
+    """
+    __tablename__ = "note_packages"
+    __table_args__ = (
+        Index("ix_note_packages_user_package", "user_id", "package", "note_id"),
+    )
+
+    note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True)
+    package = Column(String(100), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    def __repr__(self):
+        return f"<NotePackage(note_id={self.note_id}, package='{self.package}')>"
@@ -0,0 +1,42 @@
+# NoteRevision model - the compressed edit history of a note's LaTeX
+
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+
+from ..database import Base
+
+
+class NoteRevision(Base):
+    """
+    NoteRevision model - one saved version of a note's latex_content.
+
+    Most rows only store what changed since the previous revision (a delta);
+    every REVISION_SNAPSHOT_INTERVAL revisions a full copy is stored instead,
+    so rebuilding any revision replays a bounded number of deltas.
+    See services/revisions.py for the formats.
+
+    Columns:
+    - note_id / revision: which note, and its revision number (1, 2, 3, ...)
+    - kind: "snapshot" (full text) or "delta" (edits against revision - 1)
+    - data: zlib-compressed payload
+    - content_length: length of the full text at this revision, in characters
+    - created_at: when the revision was saved
+    """
+    __tablename__ = "note_revisions"
+    __table_args__ = (
+        UniqueConstraint("note_id", "revision", name="uq_note_revisions_note_revision"),
+    )
+    # The unique constraint doubles as the index for "revisions N..M of note X"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False)
+    revision = Column(Integer, nullable=False)
+
+    kind = Column(String(16), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    content_length = Column(Integer, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<NoteRevision(note_id={self.note_id}, revision={self.revision}, kind='{self.kind}')>"
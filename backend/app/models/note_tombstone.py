@@ -0,0 +1,34 @@
+# NoteTombstone model - a record that a note was deleted, for sync clients
+
+from sqlalchemy import Column, Integer, DateTime, Index
+
+from ..database import Base
+from .note import _utcnow
+
+
+class NoteTombstone(Base):
+    """
+    NoteTombstone model - one deleted note.
+
+    A client syncing with GET /notes/?changed_since= sees changed notes in
+    the notes table, but a deleted note has no row left to show it. These
+    rows tell the client which of its copies to drop. They are kept for
+    SYNC_TOMBSTONE_DAYS; a sync token older than that has to start over.
+
+    Columns:
+    - note_id / user_id: the deleted note and its owner (no foreign keys -
+      both may be gone)
+    - deleted_at: when it was deleted
+    """
+    __tablename__ = "note_tombstones"
+    __table_args__ = (
+        Index("ix_note_tombstones_user_deleted", "user_id", "deleted_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, default=_utcnow, index=True)
+
+    def __repr__(self):
+        return f"<NoteTombstone(note_id={self.note_id}, user_id={self.user_id})>"
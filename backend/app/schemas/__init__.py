@@ -1,7 +1,15 @@
 # Schemas package - exports all Pydantic schemas
 
 from .user import UserBase, UserCreate, UserResponse, UserWithNotes
-from .note import NoteBase, NoteCreate, NoteUpdate, NoteResponse, NoteWithUser
+from .note import (
+    NoteBase, NoteCreate, NoteUpdate, TextEdit, NotePatch, NoteResponse, NoteSummary, NotePage,
+    NoteSearchHit, NoteSearchPage, NoteRevisionInfo, NoteRevisionPage, NoteRevisionContent,
+    BatchCreate, BatchUpdate, BatchDelete, NoteBatch, BatchItemResult, NoteBatchResult,
+    NoteFileWrite, NoteFileInfo, NoteFileContent, NoteProject,
+    NoteImportError, NoteImportResult,
+    NoteWithUser,
+)
+from .render import MathSnippet, MathRenderRequest, RenderedMath, MathRenderResponse, NoteMath
 
 # Fix forward references for circular imports
 UserWithNotes.model_rebuild()
@@ -9,5 +17,12 @@ NoteWithUser.model_rebuild()
 
 __all__ = [
     "UserBase", "UserCreate", "UserResponse", "UserWithNotes",
-    "NoteBase", "NoteCreate", "NoteUpdate", "NoteResponse", "NoteWithUser",
+    "NoteBase", "NoteCreate", "NoteUpdate", "TextEdit", "NotePatch", "NoteResponse",
+    "NoteSummary", "NotePage", "NoteSearchHit", "NoteSearchPage",
+    "NoteRevisionInfo", "NoteRevisionPage", "NoteRevisionContent",
+    "BatchCreate", "BatchUpdate", "BatchDelete", "NoteBatch", "BatchItemResult", "NoteBatchResult",
+    "NoteFileWrite", "NoteFileInfo", "NoteFileContent", "NoteProject",
+    "NoteImportError", "NoteImportResult",
+    "NoteWithUser",
+    "MathSnippet", "MathRenderRequest", "RenderedMath", "MathRenderResponse", "NoteMath",
 ]
@@ -1,8 +1,8 @@
 # Note schemas for API request/response validation
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Dict, List, Literal, Optional, Union
 
 # Base note schema with common fields
 class NoteBase(BaseModel):
@@ -13,23 +13,188 @@ class NoteBase(BaseModel):
 class NoteCreate(NoteBase):
     pass  # Same as base for now
 
-# Schema for updating a note
+# Schema for updating a note. expected_version (or an If-Match header)
+# makes the update fail with 409 if the note changed since it was read
 class NoteUpdate(BaseModel):
     title: Optional[str] = None
     latex_content: Optional[str] = None
+    expected_version: Optional[int] = None
+
+# One text edit: replace characters [start, end) of the base text with `text`.
+# Offsets are Unicode code points and refer to the base revision's text
+class TextEdit(BaseModel):
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    text: str = ""
+
+# Schema for a delta update (PATCH) - edits against a known revision.
+# Edits must be sorted by position and must not overlap
+class NotePatch(BaseModel):
+    base_revision: int
+    edits: List[TextEdit] = []
+    title: Optional[str] = None
 
 # Schema for note responses (what we send back via API)
 class NoteResponse(NoteBase):
     id: int
     user_id: int
+    revision: int
+    version: int
+    content_size: int
+    word_count: int
+    math_count: int  # Inline and display math expressions
+    document_class: Optional[str] = None
+    packages: List[str]  # \usepackage'd packages, in order
     pdf_url: Optional[str] = None
     status: str
     created_at: datetime
     updated_at: datetime
+    changed_at: datetime  # Last change of any kind, compile status included
     
     class Config:
         from_attributes = True
 
+# Schema for one row of the note list - everything except the LaTeX body,
+# which is only included when the client asks for it (include_content=true)
+class NoteSummary(BaseModel):
+    id: int
+    user_id: int
+    title: str
+    pdf_url: Optional[str] = None
+    status: str
+    revision: int
+    version: int
+    content_size: int  # Bytes of LaTeX - known without loading the body
+    word_count: int    # Statistics of the body, computed when it was saved
+    math_count: int
+    document_class: Optional[str] = None
+    packages: List[str]
+    created_at: datetime
+    updated_at: datetime
+    changed_at: datetime  # Last change of any kind, compile status included
+    latex_content: Optional[str] = None
+
+# Schema for one page of the note list
+class NotePage(BaseModel):
+    items: List[NoteSummary]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= for the next page; null = last page
+    # Sync: the first page of a listing has a sync_token; ?changed_since=<token>
+    # answers with notes changed since (oldest first), ids of notes deleted
+    # since, and the sync_token to keep for next time
+    deleted: Optional[List[int]] = None
+    sync_token: Optional[str] = None
+
+# Schema for one search result - snippet/title_highlight wrap matches in <mark>
+class NoteSearchHit(BaseModel):
+    id: int
+    title: str
+    title_highlight: str
+    snippet: str
+    status: str
+    pdf_url: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    rank: float  # bm25 score - lower is a better match
+
+# Schema for one page of search results
+class NoteSearchPage(BaseModel):
+    items: List[NoteSearchHit]
+    next_offset: Optional[int] = None  # Pass back as ?offset= for more; null = no more
+
+# Schema for one entry of a note's revision history (contents not included)
+class NoteRevisionInfo(BaseModel):
+    revision: int
+    kind: str  # "snapshot" or "delta" - how it is stored
+    content_length: int
+    created_at: datetime
+
+# Schema for one page of revision history, newest first
+class NoteRevisionPage(BaseModel):
+    items: List[NoteRevisionInfo]
+    next_before: Optional[int] = None  # Pass back as ?before= for older revisions
+
+# Schema for the full text of one past revision
+class NoteRevisionContent(BaseModel):
+    note_id: int
+    revision: int
+    latex_content: str
+
+# Batch operations - one of these per item in POST /notes/batch
+class BatchCreate(BaseModel):
+    op: Literal["create"]
+    title: str
+    latex_content: str
+
+class BatchUpdate(BaseModel):
+    op: Literal["update"]
+    id: int
+    title: Optional[str] = None
+    latex_content: Optional[str] = None
+    base_revision: Optional[int] = None  # If given, the item fails unless the note is still at it
+    expected_version: Optional[int] = None  # Same, for the note's version
+
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+    expected_version: Optional[int] = None
+
+BatchOperation = Annotated[Union[BatchCreate, BatchUpdate, BatchDelete], Field(discriminator="op")]
+
+# Schema for a batch request - applied all together or not at all
+class NoteBatch(BaseModel):
+    operations: List[BatchOperation]
+
+# Outcome of one batch item, in request order
+class BatchItemResult(BaseModel):
+    index: int
+    op: str
+    ok: bool
+    id: Optional[int] = None        # Note id (new id for creates)
+    revision: Optional[int] = None
+    version: Optional[int] = None
+    status: Optional[str] = None    # Compile status after the batch
+    error: Optional[str] = None     # Why this item was rejected
+
+# Schema for the batch response - applied=false means nothing was changed
+class NoteBatchResult(BaseModel):
+    applied: bool
+    results: List[BatchItemResult]
+
+# Schema for writing one project file of a multi-file note
+class NoteFileWrite(BaseModel):
+    content: str
+
+# Schema for one project file (contents not included)
+class NoteFileInfo(BaseModel):
+    path: str           # Relative to the main document, e.g. "chapters/intro.tex"
+    content_size: int
+    used: bool          # Reached from the main document - changing it recompiles the note
+    created_at: datetime
+    updated_at: datetime
+
+# Schema for one project file with its contents
+class NoteFileContent(NoteFileInfo):
+    content: str
+
+# Schema for a note's project: its files and what includes what.
+# "note.tex" in the graph stands for the note's own latex_content
+class NoteProject(BaseModel):
+    note_id: int
+    files: List[NoteFileInfo]
+    dependencies: Dict[str, List[str]]  # File -> project files it references
+    missing: Dict[str, List[str]]       # File -> \input/\include/.bib targets that don't exist
+
+# One note folder of an import archive that was skipped, and why
+class NoteImportError(BaseModel):
+    folder: str         # e.g. "notes/12"
+    error: str
+
+# Outcome of POST /notes/import
+class NoteImportResult(BaseModel):
+    imported: int       # New notes created (they compile in the background)
+    failed: int         # Note folders skipped
+    errors: List[NoteImportError]  # The first 100 of them
+
 # Schema for note with user information included
 class NoteWithUser(NoteResponse):
     user: "UserResponse"
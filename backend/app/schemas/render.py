@@ -0,0 +1,38 @@
+# Math preview schemas - POST /render/math and GET /notes/{id}/math
+
+from pydantic import BaseModel
+from typing import List, Optional
+
+# One snippet to render: the math without its delimiters
+class MathSnippet(BaseModel):
+    tex: str
+    display: bool = False
+
+# Render request: a list of snippets, or a whole document whose math is
+# found and rendered (batch mode). `macros` is LaTeX with \newcommand /
+# \def / \DeclareMathOperator definitions the snippets may use; for a
+# document, its own definitions are used as well
+class MathRenderRequest(BaseModel):
+    snippets: List[MathSnippet] = []
+    document: Optional[str] = None
+    macros: Optional[str] = None
+
+# One rendered snippet: MathML, or an error with its offset in `tex`.
+# start/end/line locate the math (delimiters included) in a document
+class RenderedMath(BaseModel):
+    tex: str
+    display: bool
+    mathml: Optional[str] = None
+    error: Optional[str] = None
+    error_position: Optional[int] = None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    line: Optional[int] = None
+
+class MathRenderResponse(BaseModel):
+    items: List[RenderedMath]
+
+# All the math of a stored note, at the revision it was rendered from
+class NoteMath(MathRenderResponse):
+    note_id: int
+    revision: int
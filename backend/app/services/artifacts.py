@@ -0,0 +1,361 @@
+# Artifact store - content-addressed cache of compiled PDFs
+#
+# Many notes compile to the same PDF: templates, copied course notes, or a
+# resave that only touched whitespace. Instead of compiling each one, we
+# hash the *normalized* source together with the compiler settings and keep
+# one PDF per hash on disk:
+#
+#   storage/artifacts/ab/abcdef....pdf
+#
+# Notes point at a PDF through Note.artifact_key. The artifacts table keeps
+# a reference count per PDF, so deleting a note only makes its PDF
+# evictable when no other note uses it. Unreferenced PDFs stay around as a
+# cache until the store outgrows ARTIFACT_STORE_MAX_MB, then the least
+# recently used ones are removed first.
+
+import asyncio
+import hashlib
+import os
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.models import Artifact, Note
+
+ARTIFACT_DIR = os.path.join(config.STORAGE_DIR, "artifacts")
+
+# Bump when the compile pipeline changes in a way that changes the PDF,
+# so old cache entries stop matching
+# 2: documents are compiled until cross-references settle, with bibtex/biber
+# 3: spaces after a control space and \obeyspaces documents are kept (keys
+#    made by version 2 could be shared by sources that typeset differently)
+CACHE_VERSION = "3"
+
+# Most PDFs trim_store() will evict in one go
+TRIM_BATCH = 500
+
+# Most keys per "key IN (...)" query in the bulk helpers
+LOOKUP_CHUNK = 500
+
+# Environments whose contents TeX reads character by character - spaces
+# and % signs inside them are real content and must not be normalized
+VERBATIM_ENVIRONMENTS = (
+    "verbatim", "verbatim*", "Verbatim", "BVerbatim", "LVerbatim",
+    "lstlisting", "minted", "alltt", "filecontents", "filecontents*",
+)
+_VERBATIM_BEGIN = re.compile(
+    r"\\begin\{(" + "|".join(re.escape(env) for env in VERBATIM_ENVIRONMENTS) + r")\}"
+)
+
+# Commands whose argument may legally contain % or meaningful spaces - lines
+# using them are kept exactly as written
+_RAW_ARGUMENT_COMMANDS = re.compile(r"\\(verb|url|href|path|lstinline|mintinline)\b")
+
+_SPACES = re.compile(r"[ \t]+")
+
+# Commands after which spaces and line breaks may be content (they change
+# catcodes) - documents using them are only trimmed, never rewritten
+_CATCODE_COMMANDS = ("\\catcode", "\\obeyspaces", "\\obeylines")
+
+
+def _squash_spaces(text: str) -> str:
+    """
+    Squash each run of spaces into one, like TeX - except that the space of
+    a control space ("\\ ", an odd number of backslashes before it) is part
+    of that command, and the spaces after it are a run of their own:
+    "a\\  b" typesets two spaces, "a\\ b" one.
+    """
+    def replace(match):
+        start = match.start()
+        backslashes = 0
+        while start - backslashes - 1 >= 0 and text[start - backslashes - 1] == "\\":
+            backslashes += 1
+        run = match.group()
+        if backslashes % 2:
+            return run[0] + (" " if len(run) > 1 else "")
+        return " "
+    return _SPACES.sub(replace, text)
+
+
+def _strip_comment(line: str) -> tuple:
+    """
+    Cut a line at its first unescaped %.
+    Returns (text_before_comment, had_comment).
+    """
+    index = 0
+    while True:
+        index = line.find("%", index)
+        if index == -1:
+            return line, False
+        # Count the backslashes in front: \% is a literal percent, \\% is a comment
+        backslashes = 0
+        while index - backslashes - 1 >= 0 and line[index - backslashes - 1] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return line[:index], True
+        index += 1
+
+
+def normalize_latex(source: str) -> str:
+    """
+    Rewrite LaTeX so that sources TeX treats identically compare equal.
+
+    - comments are removed (a comment also eats the newline and the next
+      line's leading spaces, exactly like TeX)
+    - runs of spaces and line breaks inside a paragraph become one space
+    - any number of blank lines becomes a single paragraph break
+    - verbatim-like environments and \\verb/\\url lines are left untouched
+
+    Documents that change catcodes (\\catcode, \\obeyspaces, \\obeylines)
+    can make any character special, so those are only trimmed, never
+    rewritten.
+    """
+    if any(command in source for command in _CATCODE_COMMANDS):
+        return source.strip()
+
+    paragraphs: List[str] = []
+    current: List[str] = []
+    verbatim_end: Optional[str] = None
+
+    def end_paragraph():
+        text = "".join(current).strip()
+        if text:
+            paragraphs.append(text)
+        current.clear()
+
+    for line in source.splitlines():
+        if verbatim_end is not None:
+            # Inside verbatim: keep lines byte for byte
+            paragraphs.append(line)
+            if verbatim_end in line:
+                verbatim_end = None
+            continue
+
+        match = _VERBATIM_BEGIN.search(line)
+        if match:
+            end_paragraph()
+            paragraphs.append(line)
+            end_marker = f"\\end{{{match.group(1)}}}"
+            if end_marker not in line[match.end():]:
+                verbatim_end = end_marker
+            continue
+
+        if _RAW_ARGUMENT_COMMANDS.search(line):
+            text, had_comment = line.strip(), False
+        else:
+            text, had_comment = _strip_comment(line)
+            # TeX skips leading spaces and squashes runs of spaces into one
+            text = _squash_spaces(text).lstrip()
+            if not had_comment:
+                text = text.rstrip()
+
+        if not text and not had_comment:
+            # A blank line ends the paragraph (a comment-only line does not)
+            end_paragraph()
+            continue
+        current.append(text)
+        if not had_comment:
+            # The line break itself counts as one space - unless a % ate it
+            current.append(" ")
+
+    end_paragraph()
+    return "\n\n".join(paragraphs)
+
+
+def cache_key(source: str, engine: str, options: str = "",
+              files: Optional[Dict[str, str]] = None) -> str:
+    """
+    Content hash that identifies the PDF a source will compile to.
+    `files` are the other project files the compile uses ({path: text});
+    .tex files among them are normalized like the main source, anything
+    else (.bib, .sty, ...) is hashed as written.
+    """
+    digest = hashlib.sha256()
+    for part in (CACHE_VERSION, engine, options, normalize_latex(source)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for path in sorted(files or ()):
+        content = files[path]
+        for part in (path, normalize_latex(content) if path.endswith(".tex") else content):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def artifact_path(key: str) -> str:
+    """Where the PDF for a key lives (fanned out over 256 folders)."""
+    return os.path.join(ARTIFACT_DIR, key[:2], f"{key}.pdf")
+
+
+def pdf_url_for(note_id: int) -> str:
+    """The pdf_url stored on a compiled note (served by GET /notes/{id}/pdf)."""
+    return f"/notes/{note_id}/pdf"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def lookup(db: AsyncSession, key: str) -> Optional[Artifact]:
+    """Return the cached artifact for a key, or None on a cache miss."""
+    artifact = await db.get(Artifact, key)
+    if artifact is None or not await asyncio.to_thread(os.path.exists, artifact_path(key)):
+        return None
+    return artifact
+
+
+def _existing_files(keys: List[str]) -> Set[str]:
+    return {key for key in keys if os.path.exists(artifact_path(key))}
+
+
+async def lookup_many(db: AsyncSession, keys: Iterable[str]) -> Set[str]:
+    """Bulk lookup(): which of these keys have a cached PDF."""
+    keys = list(dict.fromkeys(keys))
+    found = []
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        found.extend(await db.scalars(select(Artifact.key).where(Artifact.key.in_(chunk))))
+    return await asyncio.to_thread(_existing_files, found)
+
+
+async def register(db: AsyncSession, key: str) -> Artifact:
+    """Record a freshly compiled PDF in the store (no references yet)."""
+    size = await asyncio.to_thread(os.path.getsize, artifact_path(key))
+    artifact = await db.get(Artifact, key)
+    if artifact is None:
+        artifact = Artifact(key=key, size_bytes=size, ref_count=0, last_used_at=_now())
+        db.add(artifact)
+    else:
+        artifact.size_bytes = size
+        artifact.last_used_at = _now()
+    return artifact
+
+
+async def _adjust_refs(db: AsyncSession, key: str, delta: int) -> bool:
+    """Change an artifact's reference count. False if the artifact is gone (evicted)."""
+    values = {"ref_count": Artifact.ref_count + delta}
+    if delta > 0:
+        values["last_used_at"] = _now()
+    result = await db.execute(
+        update(Artifact)
+        .where(Artifact.key == key)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+async def attach_note(db: AsyncSession, note_id: int, current_key: Optional[str], key: str) -> bool:
+    """
+    Point a note at an artifact, moving its reference off the old one.
+    Sets status/pdf_url without touching updated_at (a compile is not an edit).
+    Returns False, changing nothing, if the artifact was evicted meanwhile.
+    """
+    return not await attach_notes(db, [(note_id, current_key, key)])
+
+
+async def attach_notes(db: AsyncSession, attachments: List[Tuple[int, Optional[str], str]]) -> Set[str]:
+    """
+    Bulk attach_note() for (note_id, current_key, key) triples: one
+    reference-count update per distinct key, one executemany for the notes.
+
+    Returns the keys that could not be attached. A lookup and this call are
+    separate statements, and trim_store() in another session may evict an
+    unreferenced PDF in between; taking the reference is what decides.
+    Notes whose key is returned are left as they were - the caller has to
+    compile them instead.
+    """
+    if not attachments:
+        return set()
+    gained = Counter(key for _, current_key, key in attachments if current_key != key)
+    evicted = set()
+    for key, count in gained.items():
+        # The UPDATE locks the row, so once it matched, trim_store's
+        # "ref_count <= 0" re-check can no longer delete it
+        if not await _adjust_refs(db, key, count):
+            evicted.add(key)
+    attachments = [attachment for attachment in attachments if attachment[2] not in evicted]
+    lost = Counter(current_key for _, current_key, key in attachments
+                   if current_key != key and current_key is not None)
+    for key, count in lost.items():
+        await _adjust_refs(db, key, -count)
+    if not attachments:
+        return evicted
+
+    notes = Note.__table__
+    # Core executemany: per-row values, and updated_at set to itself so the
+    # onupdate hook doesn't stamp a compile as an edit
+    await db.execute(
+        update(notes)
+        .where(notes.c.id == bindparam("note_id"))
+        .values(
+            artifact_key=bindparam("key"),
+            pdf_url=bindparam("url"),
+            status="completed",
+            updated_at=notes.c.updated_at,
+        ),
+        [{"note_id": note_id, "key": key, "url": pdf_url_for(note_id)} for note_id, _, key in attachments],
+    )
+    return evicted
+
+
+async def release(db: AsyncSession, key: Optional[str]) -> None:
+    """Drop one reference to an artifact (e.g. its note was deleted)."""
+    if key is not None:
+        await _adjust_refs(db, key, -1)
+
+
+async def release_many(db: AsyncSession, keys: Iterable[Optional[str]]) -> None:
+    """Bulk release(): one update per distinct key."""
+    for key, count in Counter(key for key in keys if key is not None).items():
+        await _adjust_refs(db, key, -count)
+
+
+def _remove_files(keys: List[str]) -> None:
+    for key in keys:
+        try:
+            os.remove(artifact_path(key))
+        except FileNotFoundError:
+            pass
+
+
+async def trim_store(db: AsyncSession, max_bytes: int = config.ARTIFACT_STORE_MAX_MB * 1024 * 1024) -> int:
+    """
+    Evict least recently used, unreferenced PDFs until the store fits its
+    budget. PDFs that any note still uses are never evicted.
+    Commits, then deletes the files. Returns the number of PDFs removed.
+    """
+    total = await db.scalar(select(func.coalesce(func.sum(Artifact.size_bytes), 0)))
+    if total <= max_bytes:
+        return 0
+
+    victims = []
+    candidates = await db.execute(
+        select(Artifact.key, Artifact.size_bytes)
+        .where(Artifact.ref_count <= 0)
+        .order_by(Artifact.last_used_at)
+        .limit(TRIM_BATCH)
+    )
+    for key, size in candidates:
+        if total <= max_bytes:
+            break
+        victims.append(key)
+        total -= size
+
+    # Re-check ref_count per row: a note may have attached in the meantime
+    evicted = []
+    for key in victims:
+        result = await db.execute(
+            delete(Artifact).where(Artifact.key == key, Artifact.ref_count <= 0)
+        )
+        if result.rowcount:
+            evicted.append(key)
+    await db.commit()
+
+    await asyncio.to_thread(_remove_files, evicted)
+    return len(evicted)
@@ -1,12 +1,21 @@
 # Authentication service - handles password hashing and JWT tokens
 
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import config
 from app.models import User
 from app.schemas import UserCreate
+from app.services import metrics
 
 # Configuration
 SECRET_KEY = "your-secret-key-change-in-production"  # TODO: Move to environment variable
@@ -14,7 +23,15 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Password hashing setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=config.BCRYPT_ROUNDS,
+    # min == max == rounds: any stored hash with a different cost "needs
+    # update", so changing BCRYPT_ROUNDS rehashes each user at next login
+    bcrypt__min_rounds=config.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=config.BCRYPT_ROUNDS,
+)
 
 def hash_password(password: str) -> str:
     """Hash a plain password using bcrypt."""
@@ -24,6 +41,63 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hash."""
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already waiting - shed this request."""
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool instead of the event loop.
+
+    One bcrypt call takes 100-300 ms of CPU. Inline, a burst of logins
+    froze every request on the worker. Here the loop just awaits while a
+    pool thread hashes (bcrypt releases the GIL, so threads really run in
+    parallel). The pool is capped at `workers` threads, and at most
+    `max_pending` hashes may be running or queued - beyond that callers get
+    PasswordHasherBusy right away instead of piling up behind each other.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, max_pending: int):
+        self.context = context
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0  # Only touched from the event loop thread
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, operation: str, func, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            metrics.PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHasherBusy()
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            metrics.PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+    async def hash(self, password: str) -> str:
+        """Hash a plain password with the configured bcrypt cost."""
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password. Returns (valid, new_hash) - new_hash is set when
+        the stored hash uses an old bcrypt cost and should be replaced.
+        """
+        return await self._run("verify", self.context.verify_and_update, password, hashed_password)
+
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=config.PASSWORD_HASH_WORKERS,
+    max_pending=config.PASSWORD_HASH_MAX_PENDING,
+)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -43,27 +117,158 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-def create_user(db: Session, user: UserCreate) -> User:
+async def create_user(db: AsyncSession, user: UserCreate) -> User:
     """Create a new user with hashed password."""
-    hashed_password = hash_password(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = User(
         email=user.email,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Authenticate a user by email and password."""
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
+    """
+    Authenticate a user by email and password.
+    Transparently upgrades the stored hash if BCRYPT_ROUNDS has changed.
+    """
+    user = await get_user_by_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-def get_user_by_email(db: Session, email: str) -> Optional[User]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """Get user by email address."""
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
+
+
+# Authenticated-user cache
+#
+# Every authenticated request used to decode the JWT and then query the
+# users table just to learn who is calling. Tokens are immutable, so once a
+# token has been verified we remember the identity it maps to for a short
+# while. Any change to a user row drops that user's entries immediately;
+# other server processes see the change within AUTH_CACHE_TTL_SECONDS.
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Who is calling - enough to filter by owner without loading the User row."""
+    id: int
+    email: str
+
+class TokenCache:
+    """Thread-safe LRU cache of verified token -> AuthenticatedUser with a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (identity, expires_at)
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        """Return the cached identity for a token, or None if absent/expired."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            identity, expires_at = entry
+            if expires_at <= time.time():
+                self._remove_locked(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return identity
+
+    def put(self, token: str, identity: AuthenticatedUser, token_expires_at: float) -> None:
+        """Remember a verified token - never past the token's own expiry."""
+        expires_at = min(time.time() + self.ttl_seconds, token_expires_at)
+        with self._lock:
+            self._remove_locked(token)
+            self._entries[token] = (identity, expires_at)
+            self._tokens_by_user.setdefault(identity.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Forget every cached token of a user (call whenever the user changes)."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove_locked(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove_locked(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0].id)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0].id]
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size, for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+user_cache = TokenCache(
+    max_entries=config.AUTH_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.AUTH_CACHE_TTL_SECONDS,
+)
+
+# Drop cached identities whenever a user row is updated or deleted through
+# the ORM. Bulk update()/delete() statements skip these hooks - call
+# user_cache.invalidate_user() yourself after those.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate_user(target.id)
+
+async def resolve_token(db: AsyncSession, token: str) -> Optional[AuthenticatedUser]:
+    """
+    Turn a bearer token into the caller's identity.
+    Served from user_cache when possible; otherwise verifies the JWT and
+    checks the user still exists (one query), then caches the result.
+    """
+    identity = user_cache.get(token)
+    if identity is not None:
+        return identity
+
+    payload = verify_token(token)
+    if payload is None:
+        return None
+    email = payload.get("sub")
+    if email is None:
+        return None
+
+    user = await get_user_by_email(db, email=email)
+    # Tokens issued before "uid" existed only carry the email - still accepted
+    if user is None or payload.get("uid", user.id) != user.id:
+        return None
+
+    identity = AuthenticatedUser(id=user.id, email=user.email)
+    user_cache.put(token, identity, token_expires_at=float(payload["exp"]))
+    return identity
@@ -0,0 +1,130 @@
+# Downloads - streaming file responses with HTTP Range and conditional GET
+#
+# PDF viewers (pdf.js, browsers) open large PDFs by fetching byte ranges:
+# first the trailer at the end of the file, then whichever pages are on
+# screen. This module answers those requests straight from the file on
+# disk, a chunk at a time, so a 200 MB PDF never sits in worker memory.
+#
+# Where the ASGI server offers the http.response.zerocopy extension, the
+# bytes skip Python entirely: the server calls sendfile() on our open file.
+# Otherwise we fall back to os.pread() in a thread, CHUNK_SIZE at a time.
+
+import os
+import re
+from typing import BinaryIO, Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", re.IGNORECASE)
+
+
+class RangeNotSatisfiable(Exception):
+    """The Range header asks for bytes past the end of the file (HTTP 416)."""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Turn a Range header into an inclusive (start, end) byte range.
+
+    Returns None when the whole file should be sent: no header, a header we
+    don't understand, or several ranges at once (allowed by RFC 9110 - the
+    client just gets a 200 with everything). Raises RangeNotSatisfiable
+    when the range starts past the end of the file.
+    """
+    if not header or "," in header:
+        return None
+    match = _RANGE.match(header)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # "bytes=-500" = the last 500 bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None  # Invalid range - ignore it
+    return start, end
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Does an If-None-Match header list this ETag (or "*")?"""
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class FileRangeResponse(Response):
+    """
+    ASGI response that sends an already-open file (or one byte range of it).
+
+    Taking an open file instead of a path matters: the artifact store may
+    evict the file while we stream, but an open file keeps reading the
+    bytes we checked. The file is closed when the response finishes.
+    """
+
+    def __init__(self, file: BinaryIO, size: int, headers: dict,
+                 byte_range: Optional[Tuple[int, int]] = None, send_body: bool = True):
+        self.file = file
+        self.background = None
+        self.size = size
+        self.send_body = send_body
+        if byte_range is None:
+            self.status_code = 200
+            self.offset, self.length = 0, size
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset, self.length = start, end - start + 1
+            headers = {**headers, "content-range": f"bytes {start}-{end}/{size}"}
+        headers = {**headers, "accept-ranges": "bytes", "content-length": str(self.length)}
+        self.raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in headers.items()]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code,
+                        "headers": self.raw_headers})
+            if not self.send_body or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            extensions = scope.get("extensions") or {}
+            if "http.response.zerocopy" in extensions:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": self.file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            else:
+                await self._send_chunks(send)
+        finally:
+            self.file.close()
+
+    async def _send_chunks(self, send: Send) -> None:
+        # pread takes an explicit offset, so there is no shared file position
+        fd = self.file.fileno()
+        position, remaining = self.offset, self.length
+        while remaining > 0:
+            chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, remaining), position)
+            if not chunk:
+                break  # File shrank underneath us - end the body early
+            position += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
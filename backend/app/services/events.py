@@ -0,0 +1,182 @@
+# Events - in-process pub/sub that pushes compile status to clients (SSE)
+#
+# Instead of polling GET /notes/{id}, clients keep one GET /events stream
+# open and receive a small JSON message whenever one of their notes moves
+# through the compile pipeline:
+#
+#   pending -> compiling -> completed / failed (with the error summary)
+#
+# While a note is compiling, `progress` events say which step the worker
+# is at (TeX pass 2 of 4, bibtex, ...).
+#
+# The broker is built for many idle connections: a subscriber is just a
+# bounded deque plus an asyncio.Event, indexed by user id, so publishing
+# costs O(subscribers of that user) and an idle stream costs no CPU.
+#
+# Status events describe committed state. Code inside a transaction calls
+# publish_after_commit(db, ...), and the event goes out only when that
+# session commits (and is dropped on rollback), so a client never hears
+# about a status it then can't read back. Progress isn't stored anywhere,
+# so the dispatcher publishes it directly.
+#
+# The broker lives in one process. With several server processes, each
+# stream only hears about compiles dispatched by its own process.
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import config
+
+# Session.info key holding events waiting for their transaction to commit
+_PENDING_KEY = "pending_events"
+
+
+class Subscription:
+    """One open event stream: a user's events, optionally for one note only."""
+
+    __slots__ = ("user_id", "note_id", "events", "ready", "overflowed", "missed")
+
+    def __init__(self, user_id: int, note_id: Optional[int], max_pending: int):
+        self.user_id = user_id
+        self.note_id = note_id
+        self.events: Deque[Tuple[int, dict]] = deque(maxlen=max_pending)
+        self.ready = asyncio.Event()
+        self.overflowed = False  # Events were dropped - the client should reload
+        self.missed = False      # Its Last-Event-ID couldn't be replayed - same
+
+    def _deliver(self, sequence: int, payload: dict) -> None:
+        if self.note_id is not None and payload.get("note_id") != self.note_id:
+            return
+        if len(self.events) == self.events.maxlen:
+            self.overflowed = True  # deque drops the oldest event
+        self.events.append((sequence, payload))
+        self.ready.set()
+
+    async def next_events(self, timeout: float) -> List[Tuple[int, dict]]:
+        """Wait up to `timeout` seconds and return everything queued (maybe nothing)."""
+        if not self.events:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class TooManySubscriptions(Exception):
+    """The user already has EVENTS_MAX_STREAMS_PER_USER streams open."""
+
+
+class EventBroker:
+    """
+    Fans events out to the subscriptions of the user they belong to.
+    Remembers the last `history` events so a reconnecting client can ask
+    for what it missed (SSE Last-Event-ID).
+
+    Sequence numbers start at the process start time in microseconds, so
+    they keep growing across restarts: an id from before a restart is
+    older than anything in the history and is recognized as unreplayable,
+    instead of being mistaken for an id of this process.
+    """
+
+    def __init__(self, max_pending: int = config.EVENTS_QUEUE_SIZE,
+                 history: int = config.EVENTS_HISTORY_SIZE,
+                 max_per_user: int = config.EVENTS_MAX_STREAMS_PER_USER):
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._history: Deque[Tuple[int, int, dict]] = deque(maxlen=history)  # (sequence, user_id, payload)
+        self._sequence = itertools.count(time.time_ns() // 1000)
+        self._last_sequence = None  # Highest sequence handed out so far
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self.published = 0
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def subscribe(self, user_id: int, note_id: Optional[int] = None,
+                  last_event_id: Optional[int] = None) -> Subscription:
+        """Open a subscription (call from the event loop). Raises TooManySubscriptions."""
+        subscriptions = self._subscribers.setdefault(user_id, set())
+        if len(subscriptions) >= self.max_per_user:
+            raise TooManySubscriptions()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        subscription = Subscription(user_id, note_id, self.max_pending)
+        if last_event_id is not None and not self._can_replay(last_event_id):
+            subscription.missed = True
+        elif last_event_id is not None:
+            for sequence, owner, payload in self._history:
+                if sequence > last_event_id and owner == user_id:
+                    subscription._deliver(sequence, payload)
+        subscriptions.add(subscription)
+        return subscription
+
+    def _can_replay(self, last_event_id: int) -> bool:
+        """Is every event after last_event_id still in the history?"""
+        if self._last_sequence is None or last_event_id > self._last_sequence:
+            return False  # Not an id of this process (e.g. from before a restart)
+        oldest = self._history[0][0] if self._history else self._last_sequence + 1
+        return last_event_id + 1 >= oldest
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: int, payload: dict) -> None:
+        """Send an event to every stream of one user. Safe to call from any thread."""
+        if self._loop is None:
+            return  # Nobody has ever subscribed in this process
+        if threading.get_ident() != self._loop_thread:
+            self._loop.call_soon_threadsafe(self.publish, user_id, payload)
+            return
+        sequence = next(self._sequence)
+        self._last_sequence = sequence
+        self._history.append((sequence, user_id, payload))
+        self.published += 1
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription._deliver(sequence, payload)
+
+
+def publish_after_commit(db, user_id: int, payload: dict) -> None:
+    """Queue an event on a session; it is published once the session commits."""
+    db.info.setdefault(_PENDING_KEY, []).append((user_id, payload))
+
+
+def status_event(note_id: int, status: str, **details) -> dict:
+    """The payload of a compile status change."""
+    return {"type": "status", "note_id": note_id, "status": status, **details}
+
+
+def progress_event(note_id: int, step: str, **details) -> dict:
+    """The payload of a running compile's progress (see latex_worker._report_progress)."""
+    return {"type": "progress", "note_id": note_id, "step": step, **details}
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session) -> None:
+    for user_id, payload in session.info.pop(_PENDING_KEY, ()):
+        event_broker.publish(user_id, payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+# The single broker used by the app
+event_broker = EventBroker()
@@ -0,0 +1,77 @@
+# HTTP caching - validators and conditional requests for note responses
+#
+# Clients refresh notes much more often than notes change. Each response
+# carries validators; the next request sends them back and, if nothing
+# changed, gets an empty 304 after a metadata-only query - the LaTeX body
+# is never read, decompressed or sent:
+#
+#   ETag: "<version>.<changed_at in µs>"   (strong, one note)
+#   ETag: W/"<hash of the page's rows>"    (weak, a page of the note list)
+#   Last-Modified: changed_at              (one note; second precision)
+#
+# A note's ETag starts with its version, so the same value works as
+# If-Match for writes (see api/notes.py) - only the version part is
+# compared there, so a compile finishing in between doesn't cause a 409.
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+
+from app.services.downloads import etag_matches
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def note_etag(version: int, changed_at: datetime) -> str:
+    """Strong ETag of one note: changes whenever anything in its JSON does."""
+    return f'"{version}.{_micros(changed_at)}"'
+
+
+def list_etag(rows: Iterable[Tuple[int, int, datetime]], *parts: object) -> str:
+    """
+    Weak ETag of a page of notes from (id, version, changed_at) of its rows
+    and whatever else shapes the page (cursor, flags). Weak: the same rows
+    always give the same JSON, but we don't promise byte-identical bodies.
+    """
+    digest = hashlib.sha1(repr(parts).encode())
+    for note_id, version, changed_at in rows:
+        digest.update(b"%d:%d:%d;" % (note_id, version, _micros(changed_at)))
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(_utc(moment).replace(microsecond=0), usegmt=True)
+
+
+def not_modified(headers, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    Is the client's copy current? If-None-Match wins when both are sent
+    (RFC 9110 13.2.2); If-Modified-Since compares whole seconds.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag.removeprefix("W/"))
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False  # An unparseable date is ignored
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return _utc(last_modified).replace(microsecond=0) <= since
+
+
+def has_validators(headers) -> bool:
+    return "if-none-match" in headers or "if-modified-since" in headers
+
+
+def _utc(moment: datetime) -> datetime:
+    # SQLite hands DateTime(timezone=True) values back naive - they are UTC
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+
+def _micros(moment: datetime) -> int:
+    return (_utc(moment) - _EPOCH) // timedelta(microseconds=1)
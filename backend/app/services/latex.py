@@ -0,0 +1,559 @@
+# LaTeX compilation service - turns note source into PDFs in the background
+#
+# How the pieces fit together:
+#   1. API handlers call enqueue_compile() - this only adds a row to the
+#      compile_jobs table, so saving a note never waits for TeX.
+#   2. CompileDispatcher runs inside the web process. It claims queued jobs
+#      and hands them to a bounded pool of worker processes (one per core).
+#   3. Each worker runs the TeX engine sandboxed with CPU, memory and
+#      wall-clock limits (see latex_worker.py).
+#   4. The dispatcher writes the result back: the note moves
+#      pending -> compiling -> completed/failed and gets its pdf_url.
+#
+# Every compile goes through the artifact store first (artifacts.py): a
+# note whose normalized source was compiled before just points at the
+# existing PDF and never reaches a worker. Notes that do compile reuse a
+# precompiled preamble when one exists (preamble.py), and the .aux/.bbl
+# files of their previous compile (the worker's build folder).
+#
+# A multi-file note compiles together with the project files its main
+# document reaches (projects.py) - those are part of the cache key too.
+#
+# The queue lives in the database, so jobs survive restarts. Every status
+# change is also pushed to the note owner's open event streams (events.py),
+# and so is the progress of running compiles (which TeX pass, bibtex...).
+
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.database import AsyncSessionLocal
+from app.models import Note, CompileJob
+from app.services import artifacts, metrics, projects
+from app.services.events import event_broker, progress_event, publish_after_commit, status_event
+from app.services.latex_worker import CompileLimits, CompileResult, compile_latex
+from app.services.preamble import preamble_cache
+
+logger = logging.getLogger(__name__)
+
+LIMITS = CompileLimits(
+    cpu_seconds=config.LATEX_CPU_SECONDS,
+    wall_seconds=config.LATEX_WALL_SECONDS,
+    memory_mb=config.LATEX_MEMORY_MB,
+)
+
+# Extra time we give a worker beyond its own wall-clock limit before the
+# dispatcher stops waiting for it
+WORKER_GRACE_SECONDS = 30
+
+# Job priorities - higher runs first
+PRIORITY_BACKGROUND = 0   # Saves, batches, imports
+PRIORITY_INTERACTIVE = 1  # The user pressed "compile now"
+
+# How often the dispatcher checks whether a running job was superseded
+# (and reports its progress)
+CANCEL_CHECK_SECONDS = 1.0
+
+# A running job is told to stop by creating storage/cancel/<job id>
+CANCEL_DIR = os.path.join(config.STORAGE_DIR, "cancel")
+
+# ...and reports the step it is at in storage/progress/<job id>
+PROGRESS_DIR = os.path.join(config.STORAGE_DIR, "progress")
+
+# Monotonic turn counter for fair scheduling
+_turns = itertools.count(1)
+
+# forkserver avoids forking the web process (and its threads) for every
+# worker; fall back to spawn where forkserver does not exist
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+async def enqueue_compile(db: AsyncSession, note: Note,
+                          priority: int = PRIORITY_BACKGROUND) -> Optional[CompileJob]:
+    """
+    Queue a compilation for a note.
+
+    If the artifact store already has a PDF for this source, the note is
+    pointed at it right away and no job is created (returns None).
+    The caller commits, then calls compile_dispatcher.notify().
+    """
+    return (await enqueue_compiles(db, [note], priority))[0]
+
+
+async def enqueue_compiles(db: AsyncSession, notes: Sequence[Note],
+                           priority: int = PRIORITY_BACKGROUND) -> List[Optional[CompileJob]]:
+    """
+    enqueue_compile() for many notes at once (batch saves and imports):
+    one query per step instead of one per note. Returns the job for each
+    note, or None where a cached PDF was attached.
+
+    Edits are coalesced: a note has at most one queued job. A newer save
+    reuses it and pushes its start time back (debounce), and a compile of
+    the old text that is already running is stopped.
+    """
+    await db.flush()  # Write pending edits first - the cache hit path updates with SQL
+    note_ids = [note.id for note in notes]
+    queued: Dict[int, CompileJob] = {}
+    for start in range(0, len(note_ids), artifacts.LOOKUP_CHUNK):
+        chunk = note_ids[start:start + artifacts.LOOKUP_CHUNK]
+        await _cancel_running(db, chunk)
+        queued.update(await _queued_jobs(db, chunk))
+
+    project_files = await projects.load_files(db, note_ids)
+    keys = [
+        artifacts.cache_key(
+            note.latex_content, config.LATEX_ENGINE,
+            files=projects.compile_files(note.latex_content, project_files.get(note.id, {})),
+        )
+        for note in notes
+    ]
+    cached = await artifacts.lookup_many(db, keys)
+    # Take the references first: a PDF evicted since the lookup can't be
+    # attached, and its note is compiled like any other miss
+    cached -= await artifacts.attach_notes(db, [
+        (note.id, note.artifact_key, key) for note, key in zip(notes, keys) if key in cached
+    ])
+
+    now = _now()
+    jobs: List[Optional[CompileJob]] = []
+    hits = 0
+    for note, key in zip(notes, keys):
+        job = queued.get(note.id)
+        if key in cached:
+            if job is not None:
+                job.status = "cancelled"
+            hits += 1
+            jobs.append(None)
+            publish_after_commit(db, note.user_id, status_event(
+                note.id, "completed", pdf_url=artifacts.pdf_url_for(note.id), cached=True))
+            continue
+        note.status = "pending"
+        if job is None:
+            job = CompileJob(note_id=note.id, user_id=note.user_id, status="queued", priority=priority)
+            db.add(job)
+        job.priority = max(job.priority or 0, priority)
+        job.not_before = _start_time(job, now)
+        jobs.append(job)
+        publish_after_commit(db, note.user_id, status_event(note.id, "pending"))
+    metrics.count_cache_lookups("artifact", hits=hits, misses=len(notes) - hits)
+    return jobs
+
+
+def _as_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """SQLite hands datetimes back without a timezone - they are UTC."""
+    if moment is not None and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def _start_time(job: CompileJob, now: datetime) -> datetime:
+    """
+    When a queued job may start: right away for "compile now", otherwise
+    once the note has been quiet for LATEX_DEBOUNCE_SECONDS - but no later
+    than LATEX_DEBOUNCE_MAX_SECONDS after the job was first queued.
+    """
+    if job.priority >= PRIORITY_INTERACTIVE:
+        return now
+    start = now + timedelta(seconds=config.LATEX_DEBOUNCE_SECONDS)
+    first_queued = _as_utc(job.created_at) or now
+    return min(start, max(now, first_queued + timedelta(seconds=config.LATEX_DEBOUNCE_MAX_SECONDS)))
+
+
+async def _queued_jobs(db: AsyncSession, note_ids: Sequence[int]) -> Dict[int, CompileJob]:
+    """The queued job of each note (extra ones, left by older versions, are cancelled)."""
+    jobs: Dict[int, CompileJob] = {}
+    for job in await db.scalars(
+        select(CompileJob)
+        .where(CompileJob.note_id.in_(note_ids), CompileJob.status == "queued")
+        .order_by(CompileJob.id)
+    ):
+        if job.note_id in jobs:
+            job.status = "cancelled"
+        else:
+            jobs[job.note_id] = job
+    return jobs
+
+
+async def _cancel_running(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """
+    Running jobs of these notes compile stale source - mark them cancelled.
+    The dispatcher notices and stops the TeX process; its result will not
+    touch the note either way.
+    """
+    await db.execute(
+        update(CompileJob)
+        .where(CompileJob.note_id.in_(note_ids), CompileJob.status == "running")
+        .values(status="cancelled")
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def cancel_compiles(db: AsyncSession, note_id: int) -> None:
+    """Drop every job for a note (used when the note is deleted)."""
+    await db.execute(delete(CompileJob).where(CompileJob.note_id == note_id))
+
+
+async def cancel_compiles_many(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """Bulk cancel_compiles() for notes deleted together."""
+    for start in range(0, len(note_ids), artifacts.LOOKUP_CHUNK):
+        chunk = note_ids[start:start + artifacts.LOOKUP_CHUNK]
+        await db.execute(delete(CompileJob).where(CompileJob.note_id.in_(chunk)))
+
+
+async def queue_counts(db: AsyncSession) -> Dict[str, int]:
+    """Number of queued and running compile jobs (for monitoring)."""
+    counts = dict((await db.execute(
+        select(CompileJob.status, func.count())
+        .where(CompileJob.status.in_(("queued", "running")))
+        .group_by(CompileJob.status)
+    )).all())
+    return {status: counts.get(status, 0) for status in ("queued", "running")}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def _set_note_status(db: AsyncSession, note_id: int, values: dict) -> None:
+    """
+    Update compile fields on a note without touching updated_at.
+    updated_at means "the user edited this", not "the compiler ran".
+    """
+    await db.execute(
+        update(Note)
+        .where(Note.id == note_id)
+        .values({**values, "updated_at": Note.updated_at})
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _requeue_interrupted() -> None:
+    """Jobs left 'running' by a previous process will never finish - retry them."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(CompileJob).where(CompileJob.status == "running").values(status="queued")
+        )
+        await db.commit()
+
+
+async def _pick_job(db: AsyncSession, served: Dict[int, int]) -> Optional[int]:
+    """
+    Choose the next job to run, fairly:
+      1. users below LATEX_MAX_JOBS_PER_USER running jobs before users at it
+      2. "compile now" before background saves
+      3. the user who was served longest ago (served = {user_id: turn})
+      4. the oldest job of that user
+    Only jobs whose debounce time has passed are eligible.
+    """
+    candidates = (await db.execute(
+        select(CompileJob.user_id, CompileJob.priority, func.min(CompileJob.id))
+        .where(
+            CompileJob.status == "queued",
+            or_(CompileJob.not_before.is_(None), CompileJob.not_before <= _now()),
+        )
+        .group_by(CompileJob.user_id, CompileJob.priority)
+    )).all()
+    if not candidates:
+        return None
+    running = dict((await db.execute(
+        select(CompileJob.user_id, func.count())
+        .where(CompileJob.status == "running")
+        .group_by(CompileJob.user_id)
+    )).all())
+
+    def order(candidate):
+        user_id, priority, job_id = candidate
+        at_limit = running.get(user_id, 0) >= config.LATEX_MAX_JOBS_PER_USER
+        return at_limit, -priority, served.get(user_id, 0), job_id
+
+    return min(candidates, key=order)[2]
+
+
+async def _seconds_until_due() -> Optional[float]:
+    """How long until the earliest debounced job may start (None: nothing waiting)."""
+    async with AsyncSessionLocal() as db:
+        due = await db.scalar(
+            select(func.min(CompileJob.not_before))
+            .where(CompileJob.status == "queued", CompileJob.not_before > _now())
+        )
+    if due is None:
+        return None
+    return max(0.0, (_as_utc(due) - _now()).total_seconds())
+
+
+async def _claim_next_job(served: Dict[int, int]) -> Optional[Tuple[int, int, int, str, Dict[str, str], str]]:
+    """
+    Atomically take the next queued job (see _pick_job) that actually
+    needs a compile, and record the turn in `served`.
+    Returns (job_id, note_id, user_id, latex_source, project_files, artifact_key) or
+    None when no job is ready. Jobs whose PDF is already cached are
+    finished here.
+    """
+    async with AsyncSessionLocal() as db:
+        while True:
+            job_id = await _pick_job(db, served)
+            if job_id is None:
+                return None
+
+            # Conditional UPDATE: if another process claimed it first, rowcount is 0
+            claimed = await db.execute(
+                update(CompileJob)
+                .where(CompileJob.id == job_id, CompileJob.status == "queued")
+                .values(status="running", attempts=CompileJob.attempts + 1, started_at=_now())
+                .execution_options(synchronize_session=False)
+            )
+            if not claimed.rowcount:
+                await db.rollback()
+                continue
+            job = await db.get(CompileJob, job_id)
+            served[job.user_id] = next(_turns)
+
+            note = await db.get(Note, job.note_id)
+            if note is None:
+                job.status = "failed"
+                job.error = "Note no longer exists"
+                job.finished_at = _now()
+                await db.commit()
+                continue
+
+            files = projects.compile_files(
+                note.latex_content, (await projects.load_files(db, [note.id])).get(note.id, {})
+            )
+            key = artifacts.cache_key(note.latex_content, config.LATEX_ENGINE, files=files)
+            # attach_note() fails if the PDF was evicted since the lookup - compile then
+            cached = (await artifacts.lookup(db, key) is not None
+                      and await artifacts.attach_note(db, note.id, note.artifact_key, key))
+            metrics.count_cache_lookups("artifact", hits=int(cached), misses=int(not cached))
+            if cached:
+                # An identical note compiled while this one waited in the queue
+                publish_after_commit(db, note.user_id, status_event(
+                    note.id, "completed", pdf_url=artifacts.pdf_url_for(note.id), cached=True))
+                job.status = "completed"
+                job.finished_at = _now()
+                await db.commit()
+                continue
+
+            await _set_note_status(db, note.id, {"status": "compiling"})
+            publish_after_commit(db, note.user_id, status_event(note.id, "compiling"))
+            await db.commit()
+            return job.id, note.id, note.user_id, note.latex_content, files, key
+
+
+async def _is_superseded(job_id: int) -> bool:
+    """Was a running job cancelled (by a newer save, or its note's deletion)?"""
+    async with AsyncSessionLocal() as db:
+        status = await db.scalar(select(CompileJob.status).where(CompileJob.id == job_id))
+    return status != "running"
+
+
+def _read_progress(path: str) -> Optional[dict]:
+    """A running job's progress file (see latex_worker._report_progress), if any yet."""
+    try:
+        with open(path, "r", encoding="utf-8") as progress:
+            value = json.load(progress)
+    except (OSError, ValueError):
+        return None
+    return value if isinstance(value, dict) and isinstance(value.get("step"), str) else None
+
+
+async def _finish_job(job_id: int, note_id: int, key: str, result: CompileResult) -> None:
+    """Record a worker's result on the job, the store and (if still current) the note."""
+    async with AsyncSessionLocal() as db:
+        job = await db.get(CompileJob, job_id)
+        # A cancelled job was superseded by a newer save (or its note was
+        # deleted) - its result must not overwrite the note
+        still_current = job is not None and job.status == "running"
+        if job is not None:
+            if still_current:
+                job.status = "completed" if result.ok else "failed"
+            job.error = result.error
+            job.finished_at = _now()
+
+        if result.ok:
+            # Even if nobody wants this PDF any more it is a valid cache entry
+            await artifacts.register(db, key)
+            await db.flush()
+
+        note = (await db.execute(
+            select(Note.id, Note.user_id, Note.artifact_key).where(Note.id == note_id)
+        )).first()
+        if note is not None and still_current:
+            if result.ok:
+                await artifacts.attach_note(db, note_id, note.artifact_key, key)
+                publish_after_commit(db, note.user_id, status_event(
+                    note_id, "completed", pdf_url=artifacts.pdf_url_for(note_id), passes=result.passes))
+            else:
+                await _set_note_status(db, note_id, {"status": "failed"})
+                publish_after_commit(db, note.user_id, status_event(note_id, "failed", error=result.error))
+        await db.commit()
+
+        if result.ok:
+            await artifacts.trim_store(db)
+
+
+class CompileDispatcher:
+    """
+    Feeds queued compile jobs to a bounded pool of worker processes.
+
+    At most `workers` jobs run at once, handed out fairly between users
+    (see _pick_job). Handlers call notify() after queueing so new work
+    starts immediately; the dispatcher also wakes when the next debounced
+    job is due, and polls every LATEX_POLL_SECONDS to pick up jobs queued
+    by other processes.
+    """
+
+    def __init__(self, workers: int = config.LATEX_WORKERS):
+        self.workers = max(1, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self._served: Dict[int, int] = {}  # user_id -> turn of their last job
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context(_START_METHOD)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    async def start(self) -> None:
+        """Start the worker pool and the dispatch loop (called on app startup)."""
+        self._pool = self._new_pool()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._wakeup = asyncio.Event()
+        await _requeue_interrupted()
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop dispatching and shut the pool down (called on app shutdown)."""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def notify(self) -> None:
+        """Wake the dispatcher - call after committing new jobs."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._slots.acquire()
+            # Clear before looking so a notify() during the claim isn't lost
+            self._wakeup.clear()
+            try:
+                claimed = await _claim_next_job(self._served)
+                idle_for = None if claimed else await _seconds_until_due()
+            except Exception:
+                logger.exception("Could not claim a compile job")
+                claimed, idle_for = None, None
+
+            if claimed is None:
+                self._slots.release()
+                timeout = config.LATEX_POLL_SECONDS
+                if idle_for is not None:
+                    timeout = min(timeout, idle_for + 0.05)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if len(self._served) > 100_000:
+                self._served.clear()  # Forget old turns rather than grow forever
+
+            task = asyncio.create_task(self._execute(*claimed))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job_id: int, note_id: int, user_id: int, source: str,
+                       files: Dict[str, str], key: str) -> None:
+        loop = asyncio.get_running_loop()
+        format_plan = preamble_cache.plan(source, config.LATEX_ENGINE, files) if config.PREAMBLE_CACHE_ENABLED else None
+        cancel_path = os.path.join(CANCEL_DIR, str(job_id))
+        progress_path = os.path.join(PROGRESS_DIR, str(job_id))
+        started = time.perf_counter()
+        try:
+            os.makedirs(PROGRESS_DIR, exist_ok=True)
+            future = loop.run_in_executor(
+                self._pool, compile_latex, source, config.LATEX_ENGINE, LIMITS,
+                artifacts.artifact_path(key), format_plan,
+                files, projects.build_dir(note_id), config.LATEX_MAX_PASSES, cancel_path, progress_path,
+            )
+            result = await self._wait_for_worker(job_id, note_id, user_id, future, cancel_path, progress_path)
+        except asyncio.TimeoutError:
+            result = CompileResult(ok=False, error="Compile worker did not respond")
+        except BrokenProcessPool:
+            # A worker died hard (e.g. OOM killer) - replace the whole pool
+            logger.error("Compile worker pool broke, restarting it")
+            self._pool = self._new_pool()
+            result = CompileResult(ok=False, error="Compile worker crashed")
+        except Exception as exc:
+            logger.exception("Compile job %s crashed", job_id)
+            result = CompileResult(ok=False, error=f"Compile worker crashed: {exc}")
+        preamble_cache.finish(format_plan, result.format_built)
+        outcome = "cancelled" if result.cancelled else ("completed" if result.ok else "failed")
+        metrics.COMPILE_SECONDS.observe(time.perf_counter() - started, result=outcome)
+        for path in (cancel_path, progress_path, progress_path + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        try:
+            await _finish_job(job_id, note_id, key, result)
+        except Exception:
+            logger.exception("Could not record result of compile job %s", job_id)
+        finally:
+            self._slots.release()
+
+    async def _wait_for_worker(self, job_id: int, note_id: int, user_id: int, future: asyncio.Future,
+                               cancel_path: str, progress_path: str) -> CompileResult:
+        """
+        Wait for a worker's result. Meanwhile, check every
+        CANCEL_CHECK_SECONDS whether a newer save superseded the job, and
+        if so tell the worker to stop (it kills TeX and returns early).
+        Each new step the worker writes to its progress file is sent to the
+        note's owner as a progress event (steps shorter than a check are
+        never seen - only the latest one counts).
+        Raises asyncio.TimeoutError if the worker takes far too long.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LIMITS.wall_seconds + WORKER_GRACE_SECONDS
+        cancelled = False
+        reported = None
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait({future}, timeout=min(CANCEL_CHECK_SECONDS, remaining))
+            if done:
+                return future.result()
+            progress = _read_progress(progress_path)
+            if progress is not None and progress != reported and not cancelled:
+                reported = progress
+                event_broker.publish(user_id, progress_event(note_id, **progress))
+            if not cancelled and await _is_superseded(job_id):
+                cancelled = True
+                os.makedirs(CANCEL_DIR, exist_ok=True)
+                open(cancel_path, "w").close()
+
+
+# The single dispatcher used by the app - started/stopped in app.main
+compile_dispatcher = CompileDispatcher()
@@ -0,0 +1,426 @@
+# LaTeX analyzer - one-pass structural check of a LaTeX document
+#
+# Reads the source once, left to right, and reports:
+#   - unbalanced braces and \begin/\end environments, with line/column
+#   - inline and display math counts (and unclosed math)
+#   - \documentclass, \usepackage'd packages, \input/\include references
+#     and bibliography databases (\bibliography, \addbibresource)
+#   - a word count of the document text (no commands, math or comments)
+#
+# It understands the things a substring search gets wrong: \$ and \{ are
+# escapes, % starts a comment, $$ is display math, and verbatim content is
+# not LaTeX at all.
+#
+# The analyzer is incremental: feed() it chunks as they arrive and call
+# finish() at the end, so a huge upload is never held in memory at once.
+# Only the current (unfinished) line is buffered.
+
+import re
+from typing import List, Optional
+
+# Stop collecting errors after this many - one missing } can cascade
+MAX_ERRORS = 100
+
+# Longest unfinished line we buffer before processing part of it anyway
+MAX_PENDING_CHARS = 64 * 1024
+
+# Commands whose {argument} is a name, not text: captured, not word-counted
+ARGUMENT_COMMANDS = {
+    "begin", "end", "documentclass", "usepackage", "RequirePackage",
+    "input", "include", "includeonly", "label", "ref", "eqref", "pageref",
+    "cite", "citep", "citet", "bibliography", "bibliographystyle",
+    "addbibresource", "includegraphics", "url",
+}
+INCLUDE_COMMANDS = {"input", "include"}
+BIBLIOGRAPHY_COMMANDS = {"bibliography", "addbibresource"}
+PACKAGE_COMMANDS = {"usepackage", "RequirePackage"}
+
+# Environments that are display math
+DISPLAY_MATH_ENVIRONMENTS = {
+    "equation", "equation*", "align", "align*", "gather", "gather*",
+    "multline", "multline*", "flalign", "flalign*", "eqnarray", "eqnarray*",
+    "displaymath", "math",
+}
+# Environments whose body is read raw - nothing inside is LaTeX
+VERBATIM_ENVIRONMENTS = {"verbatim", "verbatim*", "Verbatim", "lstlisting", "minted", "comment"}
+
+_TOKEN = re.compile(
+    r"\\(?P<word>[A-Za-z@]+\*?)"      # control word: \section, \begin, \alpha
+    r"|\\(?P<symbol>.)"               # control symbol: \$ \{ \\ \( \[
+    r"|(?P<backslash>\\)$"            # backslash at the very end of a line
+    r"|(?P<comment>%)"
+    r"|(?P<dollars>\$\$?)"
+    r"|(?P<open>\{)|(?P<close>\})"
+    r"|(?P<lbracket>\[)|(?P<rbracket>\])"
+    r"|(?P<text>[^\\%${}\[\]]+)"
+)
+_SPECIAL = re.compile(r"[\\%${}\[\]]")
+_WORD = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*")
+
+
+class LatexAnalyzer:
+    """Incremental single-pass LaTeX analyzer: feed() chunks, then finish()."""
+
+    def __init__(self):
+        self.errors: List[dict] = []
+        self.document_class: Optional[str] = None
+        self.packages: List[str] = []
+        self.includes: List[dict] = []
+        self.bibliographies: List[str] = []
+        self.bibliography_style: Optional[str] = None
+        self.inline_math = 0
+        self.display_math = 0
+        self.words = 0
+        self.length = 0
+        self.lines = 0
+
+        self._pending = ""          # Unfinished line
+        self._line = 1              # Line number of _pending
+        self._column = 0            # Columns of this line already processed
+        self._rest_is_comment = False  # A % was seen earlier on this line
+        self._braces: List[tuple] = []          # (line, column) of each open {
+        self._environments: List[tuple] = []    # (name, line, column)
+        self._math: Optional[tuple] = None      # (delimiter, line, column) of open math
+        self._math_environments = 0
+        self._raw_environment: Optional[str] = None  # Inside verbatim-like env
+        self._verb_delimiter: Optional[str] = None   # Inside \verb|...|
+        self._argument: Optional[dict] = None   # Capturing an ARGUMENT_COMMANDS argument
+        self._begin_document = None
+        self._end_document = False
+        self._finished = False
+
+    # --- Input ---
+
+    def feed(self, chunk: str) -> None:
+        """Analyze the next piece of the document."""
+        self.length += len(chunk)
+        data = self._pending + chunk
+        start = 0
+        while True:
+            newline = data.find("\n", start)
+            if newline < 0:
+                break
+            self._process(data[start:newline].rstrip("\r"), end_of_line=True)
+            start = newline + 1
+        self._pending = data[start:]
+        if len(self._pending) > MAX_PENDING_CHARS:
+            # A giant line: process up to a space (never right after a
+            # backslash, which would split a control symbol)
+            cut = len(self._pending) - 1
+            while cut > 0 and not (self._pending[cut] in " \t" and self._pending[cut - 1] != "\\"):
+                cut -= 1
+            if cut > 0:
+                self._process(self._pending[:cut + 1], end_of_line=False)
+                self._pending = self._pending[cut + 1:]
+
+    def finish(self) -> dict:
+        """Finish the analysis and return the report (see report())."""
+        if not self._finished:
+            self._finished = True
+            if self._pending or self.length == 0:
+                self._process(self._pending.rstrip("\r"), end_of_line=True)
+                self._pending = ""
+            self._close_out()
+        return self.report()
+
+    # --- Reporting ---
+
+    def _error(self, message: str, line: int, column: int) -> None:
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"message": message, "line": line, "column": column})
+
+    def _close_out(self) -> None:
+        """Everything still open at the end of the input is an error."""
+        if self._argument is not None and self._argument["depth"] > 0:
+            self._error(f"Unclosed argument of \\{self._argument['command']}",
+                        self._argument["line"], self._argument["column"])
+        for name, line, column in reversed(self._environments):
+            self._error(f"\\begin{{{name}}} is never closed", line, column)
+        if self._math is not None:
+            delimiter, line, column = self._math
+            self._error(f"Math started with {delimiter} is never closed", line, column)
+        for line, column in reversed(self._braces):
+            self._error("Unmatched {", line, column)
+
+    def report(self) -> dict:
+        structural = []
+        if self.document_class is None:
+            structural.append("Missing \\documentclass")
+        if self._begin_document is None:
+            structural.append("Missing \\begin{document}")
+        if not self._end_document:
+            structural.append("Missing \\end{document}")
+        return {
+            "valid": not self.errors and not structural,
+            "errors": [{"message": message, "line": None, "column": None} for message in structural] + self.errors,
+            "document_class": self.document_class,
+            "packages": self.packages,
+            "includes": self.includes,
+            "bibliographies": self.bibliographies,
+            "bibliography_style": self.bibliography_style,
+            "stats": {
+                "length": self.length,
+                "lines": self.lines,
+                "words": self.words,
+                "inline_math": self.inline_math,
+                "display_math": self.display_math,
+                "math_expressions": self.inline_math + self.display_math,
+            },
+        }
+
+    # --- The scanner ---
+
+    def _process(self, text: str, end_of_line: bool) -> None:
+        """Scan one line (or the first part of a very long one)."""
+        line, offset = self._line, self._column
+        if end_of_line:
+            self.lines += 1
+            self._line += 1
+            self._column = 0
+        else:
+            self._column += len(text)
+
+        if self._rest_is_comment:
+            if end_of_line:
+                self._rest_is_comment = False
+            return
+
+        if (_SPECIAL.search(text) is None and self._raw_environment is None
+                and self._verb_delimiter is None and self._argument is None):
+            # Plain prose - most lines of a real document
+            self._token("text", text, line, offset + 1)
+            return
+
+        position = 0
+        length = len(text)
+        while position < length:
+            if self._raw_environment is not None:
+                marker = f"\\end{{{self._raw_environment}}}"
+                found = text.find(marker, position)
+                if found < 0:
+                    return
+                self._close_environment(self._raw_environment, line, offset + found + 1)
+                self._raw_environment = None
+                position = found + len(marker)
+                continue
+            if self._verb_delimiter is not None:
+                found = text.find(self._verb_delimiter, position)
+                if found < 0:
+                    if end_of_line:
+                        self._verb_delimiter = None  # \verb can't span lines
+                    return
+                self._verb_delimiter = None
+                position = found + 1
+                continue
+
+            match = _TOKEN.match(text, position)
+            column = offset + position + 1
+            position = match.end()
+            kind = match.lastgroup
+            if kind == "comment":
+                if not end_of_line:
+                    self._rest_is_comment = True
+                return
+            if kind == "word" and match.group("word").rstrip("*") == "verb":
+                if position < length:
+                    self._verb_delimiter = text[position]
+                    position += 1
+                continue
+            self._token(kind, match.group(kind), line, column)
+
+    def _token(self, kind: str, value: str, line: int, column: int) -> None:
+        argument = self._argument
+        if argument is not None:
+            if self._argument_token(argument, kind, value, line, column):
+                return
+
+        if kind == "word":
+            if value in ARGUMENT_COMMANDS:
+                self._argument = {"command": value, "depth": 0, "optional": 0,
+                                  "chars": [], "line": line, "column": column}
+        elif kind == "symbol":
+            self._math_symbol(value, line, column)
+        elif kind == "dollars":
+            self._dollars(value, line, column)
+        elif kind == "open":
+            self._braces.append((line, column))
+        elif kind == "close":
+            if self._braces:
+                self._braces.pop()
+            else:
+                self._error("Unmatched }", line, column)
+        elif kind == "text":
+            if self._math is None and self._math_environments == 0 and self._counting_words():
+                self.words += len(_WORD.findall(value))
+
+    def _argument_token(self, argument: dict, kind: str, value: str, line: int, column: int) -> bool:
+        """
+        Feed a token to the argument being captured. Returns True if the
+        token was consumed, False if the command turned out to have no
+        argument (the token is then handled normally).
+        """
+        if argument["depth"] == 0:
+            if kind == "text" and not value.strip():
+                return True  # Spaces before the argument
+            if kind == "lbracket" or argument["optional"]:
+                # [options] before the argument
+                if kind == "lbracket":
+                    argument["optional"] += 1
+                elif kind == "rbracket":
+                    argument["optional"] -= 1
+                return True
+            if kind == "open":
+                self._braces.append((line, column))
+                argument["depth"] = 1
+                return True
+            self._argument = None
+            if argument["command"] in INCLUDE_COMMANDS and kind == "text":
+                # Plain TeX form: \input chapter1
+                name = value.split()[0]
+                self.includes.append({"command": argument["command"], "path": name, "line": argument["line"]})
+                return True
+            return False
+
+        if kind == "open":
+            self._braces.append((line, column))
+            argument["depth"] += 1
+        elif kind == "close":
+            if self._braces:
+                self._braces.pop()
+            argument["depth"] -= 1
+            if argument["depth"] == 0:
+                self._argument = None
+                self._finish_argument(argument["command"], "".join(argument["chars"]).strip(),
+                                      argument["line"], argument["column"])
+                return True
+        argument["chars"].append(value if kind != "word" else "\\" + value)
+        return True
+
+    def _finish_argument(self, command: str, value: str, line: int, column: int) -> None:
+        if command == "begin":
+            self._open_environment(value, line, column)
+        elif command == "end":
+            self._close_environment(value, line, column)
+        elif command == "documentclass":
+            self.document_class = value
+        elif command in PACKAGE_COMMANDS:
+            for name in value.split(","):
+                name = name.strip()
+                if name and name not in self.packages:
+                    self.packages.append(name)
+        elif command in INCLUDE_COMMANDS:
+            self.includes.append({"command": command, "path": value, "line": line})
+        elif command in BIBLIOGRAPHY_COMMANDS:
+            for name in value.split(","):
+                name = name.strip()
+                if name and name not in self.bibliographies:
+                    self.bibliographies.append(name)
+        elif command == "bibliographystyle":
+            self.bibliography_style = value
+
+    def _open_environment(self, name: str, line: int, column: int) -> None:
+        self._environments.append((name, line, column))
+        if name == "document":
+            if self._begin_document is None:
+                self._begin_document = (line, column)
+        elif name in DISPLAY_MATH_ENVIRONMENTS:
+            self.display_math += 1
+            self._math_environments += 1
+        elif name in VERBATIM_ENVIRONMENTS:
+            self._raw_environment = name
+
+    def _close_environment(self, name: str, line: int, column: int) -> None:
+        open_names = [env[0] for env in self._environments]
+        if not open_names or open_names[-1] != name:
+            if name in open_names:
+                # Something in between was left open - report it and recover
+                while self._environments[-1][0] != name:
+                    inner, inner_line, inner_column = self._environments.pop()
+                    self._error(f"\\begin{{{inner}}} is closed by \\end{{{name}}}", inner_line, inner_column)
+                    self._left_environment(inner)
+            else:
+                self._error(f"\\end{{{name}}} without matching \\begin{{{name}}}", line, column)
+                return
+        self._environments.pop()
+        self._left_environment(name)
+        if name == "document":
+            self._end_document = True
+
+    def _left_environment(self, name: str) -> None:
+        if name in DISPLAY_MATH_ENVIRONMENTS:
+            self._math_environments -= 1
+
+    def _counting_words(self) -> bool:
+        # With a preamble, only text inside the document body is counted
+        if self.document_class is None:
+            return True
+        return self._begin_document is not None and not self._end_document
+
+    # --- Math ---
+
+    def _open_math(self, delimiter: str, line: int, column: int, display: bool) -> None:
+        self._math = (delimiter, line, column)
+        if display:
+            self.display_math += 1
+        else:
+            self.inline_math += 1
+
+    def _dollars(self, value: str, line: int, column: int) -> None:
+        current = self._math[0] if self._math else None
+        if value == "$":
+            if current == "$":
+                self._math = None
+            elif current is None:
+                self._open_math("$", line, column, display=False)
+            else:
+                self._error(f"$ inside math started with {current}", line, column)
+        else:
+            if current == "$$":
+                self._math = None
+            elif current == "$":
+                # "$a$$b$" is two inline formulas, not display math
+                self._open_math("$", line, column + 1, display=False)
+            elif current is None:
+                self._open_math("$$", line, column, display=True)
+            else:
+                self._error(f"$$ inside math started with {current}", line, column)
+
+    def _math_symbol(self, symbol: str, line: int, column: int) -> None:
+        if symbol in "([":
+            if self._math is not None:
+                self._error(f"\\{symbol} inside math started with {self._math[0]}", line, column)
+                return
+            self._open_math("\\" + symbol, line, column, display=symbol == "[")
+        elif symbol in ")]":
+            expected = "\\(" if symbol == ")" else "\\["
+            if self._math is not None and self._math[0] == expected:
+                self._math = None
+            else:
+                self._error(f"\\{symbol} without matching {expected}", line, column)
+
+
+def analyze_latex(source: str) -> dict:
+    """Analyze a complete document held in memory."""
+    analyzer = LatexAnalyzer()
+    analyzer.feed(source)
+    return analyzer.finish()
+
+
+# Limits on what document_stats() keeps - they size the Note columns
+MAX_NAME_LENGTH = 100
+MAX_PACKAGES = 100
+
+
+def document_stats(source: str) -> dict:
+    """
+    The statistics stored with every note (see Note): word count, number
+    of math expressions, document class and packages of the main document.
+    """
+    report = analyze_latex(source)
+    packages = [name[:MAX_NAME_LENGTH] for name in report["packages"][:MAX_PACKAGES]]
+    return {
+        "word_count": report["stats"]["words"],
+        "math_count": report["stats"]["math_expressions"],
+        "document_class": (report["document_class"] or "")[:MAX_NAME_LENGTH] or None,
+        "packages": list(dict.fromkeys(packages)),  # Truncation may have made duplicates
+    }
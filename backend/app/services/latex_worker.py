@@ -0,0 +1,551 @@
+# LaTeX worker - the code that runs inside each compile worker process
+#
+# This module is deliberately tiny and imports nothing from the rest of the
+# app (no database, no FastAPI). Worker processes import it on startup, so
+# keeping it light keeps the pool cheap to start.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+try:
+    import resource  # POSIX only - used to cap CPU and memory of the TeX process
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+try:
+    import fcntl  # POSIX only - locks a note's build directory while it compiles
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+ALLOWED_ENGINES = {"pdflatex", "xelatex", "lualatex"}
+
+# Engines that can dump a precompiled preamble: engine -> (ini binary, base format).
+# LuaTeX cannot dump loaded fonts, so lualatex always compiles from scratch.
+FORMAT_BUILDERS = {
+    "pdflatex": ("pdftex", "&pdflatex"),
+    "xelatex": ("xetex", "&xelatex"),
+}
+
+# Log messages that mean "the format file is unusable", not "your LaTeX is wrong"
+_FORMAT_ERRORS = ("Fatal format file error", "I can't find the format file")
+
+# How much of the TeX log we keep for the error summary
+LOG_TAIL_CHARS = 2000
+
+# The main document's name inside the build directory
+MAIN_FILE = "note.tex"
+
+# Files TeX writes for the next run to read back (cross-references, table
+# of contents, ...). Another pass is only needed while these keep changing
+AUX_EXTENSIONS = (".aux", ".toc", ".lof", ".lot", ".out", ".nav", ".snm")
+
+# Bookkeeping files inside a persistent build directory
+SOURCES_MANIFEST = ".notex-sources"
+BIBLIOGRAPHY_STAMP = ".notex-bibliography"
+
+# How often a running TeX process checks for its job's cancel file
+CANCEL_POLL_SECONDS = 0.25
+
+_AUX_ARGUMENT = re.compile(r"\\(\w+)\{([^}]*)\}")
+_BCF_DATASOURCE = re.compile(r"<bcf:datasource[^>]*>([^<]+)</bcf:datasource>")
+
+
+@dataclass(frozen=True)
+class CompileLimits:
+    """Resource limits applied to a single compilation."""
+    cpu_seconds: int
+    wall_seconds: int
+    memory_mb: int
+
+
+@dataclass(frozen=True)
+class FormatPlan:
+    """
+    Which precompiled preamble (.fmt file) to compile against.
+    build=True means the worker should create it first.
+    """
+    key: str
+    path: str
+    build: bool
+
+
+@dataclass
+class CompileResult:
+    """What a worker reports back to the dispatcher."""
+    ok: bool
+    error: Optional[str] = None
+    log_tail: str = ""
+    format_built: bool = False
+    passes: int = 0  # TeX runs it took
+    cancelled: bool = False  # Stopped because a newer version was saved
+
+
+class CompileCancelled(Exception):
+    """The dispatcher created the job's cancel file - stop compiling."""
+
+
+# Cancel file of the job this worker process is running (one at a time).
+# Module state rather than a parameter so every TeX/bibtex run sees it
+_cancel_path: Optional[str] = None
+
+# Progress file of that job: the dispatcher reads it to tell the client
+# which step the compile is at (see _report_progress)
+_progress_path: Optional[str] = None
+
+
+def _report_progress(step: str, **details) -> None:
+    """
+    Record the step the compile is at ("format", "tex" with pass_number
+    and max_passes, "bibtex", "biber") as one JSON object. Written to a temp
+    file and renamed, so the dispatcher never reads half a file. Progress
+    is best-effort - a write that fails doesn't stop the compile.
+    """
+    if _progress_path is None:
+        return
+    try:
+        with open(_progress_path + ".tmp", "w", encoding="utf-8") as progress:
+            json.dump({"step": step, **details}, progress)
+        os.replace(_progress_path + ".tmp", _progress_path)
+    except OSError:
+        pass
+
+
+def _limit_resources(limits: CompileLimits):
+    """Build the preexec hook that sandboxes the TeX child process."""
+    def apply():
+        if resource is None:
+            return
+        memory = limits.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 1))
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        # Output files (PDF, log, aux) may not grow past the memory budget either
+        resource.setrlimit(resource.RLIMIT_FSIZE, (memory, memory))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    return apply
+
+
+def _sandbox_env(workdir: str) -> dict:
+    """Minimal environment for the TeX process - no inherited secrets."""
+    return {
+        "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+        "HOME": workdir,
+        "TEXMFOUTPUT": workdir,
+        "TEXMFVAR": os.path.join(workdir, ".texmf-var"),
+        # Paranoid file access: only read/write inside the job directory
+        "openin_any": "p",
+        "openout_any": "p",
+        "shell_escape": "f",
+    }
+
+
+def _read_log_tail(log_path: str) -> str:
+    """Return the end of the TeX log, where the actual error usually is."""
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as log:
+            return log.read()[-LOG_TAIL_CHARS:]
+    except OSError:
+        return ""
+
+
+def _first_error(log_tail: str) -> str:
+    """Pick the first '! ...' line out of a TeX log as a short summary."""
+    for line in log_tail.splitlines():
+        if line.startswith("!"):
+            return line[1:].strip()
+    return "LaTeX compilation failed"
+
+
+def _run_sandboxed(command: list, workdir: str, limits: CompileLimits, deadline: float) -> Optional[int]:
+    """
+    Run one TeX command inside the job directory.
+    Returns its exit code, or None if it ran past the job's deadline.
+    Raises CompileCancelled if the dispatcher asked the job to stop.
+    """
+    process = subprocess.Popen(
+        command,
+        cwd=workdir,
+        env=_sandbox_env(workdir),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=_limit_resources(limits) if resource is not None else None,
+        start_new_session=True,
+    )
+    while True:
+        remaining = max(1.0, deadline - time.monotonic())
+        try:
+            if _cancel_path is None:
+                return process.wait(timeout=remaining)
+            return process.wait(timeout=min(CANCEL_POLL_SECONDS, remaining))
+        except subprocess.TimeoutExpired:
+            cancelled = _cancel_path is not None and os.path.exists(_cancel_path)
+            if cancelled or time.monotonic() >= deadline:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                if cancelled:
+                    raise CompileCancelled()
+                return None
+
+
+def _install_file(source_path: str, target_path: str) -> None:
+    """Atomically place a file, so readers never see half of it."""
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    staging_path = f"{target_path}.{os.getpid()}.tmp"
+    shutil.copyfile(source_path, staging_path)
+    os.replace(staging_path, target_path)
+
+
+def _build_format(workdir: str, engine: str, plan: FormatPlan, limits: CompileLimits, deadline: float) -> bool:
+    """
+    Dump the preamble of note.tex into a format file with mylatexformat.
+    mylatexformat reads the document up to \\begin{document} and saves TeX's
+    memory at that point, so later runs skip loading the class and packages.
+    """
+    ini_binary, base_format = FORMAT_BUILDERS[engine]
+    if shutil.which(ini_binary) is None:
+        return False
+    command = [
+        ini_binary,
+        "-ini",
+        "-interaction=nonstopmode",
+        "-halt-on-error",
+        f"-jobname={plan.key}",
+        base_format,
+        "mylatexformat.ltx",
+        "note.tex",
+    ]
+    returncode = _run_sandboxed(command, workdir, limits, deadline)
+    built_path = os.path.join(workdir, f"{plan.key}.fmt")
+    if returncode != 0 or not os.path.exists(built_path):
+        return False
+    _install_file(built_path, plan.path)
+    return True
+
+
+def _link_format(plan: FormatPlan, workdir: str) -> bool:
+    """
+    Make the cached format visible inside the job directory.
+    A hard link keeps the file alive even if the cache evicts it mid-compile.
+    """
+    target = os.path.join(workdir, f"{plan.key}.fmt")
+    if os.path.exists(target):
+        return True  # Just built here
+    try:
+        os.link(plan.path, target)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        shutil.copyfile(plan.path, target)  # Different filesystem
+    return True
+
+
+def _safe_join(workdir: str, path: str) -> str:
+    """Resolve a project path inside workdir, refusing anything that escapes it."""
+    full = os.path.normpath(os.path.join(workdir, path))
+    if os.path.isabs(path) or not full.startswith(workdir + os.sep):
+        raise ValueError(f"Unsafe project path: {path}")
+    return full
+
+
+def _write_sources(workdir: str, sources: Dict[str, str]) -> None:
+    """
+    Put the project's files into the build directory. Files a previous
+    build wrote that are no longer part of the project are removed, so a
+    deleted chapter can't keep being \\input.
+    """
+    manifest_path = os.path.join(workdir, SOURCES_MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest:
+            previous = set(manifest.read().splitlines())
+    except OSError:
+        previous = set()
+    for path in previous - set(sources):
+        try:
+            os.remove(_safe_join(workdir, path))
+        except (OSError, ValueError):
+            pass
+    for path, content in sources.items():
+        full = _safe_join(workdir, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "w", encoding="utf-8") as source_file:
+            source_file.write(content)
+    with open(manifest_path, "w", encoding="utf-8") as manifest:
+        manifest.write("\n".join(sorted(sources)))
+
+
+def _generated_files(workdir: str, extensions: Tuple[str, ...]):
+    """Paths of files with these extensions anywhere in the build directory."""
+    for folder, _, names in os.walk(workdir):
+        for name in names:
+            if name.endswith(extensions):
+                yield os.path.join(folder, name)
+
+
+def _digest_files(paths) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        try:
+            with open(path, "rb") as data:
+                digest.update(path.encode("utf-8") + b"\0" + data.read() + b"\0")
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+def _aux_state(workdir: str) -> str:
+    """Fingerprint of everything a TeX run leaves for the next run to read."""
+    return _digest_files(_generated_files(workdir, AUX_EXTENSIONS))
+
+
+def _clean_generated(workdir: str) -> None:
+    """Forget the previous build's state (used when it makes TeX fail)."""
+    for path in _generated_files(workdir, AUX_EXTENSIONS + (".bbl", ".bcf", ".blg")):
+        os.remove(path)
+    try:
+        os.remove(os.path.join(workdir, BIBLIOGRAPHY_STAMP))
+    except FileNotFoundError:
+        pass
+
+
+def _bibliography_inputs(workdir: str) -> Optional[Tuple[str, str]]:
+    """
+    Which bibliography tool the document needs, and a fingerprint of what
+    that tool reads: the citations/style requested by the last TeX run plus
+    the .bib (and .bst) files. Returns None if there is no bibliography.
+    """
+    bcf_path = os.path.join(workdir, "note.bcf")
+    if os.path.exists(bcf_path):
+        # biblatex: the control file lists the databases
+        with open(bcf_path, "r", encoding="utf-8", errors="replace") as bcf:
+            control = bcf.read()
+        databases = _BCF_DATASOURCE.findall(control)
+        return "biber", _digest_files([bcf_path] + [os.path.join(workdir, name) for name in databases])
+
+    # BibTeX: \citation, \bibdata and \bibstyle lines in note.aux and the
+    # .aux files of \include'd chapters
+    requests = []
+    databases, styles = [], []
+    for path in sorted(_generated_files(workdir, (".aux",))):
+        with open(path, "r", encoding="utf-8", errors="replace") as aux:
+            for line in aux:
+                if line.startswith(("\\citation", "\\bibdata", "\\bibstyle")):
+                    requests.append(line)
+                    match = _AUX_ARGUMENT.match(line)
+                    if match and line.startswith("\\bibdata"):
+                        databases += [name.strip() + ".bib" for name in match.group(2).split(",")]
+                    elif match and line.startswith("\\bibstyle"):
+                        styles.append(match.group(2).strip() + ".bst")
+    if not databases:
+        return None
+    digest = hashlib.sha256("".join(requests).encode("utf-8"))
+    digest.update(_digest_files([os.path.join(workdir, name) for name in databases + styles]).encode())
+    return "bibtex", digest.hexdigest()
+
+
+def _run_bibliography(workdir: str, limits: CompileLimits, deadline: float) -> bool:
+    """
+    Run bibtex/biber - but only if their inputs changed since the last time
+    they ran in this build directory. Returns True if note.bbl changed
+    (TeX then has to run again to pick it up).
+    """
+    needed = _bibliography_inputs(workdir)
+    if needed is None:
+        return False
+    tool, fingerprint = needed
+    stamp_path = os.path.join(workdir, BIBLIOGRAPHY_STAMP)
+    bbl_path = os.path.join(workdir, "note.bbl")
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as stamp:
+            if stamp.read() == tool + fingerprint and os.path.exists(bbl_path):
+                return False
+    except OSError:
+        pass
+    if shutil.which(tool) is None:
+        return False
+
+    before = _digest_files([bbl_path])
+    _report_progress(tool)
+    returncode = _run_sandboxed([tool, "note"], workdir, limits, deadline)
+    # bibtex exits 1 on mere warnings (e.g. a missing field) - still usable
+    succeeded = returncode == 0 or (tool == "bibtex" and returncode == 1)
+    if succeeded:
+        with open(stamp_path, "w", encoding="utf-8") as stamp:
+            stamp.write(tool + fingerprint)
+    return _digest_files([bbl_path]) != before
+
+
+@contextmanager
+def _build_directory(build_dir: Optional[str]):
+    """
+    The directory a compile runs in. A note's persistent build directory
+    keeps .aux/.bbl/... between compiles; it is locked so two compiles of
+    the same note never share it - the loser (and any compile without a
+    build directory) uses a throwaway temporary directory instead.
+    """
+    if build_dir is not None and fcntl is not None:
+        os.makedirs(build_dir, exist_ok=True)
+        with open(os.path.join(build_dir, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                pass
+            else:
+                yield os.path.abspath(build_dir)
+                return
+    with tempfile.TemporaryDirectory(prefix="notex-") as workdir:
+        yield workdir
+
+
+def compile_latex(
+    source: str,
+    engine: str,
+    limits: CompileLimits,
+    output_path: str,
+    format_plan: Optional[FormatPlan] = None,
+    files: Optional[Dict[str, str]] = None,
+    build_dir: Optional[str] = None,
+    max_passes: int = 4,
+    cancel_path: Optional[str] = None,
+    progress_path: Optional[str] = None,
+) -> CompileResult:
+    """
+    Compile LaTeX source to a PDF at output_path.
+
+    Runs in a worker process. The TeX engine itself is a further child
+    process with rlimits applied, started in its own session so a timeout
+    can kill it together with anything it spawned.
+
+    `files` are the other files of a multi-file note ({path: text}, paths
+    relative to the main document). With a `build_dir` the auxiliary files
+    of the previous compile are reused: TeX runs again only while its
+    .aux/.toc/... output keeps changing, and bibtex/biber only when the
+    citations or .bib files changed - an edit to one paragraph of a
+    document whose references are settled is a single TeX run.
+
+    With a format_plan the preamble comes from a precompiled format file
+    (built first if needed); any problem with the format falls back to a
+    normal compile, so a bad cache entry can never fail a job.
+
+    If the file `cancel_path` appears while the job runs, TeX is killed
+    and the result has cancelled=True. Each step is written to
+    `progress_path` as it starts (see _report_progress).
+    """
+    global _cancel_path, _progress_path
+    _cancel_path = cancel_path
+    _progress_path = progress_path
+    try:
+        return _compile(source, engine, limits, output_path, format_plan, files, build_dir, max_passes)
+    except CompileCancelled:
+        return CompileResult(ok=False, error="Superseded by a newer version", cancelled=True)
+    finally:
+        _cancel_path = None
+        _progress_path = None
+
+
+def _compile(source: str, engine: str, limits: CompileLimits, output_path: str,
+             format_plan: Optional[FormatPlan], files: Optional[Dict[str, str]],
+             build_dir: Optional[str], max_passes: int) -> CompileResult:
+    if engine not in ALLOWED_ENGINES:
+        return CompileResult(ok=False, error=f"Unsupported LaTeX engine: {engine}")
+    if shutil.which(engine) is None:
+        return CompileResult(ok=False, error=f"LaTeX engine not installed: {engine}")
+
+    deadline = time.monotonic() + limits.wall_seconds
+    with _build_directory(build_dir) as workdir:
+        try:
+            _write_sources(workdir, {**(files or {}), MAIN_FILE: source})
+        except ValueError as exc:
+            return CompileResult(ok=False, error=str(exc))
+
+        format_built = False
+        format_name = None
+        if format_plan is not None and engine in FORMAT_BUILDERS:
+            if format_plan.build:
+                _report_progress("format")
+                format_built = _build_format(workdir, engine, format_plan, limits, deadline)
+            if _link_format(format_plan, workdir):
+                format_name = format_plan.key
+
+        try:
+            result = _run_passes(workdir, engine, limits, deadline, format_name, max_passes)
+            result.format_built = format_built
+            if result.ok:
+                _install_file(os.path.join(workdir, "note.pdf"), output_path)
+        finally:
+            # Don't let a persistent build directory pin evicted formats or old PDFs
+            for name in (f"{format_name}.fmt" if format_name else None, "note.pdf"):
+                if name:
+                    try:
+                        os.remove(os.path.join(workdir, name))
+                    except FileNotFoundError:
+                        pass
+    return result
+
+
+def _run_passes(workdir: str, engine: str, limits: CompileLimits, deadline: float,
+                format_name: Optional[str], max_passes: int) -> CompileResult:
+    """Run TeX (and the bibliography tool) until the output settles."""
+    command = [engine, "-interaction=nonstopmode", "-halt-on-error", "-no-shell-escape"]
+    log_path = os.path.join(workdir, "note.log")
+    state = _aux_state(workdir)
+    reused_state = any(_generated_files(workdir, AUX_EXTENSIONS))
+    bibliography_checked = False
+    passes = 0
+
+    while True:
+        passes += 1
+        _report_progress("tex", pass_number=passes, max_passes=max_passes)
+        returncode = _run_sandboxed(
+            command + ([f"-fmt={format_name}"] if format_name else []) + ["note.tex"],
+            workdir, limits, deadline,
+        )
+        log_tail = _read_log_tail(log_path)
+        if format_name and returncode != 0 and any(err in log_tail for err in _FORMAT_ERRORS):
+            # The format itself is broken (e.g. built by another TeX version)
+            format_name = None
+            returncode = _run_sandboxed(command + ["note.tex"], workdir, limits, deadline)
+            log_tail = _read_log_tail(log_path)
+
+        if returncode is None:
+            return CompileResult(
+                ok=False,
+                error=f"Compilation timed out after {limits.wall_seconds}s",
+                log_tail=log_tail,
+                passes=passes,
+            )
+        if returncode != 0 and reused_state:
+            # A leftover .aux from an older version of the document can
+            # break the run (e.g. it uses a macro the document no longer
+            # defines) - start over from a clean slate, once
+            _clean_generated(workdir)
+            reused_state = False
+            bibliography_checked = False
+            state = _aux_state(workdir)
+            continue
+        if returncode != 0 or not os.path.exists(os.path.join(workdir, "note.pdf")):
+            if returncode < 0:
+                # Killed by a signal - almost always the CPU or memory limit
+                error = f"Compilation exceeded resource limits (signal {-returncode})"
+            else:
+                error = _first_error(log_tail)
+            return CompileResult(ok=False, error=error, log_tail=log_tail, passes=passes)
+        reused_state = False
+
+        bibliography_changed = False
+        if not bibliography_checked:
+            bibliography_checked = True
+            bibliography_changed = _run_bibliography(workdir, limits, deadline)
+        new_state = _aux_state(workdir)
+        if (new_state == state and not bibliography_changed) or passes >= max_passes:
+            return CompileResult(ok=True, log_tail=log_tail, passes=passes)
+        state = new_state
@@ -0,0 +1,344 @@
+# Metrics - counters, gauges and histograms in the Prometheus text format
+#
+# GET /metrics returns everything registered here, for Prometheus (or any
+# compatible scraper) to collect:
+#
+#   notex_http_requests_total{method,route,status}      requests served
+#   notex_http_request_duration_seconds{method,route}   latency histogram
+#   notex_http_requests_in_flight{method}               requests in progress
+#   notex_http_request_db_queries{method,route}         SQL statements per request
+#   notex_http_request_db_seconds{method,route}         SQL time per request
+#   notex_db_query_duration_seconds                     every SQL statement
+#   notex_password_hash_seconds{operation}              bcrypt time
+#   notex_compile_duration_seconds{result}              worker time per compile
+#   notex_compile_queue_jobs{status}                    queued / running jobs
+#   notex_cache_*{cache}                                hits, misses, hit ratio
+#
+# `route` is the path template (/notes/{note_id}), never the raw path, so
+# the number of series stays bounded. Observing a value is a dict lookup
+# and a few additions under a lock - cheap enough for every request and
+# every SQL statement. Values are per process.
+
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+PREFIX = "notex_"
+
+# Bucket upper bounds (seconds) for request and compile latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# SQL statements are mostly far below a millisecond
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_number(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class: a named family of series, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up (requests served, cache hits)."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels: str) -> None:
+        """Copy in a total that another object counts itself (e.g. a cache's stats())."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """A value that goes up and down (requests in flight, queue depth)."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        self.set_total(value, **labels)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets, plus their sum
+    and count - Prometheus computes percentiles from these.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[-1] if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        names = self.label_names + ("le",)
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {series[-1]}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """All metrics of the process, rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests served.", ("method", "route", "status")))
+HTTP_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve an HTTP request (until the last byte).",
+    ("method", "route")))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being served right now (open event streams included).",
+    ("method",)))
+REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements run while serving one request.", ("method", "route"),
+    buckets=COUNT_BUCKETS))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL while serving one request.", ("method", "route"),
+    buckets=QUERY_BUCKETS + (2.5, 5.0)))
+
+# Database
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "db_query_duration_seconds", "Duration of every SQL statement (requests and background work).",
+    buckets=QUERY_BUCKETS))
+
+# Authentication
+PASSWORD_HASH_SECONDS = registry.register(Histogram(
+    "password_hash_seconds", "Time to hash or verify a password with bcrypt, queueing included.",
+    ("operation",)))
+PASSWORD_HASH_REJECTED = registry.register(Counter(
+    "password_hash_rejected_total", "Logins/registrations turned away because hashing was saturated."))
+
+# Compilation
+COMPILE_SECONDS = registry.register(Histogram(
+    "compile_duration_seconds", "Worker time per compile job.", ("result",)))
+COMPILE_QUEUE = registry.register(Gauge(
+    "compile_queue_jobs", "Compile jobs waiting or running (read at scrape time).", ("status",)))
+
+# Caches - totals are copied from each cache's own stats at scrape time,
+# except the artifact store, which is counted here as lookups happen
+CACHE_HITS = registry.register(Counter("cache_hits_total", "Cache lookups that hit.", ("cache",)))
+CACHE_MISSES = registry.register(Counter("cache_misses_total", "Cache lookups that missed.", ("cache",)))
+CACHE_HIT_RATIO = registry.register(Gauge(
+    "cache_hit_ratio", "Share of lookups that hit since the process started.", ("cache",)))
+CACHE_ENTRIES = registry.register(Gauge("cache_entries", "Entries currently cached.", ("cache",)))
+
+# Live events
+EVENT_STREAMS = registry.register(Gauge("event_streams", "Open GET /events streams."))
+
+
+def record_cache(cache: str, hits: int, misses: int, entries: Optional[int] = None) -> None:
+    """Publish one cache's totals and hit ratio."""
+    CACHE_HITS.set_total(hits, cache=cache)
+    CACHE_MISSES.set_total(misses, cache=cache)
+    lookups = hits + misses
+    CACHE_HIT_RATIO.set(hits / lookups if lookups else 0.0, cache=cache)
+    if entries is not None:
+        CACHE_ENTRIES.set(entries, cache=cache)
+
+
+def count_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    """Count lookups of a cache that keeps no stats of its own."""
+    if hits:
+        CACHE_HITS.inc(hits, cache=cache)
+    if misses:
+        CACHE_MISSES.inc(misses, cache=cache)
+    total_hits, total_misses = CACHE_HITS.value(cache=cache), CACHE_MISSES.value(cache=cache)
+    CACHE_HIT_RATIO.set(total_hits / (total_hits + total_misses), cache=cache)
+
+
+# SQL accounting per request
+#
+# The middleware puts a fresh [statements, seconds] pair in this context
+# variable for each request; the engine hooks below add to it. asyncio
+# tasks and SQLAlchemy's async greenlets inherit the context, so every
+# query a handler awaits is charged to its own request.
+_request_sql: ContextVar[Optional[list]] = ContextVar("request_sql", default=None)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    connection.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+    started = connection.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    DB_QUERY_SECONDS.observe(elapsed)
+    totals = _request_sql.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+def _handle_error(exception_context) -> None:
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def instrument_engine(engine) -> None:
+    """Time every SQL statement of a (sync) engine - pass async_engine.sync_engine for async ones."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count, latency, requests in flight
+    and SQL work per request. Plain ASGI rather than BaseHTTPMiddleware, so
+    streaming responses pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[object, str]] = None  # endpoint -> path template
+
+    def _route_of(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"  # 404s: raw paths would be unbounded
+        if self._routes is None:
+            self._routes = {
+                getattr(route, "endpoint", None): route.path
+                for route in getattr(scope.get("app"), "routes", ())
+                if hasattr(route, "path")
+            }
+        return self._routes.get(endpoint, "unknown")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        totals = [0, 0.0]
+        token = _request_sql.set(totals)
+        HTTP_IN_FLIGHT.inc(method=method)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_sql.reset(token)
+            HTTP_IN_FLIGHT.dec(method=method)
+            route = self._route_of(scope)
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status_code))
+            HTTP_DURATION.observe(elapsed, method=method, route=route)
+            REQUEST_DB_QUERIES.observe(totals[0], method=method, route=route)
+            REQUEST_DB_SECONDS.observe(totals[1], method=method, route=route)
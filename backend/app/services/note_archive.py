@@ -0,0 +1,554 @@
+# Note archives - export a whole account as one zip/tar, and import it back
+#
+# Layout of an archive (same for zip and tar):
+#
+#   manifest.json              format name/version, export time, note count
+#   notes/<id>/note.json       title, status, revision, version, timestamps,
+#                              project file paths, whether a PDF is included
+#   notes/<id>/main.tex        the note's latex_content
+#   notes/<id>/files/<path>    its project files (chapters, .bib, .sty, ...)
+#   notes/<id>/note.pdf        the compiled PDF, if the note has one
+#
+# Both directions stream. Export walks the user's notes with a server-side
+# cursor (one batch of rows in memory at a time) and sends archive bytes as
+# they are produced, with PDFs copied from the artifact store a chunk at a
+# time - memory stays flat however big the account is. (A zip still keeps
+# its small per-entry directory record until the end; tar keeps nothing.)
+#
+# Import reads tar / tar.gz straight off the request body, one entry at a
+# time, in a worker thread. Zip can't be read that way - its directory is
+# at the end - so a zip upload is spooled to a temporary file first.
+# Notes are inserted IMPORT_BATCH_NOTES at a time, one transaction each.
+# Imported PDFs are ignored: the artifact store is shared between users,
+# so it only ever holds PDFs we compiled ourselves.
+
+import io
+import json
+import os
+import posixpath
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+import anyio
+from anyio.from_thread import run as run_from_thread
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.database import AsyncSessionLocal
+from app.models import Note, NoteFile
+from app.services import artifacts, note_stats, projects, revisions, search
+from app.services.latex import compile_dispatcher, enqueue_compiles
+from app.services.latex_analyzer import document_stats
+from app.services.serialization import dumps
+
+FORMAT_NAME = "notex-notes"
+FORMAT_VERSION = 1
+
+# Archive formats GET /notes/export can produce: name -> (content type, file extension)
+EXPORT_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar": ("application/x-tar", "tar"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+
+# Notes fetched per round trip of the export cursor
+EXPORT_BATCH = 100
+
+# Export output is handed to the server in pieces of about this size
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+# Most import errors reported back (the counts are always complete)
+MAX_REPORTED_ERRORS = 100
+
+_MAIN = "main.tex"
+_META = "note.json"
+_PDF = "note.pdf"
+_FILES = "files/"
+
+
+class ArchiveError(ValueError):
+    """The upload isn't a readable notes archive. `imported` notes were committed before it broke."""
+
+    def __init__(self, message: str, imported: int = 0):
+        super().__init__(message)
+        self.imported = imported
+
+
+class ImportTooLarge(ArchiveError):
+    """The upload is bigger than IMPORT_MAX_MB."""
+
+
+# --- Writing archives ---
+
+class _Sink:
+    """Write-only file object that collects what zipfile writes into it."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ZipWriter:
+    """
+    Streaming zip output. The sink has no tell()/seek(), so zipfile writes
+    sizes and CRCs after each entry (data descriptors) instead of going
+    back to patch the header - nothing is ever rewritten.
+    """
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w")
+        self._entry = None
+
+    def start(self, name: str, size: int, mtime: datetime, compress: bool) -> bytes:
+        info = zipfile.ZipInfo(name, date_time=max(mtime.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        info.file_size = size  # Lets zipfile choose ZIP64 up front for huge entries
+        self._entry = self._zip.open(info, "w")
+        return self._sink.take()
+
+    def write(self, data: bytes) -> bytes:
+        self._entry.write(data)
+        return self._sink.take()
+
+    def end(self) -> bytes:
+        self._entry.close()
+        self._entry = None
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.take()
+
+
+class _TarWriter:
+    """
+    Streaming tar output (optionally gzipped). Entry sizes are known up
+    front, so each entry is just a header, the bytes, and padding.
+    """
+
+    def __init__(self, gzip: bool = False):
+        # wbits=31: zlib writes the gzip header and trailer itself
+        self._gzip = zlib.compressobj(wbits=31) if gzip else None
+        self._padding = 0
+
+    def _out(self, data: bytes) -> bytes:
+        return self._gzip.compress(data) if self._gzip is not None else data
+
+    def start(self, name: str, size: int, mtime: datetime, compress: bool) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime.timestamp())
+        info.mode = 0o644
+        self._padding = -size % tarfile.BLOCKSIZE
+        return self._out(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+
+    def write(self, data: bytes) -> bytes:
+        return self._out(data)
+
+    def end(self) -> bytes:
+        return self._out(tarfile.NUL * self._padding)
+
+    def close(self) -> bytes:
+        # Two empty blocks mark the end of a tar archive
+        data = self._out(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        if self._gzip is not None:
+            data += self._gzip.flush()
+        return data
+
+
+def _writer(archive_format: str):
+    if archive_format == "zip":
+        return _ZipWriter()
+    return _TarWriter(gzip=archive_format == "tar.gz")
+
+
+def _utc(moment: Optional[datetime]) -> datetime:
+    if moment is None:
+        return datetime.now(timezone.utc)
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def _open_pdf(key: str):
+    """The note's PDF as (open file, size), or None if it was evicted."""
+    try:
+        pdf_file = open(artifacts.artifact_path(key), "rb", 0)
+    except FileNotFoundError:
+        return None
+    return pdf_file, os.fstat(pdf_file.fileno()).st_size
+
+
+async def export_archive(user_id: int, archive_format: str) -> AsyncIterator[bytes]:
+    """
+    Yield the bytes of an archive of every note the user has, oldest note
+    first. Uses its own database session: the response outlives the request
+    handler, and a large export can take minutes.
+    """
+    writer = _writer(archive_format)
+    pending = bytearray()
+
+    def entry(name: str, data: bytes, mtime: datetime, compress: bool = True) -> None:
+        pending.extend(writer.start(name, len(data), mtime, compress))
+        pending.extend(writer.write(data))
+        pending.extend(writer.end())
+
+    async with AsyncSessionLocal() as db:
+        now = datetime.now(timezone.utc)
+        count = await db.scalar(select(func.count()).select_from(Note).where(Note.user_id == user_id))
+        entry("manifest.json", dumps({
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "exported_at": now,
+            "note_count": count,
+        }), now)
+
+        # A server-side cursor: rows arrive EXPORT_BATCH at a time as we
+        # consume them, instead of the whole result being fetched up front
+        result = await db.stream(
+            select(Note.id, Note.title, Note.latex_content, Note.status, Note.revision, Note.version,
+                   Note.artifact_key, Note.created_at, Note.updated_at)
+            .where(Note.user_id == user_id)
+            .order_by(Note.id)
+            .execution_options(yield_per=EXPORT_BATCH)
+        )
+        async for rows in result.partitions():
+            files = await projects.load_files(db, [row.id for row in rows])
+            for row in rows:
+                folder = f"notes/{row.id}/"
+                mtime = _utc(row.updated_at)
+                note_files = files.get(row.id, {})
+                pdf = await anyio.to_thread.run_sync(_open_pdf, row.artifact_key) if row.artifact_key else None
+
+                entry(folder + _META, dumps({
+                    "id": row.id,
+                    "title": row.title,
+                    "status": row.status,
+                    "revision": row.revision,
+                    "version": row.version,
+                    "created_at": _utc(row.created_at),
+                    "updated_at": mtime,
+                    "files": sorted(note_files),
+                    "pdf": pdf is not None,
+                }), mtime)
+                entry(folder + _MAIN, row.latex_content.encode("utf-8"), mtime)
+                for path in sorted(note_files):
+                    entry(folder + _FILES + path, note_files[path].encode("utf-8"), mtime)
+
+                if pdf is not None:
+                    pdf_file, size = pdf
+                    try:
+                        # PDFs are compressed already - store them as they are
+                        pending.extend(writer.start(folder + _PDF, size, mtime, compress=False))
+                        position = 0
+                        while position < size:
+                            if len(pending) >= EXPORT_CHUNK_SIZE:
+                                yield bytes(pending)
+                                pending.clear()
+                            chunk = await anyio.to_thread.run_sync(
+                                os.pread, pdf_file.fileno(), min(EXPORT_CHUNK_SIZE, size - position), position
+                            )
+                            if not chunk:
+                                # Can't happen with the file held open, but the
+                                # header promised `size` bytes - keep the archive valid
+                                chunk = bytes(size - position)
+                            position += len(chunk)
+                            pending.extend(writer.write(chunk))
+                        pending.extend(writer.end())
+                    finally:
+                        pdf_file.close()
+
+                if len(pending) >= EXPORT_CHUNK_SIZE:
+                    yield bytes(pending)
+                    pending.clear()
+
+    pending.extend(writer.close())
+    yield bytes(pending)
+
+
+# --- Reading archives ---
+
+class _ChunkReader(io.RawIOBase):
+    """Blocking file object over chunks handed to it one at a time (for tarfile, in a thread)."""
+
+    def __init__(self, next_chunk: Callable[[], bytes]):
+        self._next_chunk = next_chunk
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        if not self._buffer:
+            chunk = self._next_chunk()
+            if not chunk:
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class _Draft:
+    """The entries of one note folder, collected while reading the archive."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.meta: Optional[bytes] = None
+        self.main: Optional[bytes] = None
+        self.files: Dict[str, bytes] = {}
+        self.error: Optional[str] = None
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return _utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+    except ValueError:
+        return None
+
+
+def _finish_draft(draft: _Draft) -> dict:
+    """Validate a note folder. Returns the note to insert, or {"error": ...}."""
+    if draft.error is not None:
+        return {"error": draft.error}
+    if draft.main is None:
+        return {"error": f"{_MAIN} is missing"}
+    if len(draft.files) > config.PROJECT_MAX_FILES:
+        return {"error": f"More than {config.PROJECT_MAX_FILES} project files"}
+    meta = {}
+    if draft.meta is not None:
+        try:
+            meta = json.loads(draft.meta)
+        except ValueError:
+            return {"error": f"{_META} is not valid JSON"}
+        if not isinstance(meta, dict):
+            return {"error": f"{_META} is not a JSON object"}
+    try:
+        latex_content = draft.main.decode("utf-8")
+        files = {}
+        for path, content in draft.files.items():
+            files[projects.validate_path(path)] = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"error": "Files must be UTF-8 text"}
+    except projects.InvalidProjectPath as exc:
+        return {"error": f"{exc}: {path}"}
+    title = meta.get("title")
+    if not isinstance(title, str) or not title.strip():
+        title = posixpath.basename(draft.folder)
+    return {
+        "title": title,
+        "latex_content": latex_content,
+        "stats": document_stats(latex_content),  # This runs on the reader thread
+        "files": files,
+        "created_at": _parse_time(meta.get("created_at")),
+        "updated_at": _parse_time(meta.get("updated_at")),
+    }
+
+
+def _check_manifest(data: bytes) -> None:
+    try:
+        manifest = json.loads(data)
+    except ValueError:
+        raise ArchiveError("manifest.json is not valid JSON")
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT_NAME:
+        raise ArchiveError("Not a notes archive (unknown manifest format)")
+    if not isinstance(manifest.get("version"), int) or manifest["version"] > FORMAT_VERSION:
+        raise ArchiveError("The archive was made by a newer version of the app")
+
+
+class _FolderCollector:
+    """
+    Groups archive entries into note folders, in archive order, and hands
+    each finished folder on. A folder's entries must be next to each other
+    (as in our own exports) - one split up becomes two notes.
+    """
+
+    def __init__(self, deliver: Callable[[str, dict], None]):
+        self._deliver = deliver
+        self._draft: Optional[_Draft] = None
+        self._limit = config.IMPORT_MAX_FILE_MB * 1024 * 1024
+
+    def add(self, name: str, size: int, read: Callable[[], bytes]) -> None:
+        """One archive member: its path, size and a function returning its bytes."""
+        name = name.lstrip("/")
+        if name == "manifest.json":
+            _check_manifest(read() if size <= self._limit else b"")
+            return
+        parts = name.split("/", 2)
+        if len(parts) < 3 or parts[0] != "notes" or not parts[1] or not parts[2]:
+            return  # Not part of a note (folders, stray files) - ignored
+        folder, inner = "notes/" + parts[1], parts[2]
+        if self._draft is None or self._draft.folder != folder:
+            self.finish()
+            self._draft = _Draft(folder)
+        draft = self._draft
+        if inner == _PDF or draft.error is not None:
+            return  # PDFs are recompiled, never trusted (see the top of this file)
+        if inner not in (_META, _MAIN) and not inner.startswith(_FILES):
+            return
+        if size > self._limit:
+            draft.error = f"{inner} is larger than {config.IMPORT_MAX_FILE_MB} MB"
+            return
+        data = read()
+        if inner == _META:
+            draft.meta = data
+        elif inner == _MAIN:
+            draft.main = data
+        else:
+            draft.files[inner[len(_FILES):]] = data
+
+    def finish(self) -> None:
+        if self._draft is not None:
+            draft, self._draft = self._draft, None
+            self._deliver(draft.folder, _finish_draft(draft))
+
+
+def _read_tar(source: io.RawIOBase, collector: _FolderCollector) -> None:
+    try:
+        # "r|*": a forward-only stream, gzip/bz2/xz detected from its first bytes
+        with tarfile.open(fileobj=io.BufferedReader(source), mode="r|*") as archive:
+            while True:
+                member = archive.next()
+                if member is None:
+                    break
+                # Stream mode still remembers every member it has seen -
+                # forget them, or memory would grow with the archive
+                archive.members.clear()
+                if member.isfile():
+                    collector.add(member.name, member.size, lambda: archive.extractfile(member).read())
+    except (tarfile.TarError, EOFError, zlib.error, OSError) as exc:
+        raise ArchiveError(f"Unreadable tar archive: {exc}")
+    collector.finish()
+
+
+def _read_zip(spooled, collector: _FolderCollector) -> None:
+    try:
+        with zipfile.ZipFile(spooled) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    collector.add(info.filename, info.file_size, lambda: archive.read(info))
+    except (zipfile.BadZipFile, zlib.error, OSError, EOFError) as exc:
+        raise ArchiveError(f"Unreadable zip archive: {exc}")
+    collector.finish()
+
+
+class _Importer:
+    """Inserts finished notes IMPORT_BATCH_NOTES at a time, committing each batch."""
+
+    def __init__(self, db: AsyncSession, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.batch: List[dict] = []
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    async def add(self, folder: str, note: dict) -> None:
+        if "error" in note:
+            self.failed += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"folder": folder, "error": note["error"]})
+            return
+        self.batch.append(note)
+        if len(self.batch) >= config.IMPORT_BATCH_NOTES:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self.batch:
+            return
+        db = self.db
+        new_notes = [
+            Note(user_id=self.user_id, title=draft["title"], latex_content=draft["latex_content"],
+                 status="pending", created_at=draft["created_at"], updated_at=draft["updated_at"],
+                 **draft["stats"])
+            for draft in self.batch
+        ]
+        db.add_all(new_notes)
+        await db.flush()  # One batched INSERT ... RETURNING assigns every id
+        for note, draft in zip(new_notes, self.batch):
+            revisions.record_revision(db, note.id, note.revision, note.latex_content)
+            db.add_all(NoteFile(note_id=note.id, path=path, content=content)
+                       for path, content in draft["files"].items())
+        await search.index_notes(db, [(note.id, note.user_id, note.title, note.latex_content) for note in new_notes])
+        await note_stats.index_packages(db, [(note.id, note.user_id, note.packages) for note in new_notes])
+        await enqueue_compiles(db, new_notes)  # Flushes the files first; cached PDFs attach at once
+        await db.commit()
+        compile_dispatcher.notify()
+        db.expunge_all()  # Let this batch's bodies go
+        self.imported += len(self.batch)
+        self.batch = []
+
+
+async def import_archive(db: AsyncSession, user_id: int, body: AsyncIterator[bytes]) -> dict:
+    """
+    Create notes from an uploaded archive (zip, tar or tar.gz, detected from
+    its content). Returns {"imported", "failed", "errors"}; folders that
+    fail validation are skipped and reported. Raises ImportTooLarge past
+    IMPORT_MAX_MB, ArchiveError if the archive itself is broken (notes from
+    batches already committed stay - the error says how many).
+    """
+    limit = config.IMPORT_MAX_MB * 1024 * 1024
+    received = 0
+    chunks = body.__aiter__()
+
+    async def next_chunk() -> bytes:
+        nonlocal received
+        async for chunk in chunks:
+            if chunk:
+                received += len(chunk)
+                if received > limit:
+                    raise ImportTooLarge(f"Archives are limited to {config.IMPORT_MAX_MB} MB")
+                return chunk
+        return b""
+
+    importer = _Importer(db, user_id)
+    # Parsing runs in a worker thread; every finished folder hops back to
+    # the event loop for its (batched) database insert
+    collector = _FolderCollector(lambda folder, note: run_from_thread(importer.add, folder, note))
+
+    first = await next_chunk()
+    try:
+        if first.startswith(b"PK"):
+            # Zip: spool to disk (not memory), then read it from there
+            with tempfile.TemporaryFile() as spooled:
+                chunk = first
+                while chunk:
+                    await anyio.to_thread.run_sync(spooled.write, chunk)
+                    chunk = await next_chunk()
+                await anyio.to_thread.run_sync(spooled.seek, 0)
+                await anyio.to_thread.run_sync(_read_zip, spooled, collector)
+        else:
+            pushed_back = [first]
+
+            def read_chunk() -> bytes:
+                if pushed_back:
+                    return pushed_back.pop()
+                return run_from_thread(next_chunk)
+
+            await anyio.to_thread.run_sync(_read_tar, _ChunkReader(read_chunk), collector)
+        await importer.flush()
+    except ArchiveError as exc:
+        # Rolls back the batch in progress; earlier batches are committed
+        await db.rollback()
+        exc.imported = importer.imported
+        raise
+    return {"imported": importer.imported, "failed": importer.failed, "errors": importer.errors}
@@ -0,0 +1,173 @@
+# Note batch service - many creates/updates/deletes in one transaction
+#
+# Sync clients and importers send hundreds of operations at once. Doing
+# them one request at a time costs an auth check, a commit and an fsync
+# each. Here the whole batch is validated first and then applied with one
+# query per *step* (insert notes, insert revisions, queue compiles, index
+# for search...) rather than one per note, and committed once.
+#
+# Batches are all-or-nothing: if any item is invalid, nothing is written
+# and every item's result says whether it was the problem.
+
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Note
+from app.services import artifacts, note_stats, projects, revisions, search, sync
+from app.services.latex import cancel_compiles_many, enqueue_compiles
+
+# Most ids per "id IN (...)" query
+LOAD_CHUNK = 500
+
+
+class BatchConflict(Exception):
+    """Another request saved one of the batch's notes while it was applied."""
+
+
+async def _load_notes(db: AsyncSession, user_id: int, note_ids: List[int]) -> Dict[int, Note]:
+    notes = {}
+    for start in range(0, len(note_ids), LOAD_CHUNK):
+        chunk = note_ids[start:start + LOAD_CHUNK]
+        for note in await db.scalars(select(Note).where(Note.id.in_(chunk), Note.user_id == user_id)):
+            notes[note.id] = note
+    return notes
+
+
+async def _load_doomed(db: AsyncSession, user_id: int, note_ids: List[int]) -> Dict[int, Tuple[str, int]]:
+    """id -> (artifact_key, version) of notes to delete (never loads their bodies)."""
+    doomed = {}
+    for start in range(0, len(note_ids), LOAD_CHUNK):
+        chunk = note_ids[start:start + LOAD_CHUNK]
+        result = await db.execute(
+            select(Note.id, Note.artifact_key, Note.version).where(Note.id.in_(chunk), Note.user_id == user_id)
+        )
+        doomed.update((note_id, (key, version)) for note_id, key, version in result)
+    return doomed
+
+
+async def apply_batch(db: AsyncSession, user_id: int, operations: Sequence) -> Tuple[bool, List[dict]]:
+    """
+    Validate and apply a batch for one user. `operations` are the parsed
+    BatchCreate/BatchUpdate/BatchDelete items. Returns (applied, results);
+    when applied is False nothing was changed. The caller commits, then
+    notifies the compile dispatcher.
+    Raises BatchConflict if a concurrent save won a race for a revision.
+    """
+    results = [{"index": index, "op": operation.op, "ok": True} for index, operation in enumerate(operations)]
+    creates = [(index, op) for index, op in enumerate(operations) if op.op == "create"]
+    updates = [(index, op) for index, op in enumerate(operations) if op.op == "update"]
+    deletes = [(index, op) for index, op in enumerate(operations) if op.op == "delete"]
+
+    # --- Validate everything before writing anything ---
+    seen = set()
+    for index, op in updates + deletes:
+        if op.id in seen:
+            results[index].update(ok=False, error="Note appears more than once in the batch")
+        seen.add(op.id)
+
+    notes = await _load_notes(db, user_id, [op.id for _, op in updates])
+    doomed = await _load_doomed(db, user_id, [op.id for _, op in deletes])
+    for index, op in updates:
+        note = notes.get(op.id)
+        if note is None:
+            results[index].update(ok=False, error="Note not found")
+        elif op.base_revision is not None and op.base_revision != note.revision:
+            results[index].update(ok=False, error=f"Note is at revision {note.revision}, not {op.base_revision}")
+        elif op.expected_version is not None and op.expected_version != note.version:
+            results[index].update(ok=False, version=note.version,
+                                  error=f"Note is at version {note.version}, not {op.expected_version}")
+    for index, op in deletes:
+        if op.id not in doomed:
+            results[index].update(ok=False, error="Note not found")
+        elif op.expected_version is not None and op.expected_version != doomed[op.id][1]:
+            version = doomed[op.id][1]
+            results[index].update(ok=False, version=version,
+                                  error=f"Note is at version {version}, not {op.expected_version}")
+
+    if not all(result["ok"] for result in results):
+        return False, results
+
+    # --- Apply ---
+    # Statistics of every new body, analyzed in one go: creates first, then
+    # edited notes in request order - the order they are taken in below
+    edited = [op for _, op in updates
+              if op.latex_content is not None and op.latex_content != notes[op.id].latex_content]
+    stats = iter(await note_stats.compute_stats(
+        [op.latex_content for _, op in creates] + [op.latex_content for op in edited]
+    ))
+    new_notes = [
+        Note(title=op.title, latex_content=op.latex_content, user_id=user_id, status="pending", **next(stats))
+        for _, op in creates
+    ]
+    db.add_all(new_notes)
+    await db.flush()  # One batched INSERT ... RETURNING assigns every id
+    for note in new_notes:
+        revisions.record_revision(db, note.id, note.revision, note.latex_content)
+
+    recompile = list(new_notes)
+    reindex = list(new_notes)
+    for _, op in updates:
+        note = notes[op.id]
+        if op.title is not None:
+            note.title = op.title
+        if op.latex_content is not None and op.latex_content != note.latex_content:
+            edits = revisions.diff_edits(note.latex_content, op.latex_content)
+            note.latex_content = op.latex_content
+            note_stats.apply_stats(note, next(stats))
+            note.revision += 1
+            note.version += 1
+            revisions.record_revision(db, note.id, note.revision, note.latex_content, edits)
+            recompile.append(note)
+            reindex.append(note)
+        elif op.title is not None:
+            note.version += 1
+            reindex.append(note)
+    try:
+        # UPDATEs (each "AND version = <loaded>") and revision INSERTs
+        await db.flush()
+    except (IntegrityError, StaleDataError):
+        await db.rollback()
+        raise BatchConflict()
+
+    jobs = await enqueue_compiles(db, recompile)
+    queued = {note.id for note, job in zip(recompile, jobs) if job is not None}
+    recompiled = {note.id for note in recompile}
+    await search.index_notes(db, [(note.id, note.user_id, note.title, note.latex_content) for note in reindex])
+    await note_stats.index_packages(db, [(note.id, note.user_id, note.packages) for note in recompile])
+
+    if deletes:
+        doomed_ids = [op.id for _, op in deletes]
+        await cancel_compiles_many(db, doomed_ids)
+        await search.remove_notes(db, doomed_ids)
+        await note_stats.remove_packages(db, doomed_ids)
+        await revisions.delete_histories(db, doomed_ids)
+        await projects.delete_files(db, doomed_ids)
+        await artifacts.release_many(db, (key for key, _ in doomed.values()))  # PDFs stay if other notes share them
+        # Delete only rows still at the version we checked - one that was
+        # saved meanwhile makes the batch a conflict instead of being lost
+        pairs = [(note_id, doomed[note_id][1]) for note_id in doomed_ids]
+        for start in range(0, len(pairs), LOAD_CHUNK):
+            chunk = pairs[start:start + LOAD_CHUNK]
+            result = await db.execute(delete(Note).where(tuple_(Note.id, Note.version).in_(chunk)))
+            if result.rowcount != len(chunk):
+                await db.rollback()
+                raise BatchConflict()
+        await sync.record_deletions(db, user_id, doomed_ids)
+
+    # --- Report ---
+    for (index, _), note in zip(creates, new_notes):
+        results[index].update(id=note.id, revision=note.revision, version=note.version,
+                              status="pending" if note.id in queued else "completed")
+    for index, op in updates:
+        note = notes[op.id]
+        status = note.status
+        if note.id in recompiled:
+            status = "pending" if note.id in queued else "completed"
+        results[index].update(id=note.id, revision=note.revision, version=note.version, status=status)
+    for index, op in deletes:
+        results[index].update(id=op.id)
+    return True, results
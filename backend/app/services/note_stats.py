@@ -0,0 +1,74 @@
+# Note statistics - the package index behind "notes using tikz"
+#
+# Word count, math count, document class and packages are computed once,
+# when a note's content is saved, and stored on the note, so the list shows
+# and sorts by them without touching bodies. The code that writes a body
+# computes them (compute_stats) - analyzing takes about 0.5 s per MB of
+# LaTeX, so big bodies are analyzed on a worker thread, not the event loop.
+#
+# Filtering by package needs one more step: a JSON list in a column can't
+# be searched with an index, so each note's packages are also written as
+# note_packages rows (user, package, note). The API refreshes them next to
+# the search index, in the same transaction as the note.
+
+import asyncio
+from typing import List, Sequence, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Note, NotePackage
+from app.services.latex_analyzer import document_stats
+
+# Most note ids per "note_id IN (...)" query
+CHUNK = 500
+
+# Up to this many characters in total are analyzed right on the event loop
+# (a few milliseconds); anything bigger goes to a worker thread
+INLINE_MAX_CHARS = 8 * 1024
+
+
+def _analyze(texts: Sequence[str]) -> List[dict]:
+    return [document_stats(text) for text in texts]
+
+
+async def compute_stats(texts: Sequence[str]) -> List[dict]:
+    """
+    document_stats() of each body about to be saved, in order. The dicts
+    hold Note column values: pass them to Note(**stats) or apply_stats().
+    """
+    if sum(len(text) for text in texts) > INLINE_MAX_CHARS:
+        return await asyncio.to_thread(_analyze, texts)
+    return _analyze(texts)
+
+
+def apply_stats(note: Note, stats: dict) -> None:
+    """Store compute_stats() output on a note whose content is changing."""
+    for column, value in stats.items():
+        setattr(note, column, value)
+
+
+async def index_packages(db: AsyncSession, notes: Sequence[Tuple[int, int, Sequence[str]]]) -> None:
+    """Refresh the package rows of (note_id, user_id, packages) tuples (caller commits)."""
+    if not notes:
+        return
+    await remove_packages(db, [note_id for note_id, _, _ in notes])
+    rows = [
+        {"note_id": note_id, "user_id": user_id, "package": package}
+        for note_id, user_id, packages in notes
+        for package in packages
+    ]
+    if rows:
+        await db.execute(insert(NotePackage), rows)
+
+
+async def remove_packages(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """Drop the package rows of deleted notes (caller commits)."""
+    for start in range(0, len(note_ids), CHUNK):
+        chunk = note_ids[start:start + CHUNK]
+        await db.execute(delete(NotePackage).where(NotePackage.note_id.in_(chunk)))
+
+
+def notes_using(user_id: int, package: str):
+    """Subquery of the user's note ids that load `package` - for Note.id.in_()."""
+    return select(NotePackage.note_id).where(NotePackage.user_id == user_id, NotePackage.package == package)
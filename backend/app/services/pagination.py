@@ -0,0 +1,42 @@
+# Pagination helpers - opaque cursors for keyset ("seek") pagination
+#
+# Instead of OFFSET (which makes the database walk and throw away every
+# earlier row), each page ends with a cursor holding the sort key of its
+# last row. The next page asks for rows strictly "after" that key, which
+# an index answers directly no matter how deep the client has paged.
+#
+# Cursors are base64 JSON so clients treat them as opaque strings.
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Pack the sort key of the last row on a page into a cursor string."""
+    plain = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(plain, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    Unpack a cursor made by encode_cursor().
+    Raises ValueError for anything that isn't a cursor we issued.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError("Malformed cursor") from exc
+    if not isinstance(values, list):
+        raise ValueError("Malformed cursor")
+    return values
+
+
+def parse_datetime(value: Any) -> datetime:
+    """Turn a timestamp that came out of a cursor back into a datetime."""
+    if not isinstance(value, str):
+        raise ValueError("Malformed cursor")
+    return datetime.fromisoformat(value)
@@ -0,0 +1,186 @@
+# Preamble cache - precompiled \documentclass/\usepackage setups shared by notes
+#
+# Loading the document class and packages is most of a typical compile.
+# Most notes use one of a handful of preambles, so for each distinct
+# preamble (everything before \begin{document}) we dump TeX's memory into a
+# format file once, and later compiles start from that dump:
+#
+#   storage/formats/<preamble hash>.fmt
+#
+# A preamble can also load files of the note's own project (\usepackage
+# {mystyle} with a mystyle.sty next to it, \input{macros}). Those files
+# are part of the hash, so editing one builds a new format, and two users
+# with the same preamble text but different local packages never share one.
+#
+# This module decides *which* format a job should use and whether it has
+# to be built; the worker process does the actual building (latex_worker.py).
+# The cache is bounded by entry count and total size, evicting the least
+# recently used formats first.
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app import config
+from app.services.artifacts import CACHE_VERSION, normalize_latex
+from app.services.latex_worker import FORMAT_BUILDERS, MAIN_FILE, FormatPlan
+from app.services.projects import build_graph
+
+FORMAT_DIR = os.path.join(config.STORAGE_DIR, "formats")
+
+# How many preambles we remember as "failed to dump" before forgetting
+# the oldest (some packages refuse to be dumped - no point retrying)
+MAX_UNBUILDABLE = 1024
+
+_BEGIN_DOCUMENT = re.compile(r"^[^%\n]*?\\begin\{document\}", re.MULTILINE)
+
+
+def split_preamble(source: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a document into (preamble, body) at the first \\begin{document}
+    that is not commented out. Returns None if there is no such line.
+    """
+    match = _BEGIN_DOCUMENT.search(source)
+    if match is None:
+        return None
+    split_at = match.end() - len("\\begin{document}")
+    return source[:split_at], source[split_at:]
+
+
+class PreambleCache:
+    """
+    LRU index of precompiled preamble formats on disk, with hit/miss stats.
+
+    Used from the dispatcher (event loop and helper threads), so all state
+    is guarded by a lock.
+    """
+
+    def __init__(self, directory: str = FORMAT_DIR,
+                 max_entries: int = config.PREAMBLE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = config.PREAMBLE_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> file size, oldest first
+        self._building: set = set()
+        self._unbuildable: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.build_failures = 0
+        self.evictions = 0
+        self._load_existing()
+
+    def _load_existing(self) -> None:
+        """Pick up formats left on disk by a previous run, oldest first."""
+        if not os.path.isdir(self.directory):
+            return
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".fmt"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+        self._evict_locked()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.fmt")
+
+    @staticmethod
+    def key_for(preamble: str, engine: str, files: Optional[Dict[str, str]] = None) -> str:
+        """
+        Hash of everything that goes into the format: the engine, the
+        normalized preamble and the project files it reaches (`files` are
+        the note's project files, {path: text}).
+        """
+        digest = hashlib.sha256()
+        for part in (CACHE_VERSION, engine, normalize_latex(preamble)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        if files:
+            used = build_graph(preamble, files).reachable() - {MAIN_FILE}
+            for path in sorted(used):
+                for part in (path, files[path]):
+                    digest.update(part.encode("utf-8"))
+                    digest.update(b"\0")
+        return digest.hexdigest()
+
+    def plan(self, source: str, engine: str, files: Optional[Dict[str, str]] = None) -> Optional[FormatPlan]:
+        """
+        Decide how a job should use the cache:
+        - a cached format exists        -> use it (hit)
+        - nobody is building it yet     -> build it in this job (miss)
+        - another job is building it,
+          or it cannot be dumped        -> compile normally (None)
+        """
+        if engine not in FORMAT_BUILDERS:
+            return None
+        parts = split_preamble(source)
+        if parts is None:
+            return None
+        key = self.key_for(parts[0], engine, files)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return FormatPlan(key=key, path=self.path_for(key), build=False)
+            self.misses += 1
+            if key in self._building or key in self._unbuildable:
+                return None
+            self._building.add(key)
+        return FormatPlan(key=key, path=self.path_for(key), build=True)
+
+    def finish(self, plan: Optional[FormatPlan], built: bool) -> None:
+        """Record the outcome of a job that was asked to build a format."""
+        if plan is None or not plan.build:
+            return
+        with self._lock:
+            self._building.discard(plan.key)
+            if built and os.path.exists(plan.path):
+                self.builds += 1
+                self._entries[plan.key] = os.path.getsize(plan.path)
+                self._entries.move_to_end(plan.key)
+                self._evict_locked()
+            else:
+                self.build_failures += 1
+                self._unbuildable[plan.key] = None
+                if len(self._unbuildable) > MAX_UNBUILDABLE:
+                    self._unbuildable.popitem(last=False)
+
+    def _evict_locked(self) -> None:
+        total = sum(self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total > self.max_bytes):
+            key, size = self._entries.popitem(last=False)
+            total -= size
+            self.evictions += 1
+            try:
+                # Running jobs hold a hard link, so removing it here is safe
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus current size, for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "builds": self.builds,
+                "build_failures": self.build_failures,
+                "evictions": self.evictions,
+            }
+
+
+# The single cache used by the compile dispatcher
+preamble_cache = PreambleCache()
@@ -0,0 +1,230 @@
+# Projects - multi-file notes and the dependency graph between their files
+#
+# A note's latex_content is the main document (compiled as note.tex); its
+# NoteFile rows are the rest of the project. References between files are
+# found with the LaTeX analyzer and resolved the way TeX resolves them -
+# relative to the main document, adding the usual extension:
+#
+#   \input{ch1}, \include{ch1}    -> ch1.tex (\input also tries "ch1")
+#   \bibliography{refs}           -> refs.bib
+#   \addbibresource{refs.bib}     -> refs.bib
+#   \bibliographystyle{mine}      -> mine.bst
+#   \usepackage{mystyle}          -> mystyle.sty
+#   \documentclass{thesis}        -> thesis.cls
+#
+# Only the files reachable from the main document take part in a compile
+# and in its artifact cache key. Editing a file nothing includes therefore
+# changes nothing; editing a chapter recompiles the note, and the build
+# folder kept by the worker (latex_worker.py) means only what that edit
+# actually changed is redone.
+
+import asyncio
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.models import NoteFile
+from app.services.latex_analyzer import LatexAnalyzer
+from app.services.latex_worker import MAIN_FILE
+
+BUILD_DIR = os.path.join(config.STORAGE_DIR, "builds")
+
+# Most note ids per "note_id IN (...)" query
+LOAD_CHUNK = 500
+
+# Text files a project may contain. TeX sources are scanned for references
+# to other files; the rest are only read by TeX, bibtex or biber
+SCANNED_EXTENSIONS = (".tex", ".sty", ".cls")
+PROJECT_EXTENSIONS = SCANNED_EXTENSIONS + (
+    ".bib", ".bst", ".bbx", ".cbx", ".cfg", ".def", ".clo", ".txt", ".csv", ".dat",
+)
+
+# Scanned files remembered (by content hash - the texts themselves aren't kept)
+SCAN_CACHE_ENTRIES = 4096
+_scan_cache: "OrderedDict[bytes, Tuple[Tuple[str, str], ...]]" = OrderedDict()
+_scan_lock = threading.Lock()
+_scan_stats = {"hits": 0, "misses": 0}
+
+_PATH = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.\-]*(/[A-Za-z0-9_][A-Za-z0-9_.\-]*)*$")
+MAX_PATH_LENGTH = 255
+MAX_PATH_DEPTH = 8
+
+
+class InvalidProjectPath(ValueError):
+    """A file path that is unsafe or not allowed in a project."""
+
+
+def validate_path(path: str) -> str:
+    """
+    Check a project file path and return it in canonical form.
+    Paths are relative, use "/", and stay inside the project.
+    """
+    path = posixpath.normpath(path.strip())
+    if not path or len(path) > MAX_PATH_LENGTH or not _PATH.match(path):
+        raise InvalidProjectPath("Invalid file path")
+    if ".." in path.split("/") or path.count("/") >= MAX_PATH_DEPTH:
+        raise InvalidProjectPath("Invalid file path")
+    if path == MAIN_FILE:
+        raise InvalidProjectPath(f"{MAIN_FILE} is the note itself")
+    if not path.endswith(PROJECT_EXTENSIONS):
+        raise InvalidProjectPath("Unsupported file type")
+    return path
+
+
+def scan_references(source: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    (kind, name) of every file a TeX source refers to, in order.
+    Results are remembered by content hash, so files that didn't change
+    are not rescanned on every save.
+    """
+    digest = hashlib.sha1(source.encode("utf-8")).digest()
+    with _scan_lock:
+        references = _scan_cache.get(digest)
+        if references is not None:
+            _scan_cache.move_to_end(digest)
+            _scan_stats["hits"] += 1
+            return references
+        _scan_stats["misses"] += 1
+
+    analyzer = LatexAnalyzer()
+    analyzer.feed(source)
+    analyzer.finish()
+    found = [(item["command"], item["path"]) for item in analyzer.includes]
+    found += [("bibliography", name) for name in analyzer.bibliographies]
+    if analyzer.bibliography_style:
+        found.append(("bibliographystyle", analyzer.bibliography_style))
+    found += [("usepackage", name) for name in analyzer.packages]
+    if analyzer.document_class:
+        found.append(("documentclass", analyzer.document_class))
+    references = tuple(found)
+
+    with _scan_lock:
+        _scan_cache[digest] = references
+        if len(_scan_cache) > SCAN_CACHE_ENTRIES:
+            _scan_cache.popitem(last=False)
+    return references
+
+
+def scan_cache_stats() -> dict:
+    """Hit/miss counters and size of the reference scan cache, for monitoring."""
+    with _scan_lock:
+        return {**_scan_stats, "entries": len(_scan_cache)}
+
+
+def _candidates(kind: str, name: str) -> List[str]:
+    """File names TeX would try for one reference, in order."""
+    name = posixpath.normpath(name.strip().strip('"')) if name.strip() else ""
+    if not name:
+        return []
+    if kind == "input":
+        return [name] if name.endswith(".tex") else [name + ".tex", name]
+    if kind == "include":
+        return [name + ".tex"]
+    if kind == "bibliography":
+        return [name] if name.endswith(".bib") else [name + ".bib"]
+    if kind == "bibliographystyle":
+        return [name + ".bst"]
+    if kind == "usepackage":
+        return [name + ".sty"]
+    if kind == "documentclass":
+        return [name + ".cls"]
+    return []
+
+
+@dataclass
+class ProjectGraph:
+    """
+    Which project file uses which. `edges` maps each TeX source (MAIN_FILE
+    included) to the project files it references; `missing` lists
+    \\input/\\include/bibliography references no project file satisfies
+    (packages and classes are normally installed, so those aren't listed).
+    """
+    edges: Dict[str, List[str]] = field(default_factory=dict)
+    missing: Dict[str, List[str]] = field(default_factory=dict)
+
+    def reachable(self, start: str = MAIN_FILE) -> Set[str]:
+        """Files the given file pulls in, directly or through others (itself included)."""
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            for target in self.edges.get(queue.popleft(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        return seen
+
+
+def build_graph(main_source: str, files: Dict[str, str]) -> ProjectGraph:
+    """Dependency graph of a project (main document plus its files)."""
+    graph = ProjectGraph()
+    sources = {MAIN_FILE: main_source, **files}
+    for path, content in sources.items():
+        if not path.endswith(SCANNED_EXTENSIONS):
+            continue
+        targets: List[str] = []
+        for kind, name in scan_references(content):
+            candidates = _candidates(kind, name)
+            found = next((candidate for candidate in candidates if candidate in files), None)
+            if found is not None:
+                if found != path and found not in targets:
+                    targets.append(found)
+            elif candidates and kind in ("input", "include", "bibliography"):
+                graph.missing.setdefault(path, []).append(candidates[0])
+        graph.edges[path] = targets
+    return graph
+
+
+def compile_files(main_source: str, files: Dict[str, str]) -> Dict[str, str]:
+    """The files a compile of this project needs - those the main document reaches."""
+    if not files:
+        return {}
+    reachable = build_graph(main_source, files).reachable()
+    return {path: content for path, content in files.items() if path in reachable}
+
+
+async def load_files(db: AsyncSession, note_ids: Sequence[int]) -> Dict[int, Dict[str, str]]:
+    """{note_id: {path: content}} for the given notes (notes without files are left out)."""
+    files: Dict[int, Dict[str, str]] = {}
+    for start in range(0, len(note_ids), LOAD_CHUNK):
+        chunk = note_ids[start:start + LOAD_CHUNK]
+        result = await db.execute(
+            select(NoteFile.note_id, NoteFile.path, NoteFile.content)
+            .where(NoteFile.note_id.in_(chunk))
+        )
+        for note_id, path, content in result:
+            files.setdefault(note_id, {})[path] = content
+    return files
+
+
+async def delete_files(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """Drop every file of these notes (used when the notes are deleted)."""
+    for start in range(0, len(note_ids), LOAD_CHUNK):
+        chunk = note_ids[start:start + LOAD_CHUNK]
+        await db.execute(delete(NoteFile).where(NoteFile.note_id.in_(chunk)))
+
+
+def build_dir(note_id: int) -> Optional[str]:
+    """The persistent build folder of a note, or None if build caching is off."""
+    if not config.LATEX_BUILD_CACHE_ENABLED:
+        return None
+    return os.path.join(BUILD_DIR, str(note_id))
+
+
+def _remove_build_dirs(note_ids: Iterable[int]) -> None:
+    for note_id in note_ids:
+        shutil.rmtree(os.path.join(BUILD_DIR, str(note_id)), ignore_errors=True)
+
+
+async def remove_build_dirs(note_ids: Iterable[int]) -> None:
+    """Delete the build folders of deleted notes (off the event loop)."""
+    await asyncio.to_thread(_remove_build_dirs, list(note_ids))
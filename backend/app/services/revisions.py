@@ -0,0 +1,181 @@
+# Revisions service - text edits and the compressed revision history of notes
+#
+# Edits are splices against a known text: (start, end, text) replaces
+# characters [start, end) with `text`. Offsets are Python string indexes
+# (Unicode code points) and always refer to the text *before* any of the
+# edits in the same list is applied, so a list is valid only if its ranges
+# are sorted and don't overlap.
+#
+# History is stored in note_revisions:
+#
+#   revision 1    snapshot   zlib(full text)
+#   revision 2    delta      zlib(JSON [[start, end, text], ...] against rev 1)
+#   ...
+#   revision 21   snapshot   (every REVISION_SNAPSHOT_INTERVAL revisions)
+#
+# Rebuilding revision N reads the closest snapshot at or before N plus the
+# deltas after it - one query, at most REVISION_SNAPSHOT_INTERVAL rows.
+
+import difflib
+import json
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.models import NoteRevision
+
+Edit = Tuple[int, int, str]
+
+# Below this many changed characters a single splice is good enough; above
+# it we diff line by line so scattered edits don't store a huge replacement
+LINE_DIFF_THRESHOLD = 4096
+
+COMPRESSION_LEVEL = 6
+
+# Most note ids per "note_id IN (...)" delete
+DELETE_CHUNK = 500
+
+
+class RevisionNotFound(Exception):
+    """The requested revision does not exist for this note."""
+
+
+def apply_edits(text: str, edits: Sequence[Edit]) -> str:
+    """
+    Apply splices to text. Raises ValueError if a range falls outside the
+    text, or the ranges are out of order or overlap.
+    """
+    pieces = []
+    position = 0
+    for start, end, replacement in edits:
+        if start < position or end < start or end > len(text):
+            raise ValueError(f"Invalid edit range [{start}, {end})")
+        pieces.append(text[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(text[position:])
+    return "".join(pieces)
+
+
+def diff_edits(old: str, new: str) -> List[Edit]:
+    """Compute edits that turn `old` into `new` (used for full-text saves)."""
+    if old == new:
+        return []
+    # Trim the common prefix and suffix - an autosave usually changes one spot
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+
+    if len(old_middle) + len(new_middle) <= LINE_DIFF_THRESHOLD:
+        return [(prefix, prefix + len(old_middle), new_middle)]
+
+    old_lines = old_middle.splitlines(keepends=True)
+    new_lines = new_middle.splitlines(keepends=True)
+    offsets = [prefix]
+    for line in old_lines:
+        offsets.append(offsets[-1] + len(line))
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append((offsets[i1], offsets[i2], "".join(new_lines[j1:j2])))
+    return edits
+
+
+def _encode_snapshot(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def _encode_delta(edits: Sequence[Edit]) -> bytes:
+    payload = json.dumps([list(edit) for edit in edits], ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def _decode(row: NoteRevision, previous: Optional[str]) -> str:
+    raw = zlib.decompress(row.data).decode("utf-8")
+    if row.kind == "snapshot":
+        return raw
+    return apply_edits(previous, [tuple(edit) for edit in json.loads(raw)])
+
+
+def _is_snapshot_revision(revision: int) -> bool:
+    return (revision - 1) % max(1, config.REVISION_SNAPSHOT_INTERVAL) == 0
+
+
+def record_revision(db: AsyncSession, note_id: int, revision: int, text: str,
+                    edits: Optional[Sequence[Edit]] = None) -> NoteRevision:
+    """
+    Add revision `revision` of a note to its history (caller commits).
+    `text` is the full new text; `edits` turn the previous revision into
+    it. Snapshot revisions (and revisions without edits) store the text.
+    """
+    if edits is None or _is_snapshot_revision(revision):
+        row = NoteRevision(note_id=note_id, revision=revision, kind="snapshot",
+                           data=_encode_snapshot(text), content_length=len(text))
+    else:
+        row = NoteRevision(note_id=note_id, revision=revision, kind="delta",
+                           data=_encode_delta(edits), content_length=len(text))
+    db.add(row)
+    return row
+
+
+async def load_revision(db: AsyncSession, note_id: int, revision: int) -> str:
+    """Rebuild the full text of one revision. Raises RevisionNotFound."""
+    snapshot = await db.scalar(
+        select(func.max(NoteRevision.revision)).where(
+            NoteRevision.note_id == note_id,
+            NoteRevision.kind == "snapshot",
+            NoteRevision.revision <= revision,
+        )
+    )
+    if snapshot is None:
+        raise RevisionNotFound(revision)
+    rows = (await db.scalars(
+        select(NoteRevision)
+        .where(
+            NoteRevision.note_id == note_id,
+            NoteRevision.revision.between(snapshot, revision),
+        )
+        .order_by(NoteRevision.revision)
+    )).all()
+    if not rows or rows[-1].revision != revision:
+        raise RevisionNotFound(revision)
+
+    text = None
+    for row in rows:
+        text = _decode(row, text)
+    return text
+
+
+async def list_revisions(db: AsyncSession, note_id: int, limit: int,
+                         before: Optional[int] = None) -> list:
+    """Revision metadata (no contents), newest first."""
+    query = select(
+        NoteRevision.revision, NoteRevision.kind, NoteRevision.content_length,
+        NoteRevision.created_at,
+    ).where(NoteRevision.note_id == note_id)
+    if before is not None:
+        query = query.where(NoteRevision.revision < before)
+    result = await db.execute(query.order_by(NoteRevision.revision.desc()).limit(limit))
+    return [row._asdict() for row in result]
+
+
+async def delete_history(db: AsyncSession, note_id: int) -> None:
+    """Drop every revision of a note (used when the note is deleted)."""
+    await delete_histories(db, [note_id])
+
+
+async def delete_histories(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """Bulk delete_history() for notes deleted together."""
+    for start in range(0, len(note_ids), DELETE_CHUNK):
+        chunk = note_ids[start:start + DELETE_CHUNK]
+        await db.execute(delete(NoteRevision).where(NoteRevision.note_id.in_(chunk)))
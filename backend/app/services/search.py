@@ -0,0 +1,298 @@
+# Search service - full-text search over notes with SQLite FTS5
+#
+# notes_fts is an FTS5 virtual table with one row per note (rowid = note id):
+#
+#   owner     "u<user id>" - lets the index itself restrict results to the
+#             caller's notes, instead of matching everyone's and filtering
+#   title     the note title
+#   body      readable text pulled out of the LaTeX (see latex_to_search_text)
+#   commands  command and environment names used (section, tikzpicture, ...)
+#
+# The API keeps it in sync on create/update/delete, inside the same
+# transaction as the note itself.
+#
+# FTS5 is SQLite-only. On PostgreSQL the index functions do nothing and
+# search_notes() falls back to plain substring matching (unranked).
+
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Note
+from app.models.note import decompress_content
+
+# Column weights for ranking (owner, title, body, commands): a hit in the
+# title counts ten times a hit in the body
+RANK_WEIGHTS = (0.0, 10.0, 1.0, 0.5)
+_RANK = "bm25(notes_fts, {})".format(", ".join(str(w) for w in RANK_WEIGHTS))
+
+SNIPPET_TOKENS = 16
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+
+CREATE_INDEX_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+    "owner, title, body, commands, "
+    "tokenize = 'unicode61 remove_diacritics 2', "
+    "prefix = '2 3')"
+)
+# prefix='2 3' keeps extra index entries for 2- and 3-letter prefixes, so
+# search-as-you-type queries like "eig*" don't scan the whole vocabulary
+
+# One LaTeX token: control word, control symbol, comment, special char, or plain text
+_TOKEN = re.compile(r"\\[A-Za-z@]+\*?|\\.|%[^\n]*|[{}\[\]$&~^_#]|[^\\%{}\[\]$&~^_#]+", re.DOTALL)
+_ENVIRONMENT = re.compile(r"\\(begin|end)\s*\{([^}]*)\}")
+_BEGIN_DOCUMENT = re.compile(r"\\begin\s*\{document\}")
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# Characters that mean something in HTML - stored text never contains them,
+# so snippets are safe to render with their <mark> highlights
+_HTML_UNSAFE = str.maketrans({"<": " ", ">": " ", "&": " ", '"': " ", "'": " "})
+
+
+def latex_to_search_text(source: str) -> Tuple[str, str]:
+    """
+    Split LaTeX into (body, commands) text for indexing, in one pass.
+
+    - prose is indexed as-is, minus braces and other markup
+    - command names (\\section, \\textbf) go to `commands`, not `body`,
+      so searching "section" doesn't match every document
+    - inside math, command names are kept in `body` too: searching for
+      "alpha" or "sum" should find $\\alpha$ and \\sum
+    - comments are dropped; the preamble only contributes to `commands`
+      (document class, package names)
+    """
+    body: List[str] = []
+    commands: dict = {}  # Ordered set - each name once keeps the index small
+
+    def add_command(name: str) -> None:
+        if name:
+            commands.setdefault(name, None)
+
+    match = _BEGIN_DOCUMENT.search(source)
+    if match is not None:
+        preamble, source = source[:match.start()], source[match.end():]
+        for token in _TOKEN.findall(preamble):
+            if token.startswith("%"):
+                continue
+            if token.startswith("\\"):
+                add_command(token[1:].rstrip("*"))
+            else:
+                for word in _WORD.findall(token):
+                    add_command(word)
+
+    # Environments become a single command name each (theorem, align, ...)
+    def environment(m):
+        if m.group(1) == "begin":
+            add_command(m.group(2).strip().rstrip("*"))
+        return " "
+    source = _ENVIRONMENT.sub(environment, source)
+
+    in_math = False
+    for token in _TOKEN.findall(source):
+        first = token[0]
+        if first == "%":
+            continue  # Comment
+        if first == "\\":
+            name = token[1:]
+            if name in ("(", "["):
+                in_math = True
+            elif name in (")", "]"):
+                in_math = False
+            elif name[:1].isalpha() or name[:1] == "@":
+                name = name.rstrip("*")
+                add_command(name)
+                if in_math:
+                    body.append(name)
+            # Other control symbols (\\, \,, \%) are spacing or escapes
+            body.append(" ")
+        elif first == "$":
+            in_math = not in_math  # $$ toggles twice, which is still correct
+            body.append(" ")
+        elif token in "{}[]&~^_#":
+            body.append(" ")
+        else:
+            body.append(token)
+
+    body_text = re.sub(r"\s+", " ", "".join(body).translate(_HTML_UNSAFE)).strip()
+    return body_text, " ".join(commands).translate(_HTML_UNSAFE)
+
+
+def _is_sqlite(db: AsyncSession) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def _owner_token(user_id: int) -> str:
+    return f"u{user_id}"
+
+
+async def index_note(db: AsyncSession, note_id: int, user_id: int, title: str, latex_content: str) -> None:
+    """Add or refresh a note in the search index (caller commits)."""
+    await index_notes(db, [(note_id, user_id, title, latex_content)])
+
+
+async def index_notes(db: AsyncSession, notes: Sequence[Tuple[int, int, str, str]]) -> None:
+    """Bulk index_note() for (note_id, user_id, title, latex_content) tuples."""
+    if not notes or not _is_sqlite(db):
+        return
+    await remove_notes(db, [note[0] for note in notes])
+    rows = []
+    for note_id, user_id, title, latex_content in notes:
+        body, commands = latex_to_search_text(latex_content)
+        rows.append({
+            "id": note_id,
+            "owner": _owner_token(user_id),
+            "title": title.translate(_HTML_UNSAFE),
+            "body": body,
+            "commands": commands,
+        })
+    await db.execute(
+        text(
+            "INSERT INTO notes_fts (rowid, owner, title, body, commands) "
+            "VALUES (:id, :owner, :title, :body, :commands)"
+        ),
+        rows,
+    )
+
+
+async def retitle_note(db: AsyncSession, note_id: int, title: str) -> None:
+    """Refresh only a note's title in the index - no need to re-read its body (caller commits)."""
+    if not _is_sqlite(db):
+        return
+    await db.execute(
+        text("UPDATE notes_fts SET title = :title WHERE rowid = :id"),
+        {"id": note_id, "title": title.translate(_HTML_UNSAFE)},
+    )
+
+
+async def remove_note(db: AsyncSession, note_id: int) -> None:
+    """Drop a note from the search index (caller commits)."""
+    await remove_notes(db, [note_id])
+
+
+async def remove_notes(db: AsyncSession, note_ids: Sequence[int]) -> None:
+    """Bulk remove_note()."""
+    if not note_ids or not _is_sqlite(db):
+        return
+    await db.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), [{"id": note_id} for note_id in note_ids])
+
+
+def build_match_query(user_id: int, query: str, command: Optional[str] = None) -> Optional[str]:
+    """
+    Turn free text from the user into a safe FTS5 MATCH expression.
+    Every word must appear (AND); the last word also matches as a prefix,
+    so results show up while the user is still typing.
+    Returns None if the query has no searchable words.
+    """
+    words = _WORD.findall(query)
+    if not words and not command:
+        return None
+
+    parts = [f'owner : "{_owner_token(user_id)}"']
+    if words:
+        # Quoting each word means FTS5 operators typed by the user (NEAR,
+        # OR, *, ^) are searched for literally instead of being interpreted
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += "*"
+        parts.append("{title body} : (" + " AND ".join(terms) + ")")
+    if command:
+        names = _WORD.findall(command)
+        if names:
+            parts.append("commands : (" + " AND ".join(f'"{name}"' for name in names) + ")")
+    return " AND ".join(parts)
+
+
+async def search_notes(db: AsyncSession, user_id: int, query: str, command: Optional[str],
+                       limit: int, offset: int) -> List[dict]:
+    """Ranked search over one user's notes, best match first."""
+    if not _is_sqlite(db):
+        return await _search_notes_fallback(db, user_id, query, command, limit, offset)
+    match = build_match_query(user_id, query, command)
+    if match is None:
+        return []
+    result = await db.execute(
+        text(
+            "SELECT n.id, n.title, n.status, n.pdf_url, n.created_at, n.updated_at, "
+            f"highlight(notes_fts, 1, :open, :close) AS title_highlight, "
+            f"snippet(notes_fts, 2, :open, :close, '…', :tokens) AS snippet, "
+            f"{_RANK} AS rank "
+            "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+            "WHERE notes_fts MATCH :match "
+            f"ORDER BY {_RANK} "
+            "LIMIT :limit OFFSET :offset"
+        ),
+        {
+            "match": match,
+            "open": HIGHLIGHT_OPEN,
+            "close": HIGHLIGHT_CLOSE,
+            "tokens": SNIPPET_TOKENS,
+            "limit": limit,
+            "offset": offset,
+        },
+    )
+    return [dict(row._mapping) for row in result]
+
+
+def _like_pattern(word: str) -> str:
+    # "_" is a word character but a LIKE wildcard, so it is escaped
+    return "%" + word.replace("\\", "\\\\").replace("_", "\\_") + "%"
+
+
+async def _search_notes_fallback(db: AsyncSession, user_id: int, query: str, command: Optional[str],
+                                 limit: int, offset: int) -> List[dict]:
+    """
+    Substring search for databases without FTS5: every word must appear in
+    the title or the source. Newest first, no ranking or highlighting.
+    """
+    words = _WORD.findall(query)
+    names = _WORD.findall(command or "")
+    if not words and not names:
+        return []
+    conditions = [Note.user_id == user_id]
+    for word in words:
+        pattern = _like_pattern(word)
+        conditions.append(or_(Note.title.ilike(pattern, escape="\\"),
+                              Note.latex_content.ilike(pattern, escape="\\")))
+    for name in names:
+        conditions.append(Note.latex_content.ilike(_like_pattern("\\" + name), escape="\\"))
+    result = await db.execute(
+        select(Note.id, Note.title, Note.status, Note.pdf_url, Note.created_at, Note.updated_at,
+               Note.latex_content)
+        .where(and_(*conditions))
+        .order_by(Note.updated_at.desc(), Note.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    hits = []
+    for row in result:
+        hit = row._asdict()
+        body, _ = latex_to_search_text(hit.pop("latex_content"))
+        hit["title_highlight"] = hit["title"].translate(_HTML_UNSAFE)
+        hit["snippet"] = " ".join(body.split(" ")[:SNIPPET_TOKENS])
+        hit["rank"] = 0.0
+        hits.append(hit)
+    return hits
+
+
+def create_search_index(connection) -> None:
+    """Create the FTS table if needed (takes a sync connection, e.g. from create_db.py)."""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(CREATE_INDEX_SQL)
+
+
+def rebuild_search_index(connection) -> int:
+    """Re-index every note from scratch (sync connection). Returns the note count."""
+    if connection.dialect.name != "sqlite":
+        return 0
+    connection.exec_driver_sql("DELETE FROM notes_fts")
+    rows = connection.exec_driver_sql("SELECT id, user_id, title, latex_content FROM notes").fetchall()
+    for note_id, user_id, title, latex_content in rows:
+        # Raw SQL skips the column type, so decode stored bodies here
+        body, commands = latex_to_search_text(decompress_content(latex_content))
+        connection.exec_driver_sql(
+            "INSERT INTO notes_fts (rowid, owner, title, body, commands) VALUES (?, ?, ?, ?, ?)",
+            (note_id, _owner_token(user_id), title.translate(_HTML_UNSAFE), body, commands),
+        )
+    return len(rows)
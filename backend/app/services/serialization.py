@@ -0,0 +1,70 @@
+# Serialization - the fast path from database rows to JSON bytes
+#
+# FastAPI's default path for a route with a response_model is: validate
+# the returned value into the Pydantic model (for ORM objects, attribute
+# by attribute via from_attributes), dump it back to plain Python, then
+# encode that with the stdlib json module. For a page of 200 notes that
+# round-trip is most of the request's CPU time.
+#
+# Note routes skip it: they build plain dicts straight from rows/objects
+# (row._asdict(), note_dict) and return a FastJSONResponse, which FastAPI
+# sends as is. The response_model stays on each route, so the OpenAPI
+# docs are unchanged - the dicts here must keep matching those schemas.
+#
+# FastJSONResponse encodes with orjson (several times faster than json,
+# and it handles datetimes natively). Without orjson installed it falls
+# back to the stdlib encoder with the same output format.
+
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# The fields of NoteResponse, in schema order (so bodies are byte-identical)
+NOTE_FIELDS = (
+    "title", "latex_content", "id", "user_id", "revision", "version", "content_size",
+    "word_count", "math_count", "document_class", "packages",
+    "pdf_url", "status", "created_at", "updated_at", "changed_at",
+)
+
+
+def _default(value: Any) -> Any:
+    """Stdlib fallback for what orjson encodes natively."""
+    if isinstance(value, datetime):
+        return _isoformat(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _isoformat(moment: datetime) -> str:
+    # UTC as "Z", like Pydantic and orjson's OPT_UTC_Z
+    if moment.utcoffset() is not None and moment.utcoffset().total_seconds() == 0:
+        return moment.replace(tzinfo=None).isoformat() + "Z"
+    return moment.isoformat()
+
+
+def dumps(content: Any) -> bytes:
+    """Encode a response body - the same bytes Pydantic's JSON mode would produce."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with orjson (or a compact stdlib fallback)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def note_dict(note) -> dict:
+    """A Note (ORM object) as a NoteResponse body."""
+    return {field: getattr(note, field) for field in NOTE_FIELDS}
+
@@ -0,0 +1,122 @@
+# Sync - "what changed since I last looked?" for offline-capable clients
+#
+# A client that keeps copies of its notes shouldn't re-download the whole
+# list to stay current. Instead:
+#
+#   1. The first page of a normal listing (GET /notes/) carries a
+#      sync_token - the position of the newest change at that moment.
+#   2. Later, GET /notes/?changed_since=<token> returns only the notes
+#      changed after it (oldest first, paged by the same limit) and the ids
+#      of notes deleted meanwhile, plus a new sync_token to keep.
+#
+# Tokens are keyset positions (changed_at, id) in the notes table (see
+# Note.changed_at and the ix_notes_user_changed_id index), packed like the
+# list cursors. Deletions leave NoteTombstone rows, kept for
+# SYNC_TOMBSTONE_DAYS; an older token can't be answered and gets 410.
+#
+# changed_at is stamped when a write is flushed, not when it commits, so
+# a slow transaction can commit a change *older* than one already visible.
+# A token past it would skip it forever. Hence tokens stay
+# SYNC_TOKEN_LAG_SECONDS behind the clock: changes newer than that "horizon"
+# are left for the next sync, by which time any transaction that stamped
+# an earlier time has committed. Clients see changes up to that much later
+# (live updates come from GET /events) and may get some twice - they apply
+# them idempotently.
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Sequence, Tuple
+
+from sqlalchemy import delete, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.models import Note, NoteTombstone
+from app.services.pagination import decode_cursor, encode_cursor, parse_datetime
+
+
+class SyncTokenExpired(Exception):
+    """The token is older than the tombstones we keep - the client must reload everything."""
+
+
+def _utc(moment: datetime) -> datetime:
+    # SQLite hands DateTime(timezone=True) values back naive - they are UTC
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def decode_token(token: str) -> Tuple[datetime, int]:
+    """(changed_at, id) of a sync token. Raises ValueError if it isn't one of ours."""
+    values = decode_cursor(token)
+    if len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError("Malformed sync token")
+    return parse_datetime(values[0]), values[1]
+
+
+def _horizon() -> datetime:
+    """Newest position a token may have - see the lag above."""
+    return datetime.now(timezone.utc) - timedelta(seconds=config.SYNC_TOKEN_LAG_SECONDS)
+
+
+async def current_token(db: AsyncSession, user_id: int) -> str:
+    """A token for "everything up to now" - served with the first page of a listing."""
+    newest = await db.scalar(select(func.max(Note.changed_at)).where(Note.user_id == user_id))
+    horizon = _horizon()
+    # id 0: the newest note(s) may come once more on the next sync - harmless,
+    # clients apply changes idempotently. Capped at the horizon, so an
+    # uncommitted older change isn't skipped (a quiet account keeps the same
+    # token, and the page its ETag)
+    return encode_cursor([min(_utc(newest), horizon) if newest else horizon, 0])
+
+
+async def changes(db: AsyncSession, user_id: int, token: str, limit: int,
+                  columns: Sequence) -> Tuple[list, List[int], str, bool]:
+    """
+    Notes changed and deleted after `token`, at most `limit` changed notes,
+    oldest change first. Returns (rows, deleted_ids, new_token, has_more).
+    Raises ValueError for a bad token, SyncTokenExpired for an old one.
+    """
+    since, last_id = decode_token(token)
+    if _utc(since) < datetime.now(timezone.utc) - timedelta(days=config.SYNC_TOMBSTONE_DAYS):
+        raise SyncTokenExpired()
+
+    # Only changes up to the horizon: everything there has committed
+    horizon = _horizon()
+    rows = (await db.execute(
+        select(*columns)
+        .where(Note.user_id == user_id, tuple_(Note.changed_at, Note.id) > tuple_(since, last_id),
+               Note.changed_at <= horizon)
+        .order_by(Note.changed_at, Note.id)
+        .limit(limit + 1)
+    )).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Deletions in the same window: up to the last change on this page if
+    # more pages follow, otherwise everything up to the horizon
+    tombstones = select(NoteTombstone.note_id, NoteTombstone.deleted_at).where(
+        NoteTombstone.user_id == user_id, NoteTombstone.deleted_at > since,
+        NoteTombstone.deleted_at <= (rows[-1].changed_at if has_more else horizon),
+    )
+    deleted = (await db.execute(tombstones.order_by(NoteTombstone.deleted_at))).all()
+
+    position = (_utc(since), last_id)
+    if rows:
+        position = (_utc(rows[-1].changed_at), rows[-1].id)
+    if deleted and _utc(deleted[-1].deleted_at) > position[0]:
+        position = (_utc(deleted[-1].deleted_at), 0)
+    if not has_more and position < (horizon, 0):
+        # Nothing else up to the horizon - move the token there, so an idle
+        # client's token doesn't age into SyncTokenExpired
+        position = (horizon, 0)
+    return rows, [note_id for note_id, _ in deleted], encode_cursor(list(position)), has_more
+
+
+async def record_deletions(db: AsyncSession, user_id: int, note_ids: Sequence[int]) -> None:
+    """Leave tombstones for deleted notes and drop expired ones (caller commits)."""
+    if not note_ids:
+        return
+    now = datetime.now(timezone.utc)
+    await db.execute(insert(NoteTombstone), [
+        {"note_id": note_id, "user_id": user_id, "deleted_at": now} for note_id in note_ids
+    ])
+    cutoff = now - timedelta(days=config.SYNC_TOMBSTONE_DAYS)
+    await db.execute(delete(NoteTombstone).where(NoteTombstone.deleted_at < cutoff))
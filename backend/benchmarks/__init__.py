@@ -0,0 +1 @@
+# Benchmarks - standalone performance measurements (run with python -m benchmarks.<name>)
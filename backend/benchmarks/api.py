@@ -0,0 +1,362 @@
+# Benchmark - the HTTP API under load, in-process
+#
+# Drives app.main:app through httpx's ASGI transport - no server, no
+# sockets - against a throwaway SQLite database, so runs are reproducible
+# and measure the application itself. Each scenario fires a fixed number
+# of requests from `--concurrency` concurrent clients and reports
+# throughput and p50/p95/p99 latency:
+#
+#   auth      register, login
+#   crud      create, read, update and delete single notes
+#   list      the first page of the note list, for every combination of
+#             --note-counts and --doc-sizes-kb (with and without bodies)
+#   validate  POST /validate-latex for every size in --validate-sizes-kb
+#
+# The compile dispatcher is not started: compiles are queued but never
+# run, so TeX doesn't compete with the API for the CPU.
+#
+# Baselines: --save writes the results as JSON (with the git commit they
+# came from); --compare prints the change against such a file and exits
+# with status 1 if any scenario's p95 got worse by more than --threshold.
+#
+# Usage (from backend/):
+#   python -m benchmarks.api --concurrency 16 --save baseline.json
+#   python -m benchmarks.api --scenarios crud,list --compare baseline.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+SCENARIOS = ("auth", "crud", "list", "validate")
+PASSWORD = "benchmark-password"
+
+# Notes created per POST /notes/batch while seeding the list scenarios
+SEED_BATCH = 500
+
+
+@dataclass
+class Result:
+    """Measurements of one scenario."""
+    name: str
+    requests: int
+    errors: int
+    concurrency: int
+    seconds: float
+    throughput: float  # Requests per second
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+async def run_load(name: str, request: Callable[[int], Awaitable[bool]], total: int,
+                   concurrency: int, warmup: int = 0) -> Result:
+    """
+    Call request(i) for i in range(total) from `concurrency` concurrent
+    clients. request returns False when the response was wrong (an error).
+    The first `warmup` calls are made beforehand and not measured.
+    """
+    for i in range(warmup):
+        await request(-1 - i)
+
+    latencies: List[float] = []
+    errors = 0
+    next_index = iter(range(total))
+
+    async def client() -> None:
+        nonlocal errors
+        for i in next_index:  # Shared iterator: each index is taken once
+            started = time.perf_counter()
+            try:
+                ok = await request(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(max(1, min(concurrency, total)))))
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    return Result(
+        name=name,
+        requests=total,
+        errors=errors,
+        concurrency=concurrency,
+        seconds=round(seconds, 4),
+        throughput=round(total / seconds, 1) if seconds else 0.0,
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 3),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 3),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+        max_ms=round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    )
+
+
+async def register_and_login(client, email: str) -> Dict[str, str]:
+    """Create a user and return its Authorization header."""
+    response = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    response = await client.post("/auth/login", data={"username": email, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def bench_auth(client, args, run_id: str) -> List[Result]:
+    # Password hashing dominates here, so this scenario has its own count
+    total = args.auth_requests
+
+    async def register(i: int) -> bool:
+        email = f"auth-{run_id}-{i}@bench.example"
+        response = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+        return response.status_code == 200
+
+    async def login(i: int) -> bool:
+        response = await client.post(
+            "/auth/login", data={"username": f"auth-{run_id}-{i % total}@bench.example", "password": PASSWORD}
+        )
+        return response.status_code == 200
+
+    return [
+        await run_load("auth register", register, total, args.concurrency),
+        await run_load("auth login", login, total, args.concurrency),
+    ]
+
+
+async def bench_crud(client, args, run_id: str) -> List[Result]:
+    from benchmarks.content_compression import make_note
+
+    headers = await register_and_login(client, f"crud-{run_id}@bench.example")
+    rng = random.Random(args.seed)
+    body = make_note(args.crud_size_kb * 1024, rng)
+    note_ids: Dict[int, int] = {}
+
+    async def create(i: int) -> bool:
+        # Unique text per note, so every save is a real change
+        response = await client.post(
+            "/notes/", json={"title": f"Note {i}", "latex_content": f"% {i}\n{body}"}, headers=headers
+        )
+        if response.status_code != 200:
+            return False
+        if i >= 0:
+            note_ids[i] = response.json()["id"]
+        return True
+
+    async def read(i: int) -> bool:
+        response = await client.get(f"/notes/{note_ids[i % len(note_ids)]}", headers=headers)
+        return response.status_code == 200
+
+    async def update(i: int) -> bool:
+        response = await client.put(
+            f"/notes/{note_ids[i]}", json={"latex_content": f"% {i} edited\n{body}"}, headers=headers
+        )
+        return response.status_code == 200
+
+    async def delete(i: int) -> bool:
+        response = await client.delete(f"/notes/{note_ids[i]}", headers=headers)
+        return response.status_code == 200
+
+    total, concurrency = args.requests, args.concurrency
+    results = [await run_load("note create", create, total, concurrency, args.warmup)]
+    results.append(await run_load("note read", read, total, concurrency, args.warmup))
+    results.append(await run_load("note update", update, total, concurrency))
+    results.append(await run_load("note delete", delete, total, concurrency))
+    return results
+
+
+async def seed_notes(client, headers: Dict[str, str], count: int, size_kb: int, seed: int) -> None:
+    """Create `count` notes of about `size_kb` through the batch endpoint."""
+    from benchmarks.content_compression import make_note
+
+    rng = random.Random(seed)
+    bodies = [make_note(size_kb * 1024, rng) for _ in range(min(count, 20))]
+    for start in range(0, count, SEED_BATCH):
+        operations = [
+            {"op": "create", "title": f"Seeded note {i}", "latex_content": f"% {i}\n{bodies[i % len(bodies)]}"}
+            for i in range(start, min(count, start + SEED_BATCH))
+        ]
+        response = await client.post("/notes/batch", json={"operations": operations}, headers=headers)
+        response.raise_for_status()
+
+
+async def bench_list(client, args, run_id: str) -> List[Result]:
+    results = []
+    for count in args.note_counts:
+        for size_kb in args.doc_sizes_kb:
+            headers = await register_and_login(client, f"list-{run_id}-{count}-{size_kb}@bench.example")
+            await seed_notes(client, headers, count, size_kb, args.seed)
+
+            async def summaries(i: int) -> bool:
+                response = await client.get("/notes/", params={"limit": args.page_size}, headers=headers)
+                return response.status_code == 200
+
+            async def with_content(i: int) -> bool:
+                response = await client.get(
+                    "/notes/", params={"limit": args.page_size, "include_content": "true"}, headers=headers
+                )
+                return response.status_code == 200
+
+            label = f"list n={count} size={size_kb}KB"
+            results.append(await run_load(label, summaries, args.requests, args.concurrency, args.warmup))
+            results.append(await run_load(label + " +content", with_content, args.requests,
+                                          args.concurrency, args.warmup))
+    return results
+
+
+async def bench_validate(client, args, run_id: str) -> List[Result]:
+    from benchmarks.content_compression import make_note
+
+    results = []
+    rng = random.Random(args.seed)
+    for size_kb in args.validate_sizes_kb:
+        payload = {"latex": make_note(size_kb * 1024, rng)}
+
+        async def validate(i: int) -> bool:
+            response = await client.post("/validate-latex", json=payload)
+            return response.status_code == 200
+
+        results.append(await run_load(f"validate-latex size={size_kb}KB", validate, args.requests,
+                                      args.concurrency, args.warmup))
+    return results
+
+
+BENCHMARKS = {"auth": bench_auth, "crud": bench_crud, "list": bench_list, "validate": bench_validate}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Result], baseline: Optional[dict]) -> None:
+    previous = {entry["name"]: entry for entry in (baseline or {}).get("results", [])}
+    header = f"{'scenario':<36}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    if previous:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    for result in results:
+        line = (f"{result.name:<36}{result.throughput:>10.1f}{result.p50_ms:>10.2f}"
+                f"{result.p95_ms:>10.2f}{result.p99_ms:>10.2f}{result.errors:>8}")
+        before = previous.get(result.name)
+        if before and before["p95_ms"]:
+            line += f"{(result.p95_ms / before['p95_ms'] - 1) * 100:>+13.1f}%"
+        print(line)
+
+
+def regressions(results: List[Result], baseline: dict, threshold: float) -> List[str]:
+    """Scenarios whose p95 latency grew by more than `threshold` (a fraction)."""
+    previous = {entry["name"]: entry for entry in baseline.get("results", [])}
+    return [
+        result.name for result in results
+        if result.name in previous and previous[result.name]["p95_ms"]
+        and result.p95_ms > previous[result.name]["p95_ms"] * (1 + threshold)
+    ]
+
+
+async def run(args) -> List[Result]:
+    import httpx
+    import create_db
+    from app.database import async_engine
+    from app.main import app
+
+    create_db.create_tables()
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    transport = httpx.ASGITransport(app=app)
+    results: List[Result] = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for scenario in args.scenarios:
+            results += await BENCHMARKS[scenario](client, args, run_id)
+    await async_engine.dispose()  # Its connection threads would keep the process alive
+    return results
+
+
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="In-process load test of the NoTeX API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--auth-requests", type=int, default=50, help="Requests per auth scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before a scenario")
+    parser.add_argument("--note-counts", type=int_list, default=[100, 1000])
+    parser.add_argument("--doc-sizes-kb", type=int_list, default=[2, 50])
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--crud-size-kb", type=int, default=10)
+    parser.add_argument("--validate-sizes-kb", type=int_list, default=[10, 500])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="FILE", help="Write the results to a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=20.0,
+                        help="p95 increase (percent) that counts as a regression")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app reads its settings on import, so point it at throwaway
+        # storage before anything from app/ is loaded
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        os.environ["STORAGE_DIR"] = os.path.join(directory, "storage")
+        results = asyncio.run(run(args))
+
+    print(f"\n{args.requests} requests per scenario, concurrency {args.concurrency}\n")
+    print_results(results, baseline)
+
+    if args.save:
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+            "results": [asdict(result) for result in results],
+        }
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if baseline is not None:
+        worse = regressions(results, baseline, args.threshold / 100)
+        if worse:
+            print(f"\nRegressions (p95 more than {args.threshold:g}% slower than commit "
+                  f"{baseline.get('commit') or '?'}): {', '.join(worse)}")
+            sys.exit(1)
+        print(f"\nNo p95 regressions beyond {args.threshold:g}% against commit {baseline.get('commit') or '?'}")
+
+
+if __name__ == "__main__":
+    main()
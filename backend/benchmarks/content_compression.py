@@ -0,0 +1,115 @@
+# Benchmark - plain Text vs CompressedText for note bodies
+#
+# Builds two throwaway SQLite databases with the same synthetic LaTeX notes,
+# one storing latex_content as plain TEXT and one as CompressedText (the
+# type Note uses), and compares:
+#   - database file size
+#   - write latency (one note insert + commit, like a save)
+#   - read latency (load one body by id, like opening a note)
+#
+# Usage (from backend/):
+#   python -m benchmarks.content_compression --notes 500 --size-kb 200
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, create_engine, event, insert, select
+
+from app.database import _tune_sqlite_connection
+from app.models.note import CompressedText
+
+SAMPLE_WORDS = (
+    "theorem lemma proof let suppose then hence matrix vector space basis "
+    "eigenvalue continuous function integral derivative converges bounded"
+).split()
+
+
+def make_note(size_bytes: int, rng: random.Random) -> str:
+    """Synthetic but realistic LaTeX: prose, math and environments."""
+    parts = ["\\documentclass{article}\n\\usepackage{amsmath,amssymb}\n\\begin{document}\n"]
+    total = len(parts[0])
+    while total < size_bytes:
+        words = " ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(8, 30)))
+        block = rng.choice((
+            f"{words.capitalize()}.\n",
+            f"\\begin{{theorem}}\n{words} $\\int_0^{{{rng.randint(1, 9)}}} f(x)\\,dx$.\n\\end{{theorem}}\n",
+            f"\\begin{{align}}\n  a_{{{rng.randint(1, 99)}}} &= \\sum_{{k=1}}^n x_k^2 \\\\\n\\end{{align}}\n",
+            f"\\section{{{words[:40]}}}\n",
+        ))
+        parts.append(block)
+        total += len(block)
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def make_table(column_type) -> Table:
+    return Table(
+        "notes", MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("latex_content", column_type, nullable=False),
+    )
+
+
+def measure(label: str, column_type, bodies: list, reads: int, rng: random.Random) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        event.listen(engine, "connect", _tune_sqlite_connection)  # Same PRAGMAs as the app
+        table = make_table(column_type)
+        table.metadata.create_all(engine)
+
+        write_times = []
+        for body in bodies:
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                connection.execute(insert(table).values(latex_content=body))
+            write_times.append(time.perf_counter() - started)
+
+        read_times = []
+        with engine.connect() as connection:
+            for _ in range(reads):
+                note_id = rng.randint(1, len(bodies))
+                started = time.perf_counter()
+                connection.execute(select(table.c.latex_content).where(table.c.id == note_id)).scalar_one()
+                read_times.append(time.perf_counter() - started)
+
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        engine.dispose()
+        return {
+            "label": label,
+            "size_mb": os.path.getsize(path) / 1024 / 1024,
+            "write_ms": statistics.median(write_times) * 1000,
+            "read_ms": statistics.median(read_times) * 1000,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", type=int, default=500)
+    parser.add_argument("--size-kb", type=int, default=50, help="Size of each note body")
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    bodies = [make_note(args.size_kb * 1024, rng) for _ in range(args.notes)]
+    print(f"{args.notes} notes of ~{args.size_kb} KB, {args.reads} random reads\n")
+
+    results = [
+        measure("Text", Text(), bodies, args.reads, random.Random(args.seed)),
+        measure("CompressedText", CompressedText(), bodies, args.reads, random.Random(args.seed)),
+    ]
+    print(f"{'column type':<16}{'db size':>12}{'write (median)':>18}{'read (median)':>18}")
+    for result in results:
+        print(f"{result['label']:<16}{result['size_mb']:>9.1f} MB{result['write_ms']:>15.2f} ms{result['read_ms']:>15.2f} ms")
+    plain, compressed = results
+    print(f"\nSize ratio: {plain['size_mb'] / compressed['size_mb']:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Benchmark - FastAPI's response_model path vs the fast serialization path
+#
+# Encodes the same note data both ways and checks the JSON is the same:
+#   standard  what FastAPI does with a returned value and a response_model:
+#             validate into the model (from_attributes for ORM objects),
+#             dump to plain Python, encode with the stdlib JSONResponse
+#   fast      plain dicts straight from rows / objects, encoded by
+#             FastJSONResponse (orjson) - see app/services/serialization.py
+#
+# Cases: a 1k-row note list (with and without bodies) and 1k single-note
+# responses built from ORM objects.
+#
+# Usage (from backend/):
+#   python -m benchmarks.note_serialization --notes 1000 --size-kb 2
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models import Note
+from app.schemas import NotePage, NoteResponse
+from app.services import serialization
+from app.services.latex_analyzer import document_stats
+from app.services.serialization import FastJSONResponse, note_dict
+from benchmarks.content_compression import make_note
+
+SummaryRow = namedtuple("SummaryRow", "id user_id title pdf_url status revision version content_size word_count math_count document_class packages created_at updated_at changed_at")
+ContentRow = namedtuple("ContentRow", SummaryRow._fields + ("latex_content",))
+
+
+def make_rows(count: int, size_kb: int, with_content: bool, rng: random.Random) -> list:
+    body = make_note(size_kb * 1024, rng) if with_content else None
+    start = datetime(2025, 1, 1)
+    rows = []
+    for i in range(count):
+        values = (
+            i + 1, 7, f"Lecture notes {i}", f"/notes/{i + 1}/pdf", "completed", rng.randint(1, 50), 1,
+            size_kb * 1024, 180 * size_kb, 12 * size_kb, "article", ["amsmath", "amssymb"],
+            start + timedelta(minutes=i), start + timedelta(minutes=i, seconds=30),
+            start + timedelta(minutes=i, seconds=45),
+        )
+        rows.append(ContentRow(*values, body) if with_content else SummaryRow(*values))
+    return rows
+
+
+def make_notes(count: int, size_kb: int, rng: random.Random) -> list:
+    body = make_note(size_kb * 1024, rng)
+    stats = document_stats(body)  # The API stores these on save (see services/note_stats.py)
+    now = datetime(2025, 1, 1)
+    return [
+        Note(id=i + 1, user_id=7, title=f"Lecture notes {i}", latex_content=body, revision=3, version=3,
+             pdf_url=f"/notes/{i + 1}/pdf", status="completed", created_at=now, updated_at=now, changed_at=now,
+             **stats)
+        for i in range(count)
+    ]
+
+
+def best_of(function, repeats: int) -> float:
+    """Median wall time of `repeats` calls, in milliseconds."""
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times) * 1000
+
+
+async def standard(field, contents: list, exclude_unset: bool = False) -> list:
+    """FastAPI's own path for values returned from a route with a response_model."""
+    bodies = []
+    for content in contents:
+        value = await serialize_response(
+            field=field, response_content=content, exclude_unset=exclude_unset, is_coroutine=True
+        )
+        bodies.append(JSONResponse(value).body)
+    return bodies
+
+
+def compare(label: str, standard_call, fast_call, repeats: int) -> None:
+    # The stdlib encoder spaces its output differently, so compare parsed values
+    same = [json.loads(body) for body in standard_call()] == [json.loads(body) for body in fast_call()]
+    slow_ms, fast_ms = best_of(standard_call, repeats), best_of(fast_call, repeats)
+    print(f"{label:<34}{slow_ms:>12.2f}{fast_ms:>12.2f}{slow_ms / fast_ms:>10.1f}x   {'yes' if same else 'NO'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Note response serialization: standard vs fast path")
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--size-kb", type=int, default=2, help="Size of each note body")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    loop = asyncio.new_event_loop()
+
+    page_field = create_response_field(name="Response_list", type_=NotePage, mode="serialization")
+    note_field = create_response_field(name="Response_note", type_=NoteResponse, mode="serialization")
+    print(f"encoder: {'orjson' if serialization.orjson is not None else 'stdlib json (orjson not installed)'}")
+    print(f"{args.notes} notes, bodies ~{args.size_kb} KB, median of {args.repeats} runs\n")
+    print(f"{'case':<34}{'standard ms':>12}{'fast ms':>12}{'speedup':>10}   same JSON")
+
+    for with_content in (False, True):
+        rows = make_rows(args.notes, args.size_kb, with_content, rng)
+        compare(
+            f"list of {args.notes}" + (" +content" if with_content else ""),
+            lambda: loop.run_until_complete(standard(
+                page_field, [{"items": [row._asdict() for row in rows], "next_cursor": None}], exclude_unset=True
+            )),
+            lambda: [FastJSONResponse({"items": [row._asdict() for row in rows], "next_cursor": None}).body],
+            args.repeats,
+        )
+
+    notes = make_notes(args.notes, args.size_kb, rng)
+    compare(
+        f"{args.notes} single-note responses",
+        lambda: loop.run_until_complete(standard(note_field, notes)),
+        lambda: [FastJSONResponse(note_dict(note)).body for note in notes],
+        max(1, args.repeats // 4),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,42 @@
 # Database initialization script
-# This creates all tables defined in our models
+# Brings the database schema up to date by running the Alembic migrations
+# in migrations/ (the same as `alembic upgrade head`)
 
-from app.database import engine, Base
-from app.models import User, Note  # Import models to register them
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+
+from app.database import engine
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+# Databases created before migrations existed (by Base.metadata.create_all)
+# have tables but no alembic_version - we tell Alembic which revision they
+# already match, so it doesn't try to create those tables again
+LEGACY_REVISIONS = (
+    ("compile_jobs", "0002"),  # Had the compile queue, artifacts and search
+    ("notes", "0001"),         # Just users and notes
+)
+
+def _adopt_legacy_database(alembic_config: Config) -> None:
+    tables = set(inspect(engine).get_table_names())
+    if "alembic_version" in tables:
+        return
+    for table, revision in LEGACY_REVISIONS:
+        if table in tables:
+            print(f"Existing database without migration history - marking it as revision {revision}")
+            command.stamp(alembic_config, revision)
+            return
 
 def create_tables():
-    """Create all database tables."""
-    print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    """Create or upgrade all database tables."""
+    print("Running database migrations...")
+    alembic_config = Config(ALEMBIC_INI)
+    alembic_config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    _adopt_legacy_database(alembic_config)
+    command.upgrade(alembic_config, "head")
     print("✅ Database tables created successfully!")
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+# Alembic environment - connects migrations to our models and database
+
+from logging.config import fileConfig
+
+from alembic import context
+
+from app.database import Base, engine
+import app.models  # noqa: F401 - registers every table on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# Autogenerate compares the database against this
+target_metadata = Base.metadata
+
+# Tables Alembic should leave alone: the FTS5 search index and its shadow
+# tables are managed by raw SQL in the migrations (see services/search.py)
+def include_object(obj, name, type_, reflected, compare_to):
+    return not (type_ == "table" and name.startswith("notes_fts"))
+
+
+def run_migrations_offline() -> None:
+    """Print the SQL instead of running it (alembic upgrade head --sql)."""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Run migrations over the app's own engine (same URL, same PRAGMAs)."""
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            # SQLite can't ALTER most column properties - batch mode
+            # rebuilds the table instead
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,155 @@
+"""Compile queue, artifact store, note list index and full-text search
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+import re
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Frozen copies of the search index DDL and tokenizer as they were at this
+# revision - a migration must not change when app/services/search.py does
+CREATE_INDEX_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+    "owner, title, body, commands, "
+    "tokenize = 'unicode61 remove_diacritics 2', "
+    "prefix = '2 3')"
+)
+
+_TOKEN = re.compile(r"\\[A-Za-z@]+\*?|\\.|%[^\n]*|[{}\[\]$&~^_#]|[^\\%{}\[\]$&~^_#]+", re.DOTALL)
+_ENVIRONMENT = re.compile(r"\\(begin|end)\s*\{([^}]*)\}")
+_BEGIN_DOCUMENT = re.compile(r"\\begin\s*\{document\}")
+_WORD = re.compile(r"\w+", re.UNICODE)
+_HTML_UNSAFE = str.maketrans({"<": " ", ">": " ", "&": " ", '"': " ", "'": " "})
+
+
+def _search_text(source: str):
+    """(body, commands) text of a LaTeX document for the index."""
+    body = []
+    commands = {}  # Ordered set
+
+    def add_command(name):
+        if name:
+            commands.setdefault(name, None)
+
+    match = _BEGIN_DOCUMENT.search(source)
+    if match is not None:
+        preamble, source = source[:match.start()], source[match.end():]
+        for token in _TOKEN.findall(preamble):
+            if token.startswith("%"):
+                continue
+            if token.startswith("\\"):
+                add_command(token[1:].rstrip("*"))
+            else:
+                for word in _WORD.findall(token):
+                    add_command(word)
+
+    def environment(m):
+        if m.group(1) == "begin":
+            add_command(m.group(2).strip().rstrip("*"))
+        return " "
+    source = _ENVIRONMENT.sub(environment, source)
+
+    in_math = False
+    for token in _TOKEN.findall(source):
+        first = token[0]
+        if first == "%":
+            continue
+        if first == "\\":
+            name = token[1:]
+            if name in ("(", "["):
+                in_math = True
+            elif name in (")", "]"):
+                in_math = False
+            elif name[:1].isalpha() or name[:1] == "@":
+                name = name.rstrip("*")
+                add_command(name)
+                if in_math:
+                    body.append(name)
+            body.append(" ")
+        elif first == "$":
+            in_math = not in_math
+            body.append(" ")
+        elif token in "{}[]&~^_#":
+            body.append(" ")
+        else:
+            body.append(token)
+
+    body_text = re.sub(r"\s+", " ", "".join(body).translate(_HTML_UNSAFE)).strip()
+    return body_text, " ".join(commands).translate(_HTML_UNSAFE)
+
+
+def _fill_search_index(bind) -> None:
+    """Index every existing note (bodies are plain TEXT at this revision)."""
+    rows = bind.exec_driver_sql("SELECT id, user_id, title, latex_content FROM notes").fetchall()
+    for note_id, user_id, title, latex_content in rows:
+        body, commands = _search_text(latex_content or "")
+        bind.exec_driver_sql(
+            "INSERT INTO notes_fts (rowid, owner, title, body, commands) VALUES (?, ?, ?, ?, ?)",
+            (note_id, f"u{user_id}", title.translate(_HTML_UNSAFE), body, commands),
+        )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "compile_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("note_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["note_id"], ["notes.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_compile_jobs_id", "compile_jobs", ["id"])
+    op.create_index("ix_compile_jobs_note_id", "compile_jobs", ["note_id"])
+    op.create_index("ix_compile_jobs_status", "compile_jobs", ["status"])
+
+    op.create_table(
+        "artifacts",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("size_bytes", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("last_used_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    op.create_index("ix_artifacts_last_used_at", "artifacts", ["last_used_at"])
+
+    with op.batch_alter_table("notes") as batch:
+        batch.add_column(sa.Column("artifact_key", sa.String(length=64), nullable=True))
+    op.create_index("ix_notes_artifact_key", "notes", ["artifact_key"])
+    op.create_index("ix_notes_user_updated_id", "notes", ["user_id", "updated_at", "id"])
+
+    # Full-text search index - SQLite FTS5 only, filled from existing notes
+    bind = op.get_bind()
+    if bind.dialect.name == "sqlite":
+        op.execute(CREATE_INDEX_SQL)
+        if not context.is_offline_mode():  # --sql just prints the DDL
+            _fill_search_index(bind)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("DROP TABLE IF EXISTS notes_fts")
+    op.drop_index("ix_notes_user_updated_id", table_name="notes")
+    op.drop_index("ix_notes_artifact_key", table_name="notes")
+    with op.batch_alter_table("notes") as batch:
+        batch.drop_column("artifact_key")
+    op.drop_index("ix_artifacts_last_used_at", table_name="artifacts")
+    op.drop_table("artifacts")
+    op.drop_index("ix_compile_jobs_status", table_name="compile_jobs")
+    op.drop_index("ix_compile_jobs_note_id", table_name="compile_jobs")
+    op.drop_index("ix_compile_jobs_id", table_name="compile_jobs")
+    op.drop_table("compile_jobs")
@@ -0,0 +1,28 @@
+"""Point pdf_url at the /notes/{id}/pdf download endpoint
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Compiled notes used to carry /files/<key>.pdf, which nothing served
+    op.execute(
+        "UPDATE notes SET pdf_url = '/notes/' || CAST(id AS VARCHAR) || '/pdf' "
+        "WHERE artifact_key IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "UPDATE notes SET pdf_url = '/files/' || artifact_key || '.pdf' "
+        "WHERE artifact_key IS NOT NULL"
+    )
@@ -0,0 +1,60 @@
+"""Note revision history
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+import zlib
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("notes") as batch:
+        batch.add_column(sa.Column("revision", sa.Integer(), nullable=False, server_default="1"))
+
+    revisions = op.create_table(
+        "note_revisions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("note_id", sa.Integer(), nullable=False),
+        sa.Column("revision", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("content_length", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(["note_id"], ["notes.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("note_id", "revision", name="uq_note_revisions_note_revision"),
+    )
+
+    # Existing notes start their history with a snapshot of what they hold now
+    if context.is_offline_mode():
+        return
+    result = op.get_bind().execute(sa.text("SELECT id, latex_content FROM notes ORDER BY id"))
+    while True:
+        notes = result.fetchmany(500)  # Batches - never the whole table in memory
+        if not notes:
+            break
+        op.bulk_insert(revisions, [
+            {
+                "note_id": note_id,
+                "revision": 1,
+                "kind": "snapshot",
+                "data": zlib.compress(latex_content.encode("utf-8"), 6),
+                "content_length": len(latex_content),
+            }
+            for note_id, latex_content in notes
+        ])
+
+
+def downgrade() -> None:
+    op.drop_table("note_revisions")
+    with op.batch_alter_table("notes") as batch:
+        batch.drop_column("revision")
@@ -0,0 +1,94 @@
+"""Store note bodies compressed and track their size
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+import zlib
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+BATCH = 500
+
+# Frozen copy of the stored body format (see CompressedText in
+# app/models/note.py): one marker byte, then UTF-8 text as-is or zlib'd.
+# The app's compression settings don't matter here - any later save
+# re-encodes the body with them
+_PLAIN = b"\x00"
+_COMPRESSED = b"\x01"
+MIN_COMPRESSED_BYTES = 1024
+COMPRESSION_LEVEL = 6
+
+
+def compress_content(text: str) -> bytes:
+    raw = text.encode("utf-8")
+    if len(raw) >= MIN_COMPRESSED_BYTES:
+        packed = zlib.compress(raw, COMPRESSION_LEVEL)
+        if len(packed) < len(raw):
+            return _COMPRESSED + packed
+    return _PLAIN + raw
+
+
+def decompress_content(value):
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == _COMPRESSED:
+        return zlib.decompress(value[1:]).decode("utf-8")
+    if value[:1] == _PLAIN:
+        return value[1:].decode("utf-8")
+    return value.decode("utf-8")
+
+
+def _rewrite_bodies(encode) -> None:
+    """Re-encode every note body in batches of BATCH rows, by id."""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, latex_content FROM notes WHERE id > :last ORDER BY id LIMIT :batch"),
+            {"last": last_id, "batch": BATCH},
+        ).fetchall()
+        if not rows:
+            return
+        for note_id, latex_content in rows:
+            text = decompress_content(latex_content)
+            bind.execute(
+                sa.text("UPDATE notes SET latex_content = :body, content_size = :size WHERE id = :id"),
+                {"body": encode(text), "size": len(text.encode("utf-8")), "id": note_id},
+            )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("notes") as batch:
+        batch.add_column(sa.Column("content_size", sa.Integer(), nullable=False, server_default="0"))
+
+    if op.get_bind().dialect.name != "sqlite":
+        # PostgreSQL keeps TEXT (TOAST compresses it) - only the size is new
+        op.execute("UPDATE notes SET content_size = octet_length(latex_content)")
+        return
+
+    with op.batch_alter_table("notes") as batch:
+        batch.alter_column("latex_content", type_=sa.LargeBinary(), existing_nullable=False)
+    if not context.is_offline_mode():
+        _rewrite_bodies(compress_content)
+        with op.get_context().autocommit_block():
+            op.execute("VACUUM")  # Hand the freed pages back to the filesystem
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        if not context.is_offline_mode():
+            _rewrite_bodies(lambda text: text)
+        with op.batch_alter_table("notes") as batch:
+            batch.alter_column("latex_content", type_=sa.Text(), existing_nullable=False)
+    with op.batch_alter_table("notes") as batch:
+        batch.drop_column("content_size")
@@ -0,0 +1,36 @@
+"""Multi-file notes: the note_files table
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Same storage as notes.latex_content: compressed BLOB on SQLite, TEXT elsewhere
+    content_type = sa.LargeBinary() if op.get_bind().dialect.name == "sqlite" else sa.Text()
+    op.create_table(
+        "note_files",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("note_id", sa.Integer(), nullable=False),
+        sa.Column("path", sa.String(length=255), nullable=False),
+        sa.Column("content", content_type, nullable=False),
+        sa.Column("content_size", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(["note_id"], ["notes.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("note_id", "path", name="uq_note_files_note_path"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("note_files")
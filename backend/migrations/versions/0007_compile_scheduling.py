@@ -0,0 +1,32 @@
+"""Compile scheduling: job owner, priority and debounce time
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("compile_jobs") as batch:
+        batch.add_column(sa.Column("user_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("priority", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("not_before", sa.DateTime(timezone=True), nullable=True))
+    op.execute(
+        "UPDATE compile_jobs SET user_id = "
+        "(SELECT notes.user_id FROM notes WHERE notes.id = compile_jobs.note_id)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("compile_jobs") as batch:
+        batch.drop_column("not_before")
+        batch.drop_column("priority")
+        batch.drop_column("user_id")
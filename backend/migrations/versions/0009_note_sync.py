@@ -0,0 +1,42 @@
+"""HTTP caching and sync: notes.changed_at and the note_tombstones table
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("notes") as batch:
+        batch.add_column(sa.Column("changed_at", sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE notes SET changed_at = updated_at")
+    with op.batch_alter_table("notes") as batch:
+        batch.alter_column("changed_at", existing_type=sa.DateTime(timezone=True), nullable=False)
+        batch.create_index("ix_notes_user_changed_id", ["user_id", "changed_at", "id"])
+
+    op.create_table(
+        "note_tombstones",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("note_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_note_tombstones_user_deleted", "note_tombstones", ["user_id", "deleted_at"])
+    op.create_index("ix_note_tombstones_deleted_at", "note_tombstones", ["deleted_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_note_tombstones_deleted_at", table_name="note_tombstones")
+    op.drop_index("ix_note_tombstones_user_deleted", table_name="note_tombstones")
+    op.drop_table("note_tombstones")
+    with op.batch_alter_table("notes") as batch:
+        batch.drop_index("ix_notes_user_changed_id")
+        batch.drop_column("changed_at")
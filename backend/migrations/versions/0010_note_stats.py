@@ -0,0 +1,307 @@
+"""Note statistics: word/math counts, document class, packages and their index
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+import re
+import zlib
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+BATCH = 500
+
+# --- Frozen copy of the statistics part of app/services/latex_analyzer.py ---
+# A migration must keep computing what it computed when it was written, so
+# this is the analyzer's scanner as of this revision, cut down to what
+# document_stats() reports (no error positions, includes or bibliographies).
+# Notes get the current analyzer's numbers again the next time they are saved
+
+MAX_NAME_LENGTH = 100
+MAX_PACKAGES = 100
+
+_ARGUMENT_COMMANDS = {
+    "begin", "end", "documentclass", "usepackage", "RequirePackage",
+    "input", "include", "includeonly", "label", "ref", "eqref", "pageref",
+    "cite", "citep", "citet", "bibliography", "bibliographystyle",
+    "addbibresource", "includegraphics", "url",
+}
+_DISPLAY_MATH_ENVIRONMENTS = {
+    "equation", "equation*", "align", "align*", "gather", "gather*",
+    "multline", "multline*", "flalign", "flalign*", "eqnarray", "eqnarray*",
+    "displaymath", "math",
+}
+_VERBATIM_ENVIRONMENTS = {"verbatim", "verbatim*", "Verbatim", "lstlisting", "minted", "comment"}
+
+_TOKEN = re.compile(
+    r"\\(?P<word>[A-Za-z@]+\*?)"
+    r"|\\(?P<symbol>.)"
+    r"|(?P<backslash>\\)$"
+    r"|(?P<comment>%)"
+    r"|(?P<dollars>\$\$?)"
+    r"|(?P<open>\{)|(?P<close>\})"
+    r"|(?P<lbracket>\[)|(?P<rbracket>\])"
+    r"|(?P<text>[^\\%${}\[\]]+)"
+)
+_SPECIAL = re.compile(r"[\\%${}\[\]]")
+_WORD = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*")
+
+
+class _StatsScanner:
+    """Word/math counts, document class and packages of one document."""
+
+    def __init__(self):
+        self.document_class = None
+        self.packages = []
+        self.math = 0
+        self.words = 0
+        self._environments = []
+        self._math = None               # Delimiter of the open math, if any
+        self._math_environments = 0
+        self._raw_environment = None
+        self._verb_delimiter = None
+        self._argument = None
+        self._begin_document = False
+        self._end_document = False
+
+    def scan(self, source: str) -> None:
+        for line in source.split("\n"):
+            self._line(line.rstrip("\r"))
+
+    def _line(self, text: str) -> None:
+        if (_SPECIAL.search(text) is None and self._raw_environment is None
+                and self._verb_delimiter is None and self._argument is None):
+            self._token("text", text)
+            return
+        position, length = 0, len(text)
+        while position < length:
+            if self._raw_environment is not None:
+                marker = f"\\end{{{self._raw_environment}}}"
+                found = text.find(marker, position)
+                if found < 0:
+                    return
+                self._close_environment(self._raw_environment)
+                self._raw_environment = None
+                position = found + len(marker)
+                continue
+            if self._verb_delimiter is not None:
+                found = text.find(self._verb_delimiter, position)
+                self._verb_delimiter = None  # \verb can't span lines
+                if found < 0:
+                    return
+                position = found + 1
+                continue
+            match = _TOKEN.match(text, position)
+            position = match.end()
+            kind = match.lastgroup
+            if kind == "comment":
+                return
+            if kind == "word" and match.group("word").rstrip("*") == "verb":
+                if position < length:
+                    self._verb_delimiter = text[position]
+                    position += 1
+                continue
+            self._token(kind, match.group(kind))
+
+    def _token(self, kind: str, value: str) -> None:
+        if self._argument is not None and self._argument_token(self._argument, kind, value):
+            return
+        if kind == "word":
+            if value in _ARGUMENT_COMMANDS:
+                self._argument = {"command": value, "depth": 0, "optional": 0, "chars": []}
+        elif kind == "symbol":
+            if value in "([" and self._math is None:
+                self._open_math("\\" + value)
+            elif value in ")]" and self._math == ("\\(" if value == ")" else "\\["):
+                self._math = None
+        elif kind == "dollars":
+            if self._math == value:
+                self._math = None
+            elif self._math is None:
+                self._open_math(value)
+            elif value == "$$" and self._math == "$":
+                self._open_math("$")  # "$a$$b$" is two inline formulas
+        elif kind == "text":
+            if self._math is None and self._math_environments == 0 and self._counting_words():
+                self.words += len(_WORD.findall(value))
+
+    def _argument_token(self, argument: dict, kind: str, value: str) -> bool:
+        if argument["depth"] == 0:
+            if kind == "text" and not value.strip():
+                return True
+            if kind == "lbracket" or argument["optional"]:
+                if kind == "lbracket":
+                    argument["optional"] += 1
+                elif kind == "rbracket":
+                    argument["optional"] -= 1
+                return True
+            if kind == "open":
+                argument["depth"] = 1
+                return True
+            self._argument = None
+            # Plain TeX "\input chapter1" swallows the name
+            return argument["command"] in ("input", "include") and kind == "text"
+        if kind == "open":
+            argument["depth"] += 1
+        elif kind == "close":
+            argument["depth"] -= 1
+            if argument["depth"] == 0:
+                self._argument = None
+                self._finish_argument(argument["command"], "".join(argument["chars"]).strip())
+                return True
+        argument["chars"].append(value if kind != "word" else "\\" + value)
+        return True
+
+    def _finish_argument(self, command: str, value: str) -> None:
+        if command == "begin":
+            self._environments.append(value)
+            if value == "document":
+                self._begin_document = True
+            elif value in _DISPLAY_MATH_ENVIRONMENTS:
+                self.math += 1
+                self._math_environments += 1
+            elif value in _VERBATIM_ENVIRONMENTS:
+                self._raw_environment = value
+        elif command == "end":
+            self._close_environment(value)
+        elif command == "documentclass":
+            self.document_class = value
+        elif command in ("usepackage", "RequirePackage"):
+            for name in value.split(","):
+                name = name.strip()
+                if name and name not in self.packages:
+                    self.packages.append(name)
+
+    def _close_environment(self, name: str) -> None:
+        if name not in self._environments:
+            return
+        while True:
+            inner = self._environments.pop()
+            if inner in _DISPLAY_MATH_ENVIRONMENTS:
+                self._math_environments -= 1
+            if inner == name:
+                break
+        if name == "document":
+            self._end_document = True
+
+    def _open_math(self, delimiter: str) -> None:
+        self._math = delimiter
+        self.math += 1
+
+    def _counting_words(self) -> bool:
+        if self.document_class is None:
+            return True
+        return self._begin_document and not self._end_document
+
+
+def document_stats(source: str) -> dict:
+    scanner = _StatsScanner()
+    scanner.scan(source)
+    packages = [name[:MAX_NAME_LENGTH] for name in scanner.packages[:MAX_PACKAGES]]
+    return {
+        "word_count": scanner.words,
+        "math_count": scanner.math,
+        "document_class": (scanner.document_class or "")[:MAX_NAME_LENGTH] or None,
+        "packages": list(dict.fromkeys(packages)),
+    }
+
+
+def decompress_content(value):
+    """Stored body -> text (marker byte + UTF-8 or zlib, see migration 0005)."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] == b"\x01":
+        return zlib.decompress(value[1:]).decode("utf-8")
+    if value[:1] == b"\x00":
+        return value[1:].decode("utf-8")
+    return value.decode("utf-8")
+
+_notes = sa.table(
+    "notes",
+    sa.column("id", sa.Integer),
+    sa.column("word_count", sa.Integer),
+    sa.column("math_count", sa.Integer),
+    sa.column("document_class", sa.String),
+    sa.column("packages", sa.JSON),
+)
+_note_packages = sa.table(
+    "note_packages",
+    sa.column("note_id", sa.Integer),
+    sa.column("package", sa.String),
+    sa.column("user_id", sa.Integer),
+)
+
+
+def _compute_stats() -> None:
+    """Analyze every existing note body, BATCH rows at a time, by id."""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, user_id, latex_content FROM notes WHERE id > :last ORDER BY id LIMIT :batch"),
+            {"last": last_id, "batch": BATCH},
+        ).fetchall()
+        if not rows:
+            return
+        updates, packages = [], []
+        for note_id, user_id, latex_content in rows:
+            stats = document_stats(decompress_content(latex_content) or "")
+            updates.append({"note_id": note_id, **stats})
+            packages.extend({"note_id": note_id, "package": name, "user_id": user_id} for name in stats["packages"])
+        bind.execute(
+            _notes.update().where(_notes.c.id == sa.bindparam("note_id")).values(
+                word_count=sa.bindparam("word_count"),
+                math_count=sa.bindparam("math_count"),
+                document_class=sa.bindparam("document_class"),
+                packages=sa.bindparam("packages", type_=sa.JSON),
+            ),
+            updates,
+        )
+        if packages:
+            bind.execute(_note_packages.insert(), packages)
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("notes") as batch:
+        batch.add_column(sa.Column("word_count", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("math_count", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("document_class", sa.String(100), nullable=True))
+        batch.add_column(sa.Column("packages", sa.JSON(), nullable=False, server_default="[]"))
+        batch.create_index("ix_notes_user_size_id", ["user_id", "content_size", "id"])
+        batch.create_index("ix_notes_user_words_id", ["user_id", "word_count", "id"])
+        batch.create_index("ix_notes_user_math_id", ["user_id", "math_count", "id"])
+        batch.create_index("ix_notes_user_class_updated_id", ["user_id", "document_class", "updated_at", "id"])
+
+    op.create_table(
+        "note_packages",
+        sa.Column("note_id", sa.Integer(), sa.ForeignKey("notes.id"), primary_key=True),
+        sa.Column("package", sa.String(100), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+    )
+    op.create_index("ix_note_packages_user_package", "note_packages", ["user_id", "package", "note_id"])
+
+    if not context.is_offline_mode():
+        _compute_stats()
+
+
+def downgrade() -> None:
+    op.drop_index("ix_note_packages_user_package", table_name="note_packages")
+    op.drop_table("note_packages")
+    with op.batch_alter_table("notes") as batch:
+        batch.drop_index("ix_notes_user_class_updated_id")
+        batch.drop_index("ix_notes_user_math_id")
+        batch.drop_index("ix_notes_user_words_id")
+        batch.drop_index("ix_notes_user_size_id")
+        batch.drop_column("packages")
+        batch.drop_column("document_class")
+        batch.drop_column("math_count")
+        batch.drop_column("word_count")
@@ -92,7 +92,7 @@ implies $c_1 = c_2 = \\cdots = c_n = 0$.
     print("\n📚 Test 6: Get All Notes")
     response = requests.get(f"{BASE_URL}/notes/", headers=headers)
     print(f"Status: {response.status_code}")
-    notes = response.json()
+    notes = response.json()["items"]  # One page; see next_cursor for more
     print(f"Found {len(notes)} notes:")
     for note in notes:
         print(f"  - {note['title']} (ID: {note['id']}, Status: {note['status']})")